@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# python 3.6+
+
+# Micro-benchmarks over the expressions found in test.py.
+
+import ast
+import gc
+import getopt
+import re
+import sys
+import time
+import tracemalloc
+
+from lalr1 import Token
+from sast import AST
+import sparser
+import sym
+
+_HEAVY_EXPRS = ['integrate (x**2 sin x, x)', 'simplify (sin(x)**2 + cos(x)**2 + (x**2 - 1) / (x - 1))', 'series (tan x, x, 0, 8)',
+		r'\int_0^\infty e^{-x**2} dx', 'factor (x**6 - 1)', 'solve (x**3 - 2x + 1, x)'] # repeated evaluations which benefit from SymPy cache
+
+_rec_TEST_EXPR = re.compile (r'''\bp \((r?'(?:\\.|[^'\\])*'|r?"(?:\\.|[^"\\])*")\)''')
+
+#...............................................................................................
+def corpus (fnm = 'test.py'):
+	return [ast.literal_eval (s) for s in _rec_TEST_EXPR.findall (open (fnm, encoding = 'utf8').read ())]
+
+def timeit (func, texts, repeat): # best of repeat runs of func over all texts, process time in seconds
+	best = None
+
+	for _ in range (repeat):
+		t0 = time.process_time ()
+
+		for text in texts:
+			func (text)
+
+		t    = time.process_time () - t0
+		best = t if best is None else min (best, t)
+
+	return best
+
+def tokenize_ref (parser, text): # single combined regex with full groups () tuple per token, as tokenize () was before first char dispatch
+	tokens = []
+	end    = len (text)
+	pos    = 0
+
+	while pos < end:
+		m = parser.tokrec.match (text, pos)
+
+		if m is None:
+			tokens.append (Token ('$err', text [pos], pos))
+
+			break
+
+		else:
+			if m.lastgroup != 'ignore':
+				tok  = m.lastgroup
+				s, e = parser.tokgrps [tok]
+				grps = m.groups () [s : e]
+
+				tokens.append (Token (tok, grps [0], pos, grps [1:]))
+
+			pos += len (m.group (0))
+
+	tokens.append (Token ('$end', '', pos))
+
+	return tokens
+
+#...............................................................................................
+def bench_tokenize (parser, texts, repeat):
+	for text in texts:
+		new = parser.tokenize (text)
+		ref = tokenize_ref (parser, text)
+
+		if [(t, t.text, t.pos, t.grp) for t in new] != [(t, t.text, t.pos, t.grp) for t in ref]:
+			raise RuntimeError (f'tokenize mismatch for {text!r}')
+
+	ntoks = sum (len (parser.tokenize (text)) for text in texts)
+	tref  = timeit (lambda text: tokenize_ref (parser, text), texts, repeat)
+	tnew  = timeit (parser.tokenize, texts, repeat)
+
+	print (f'tokenize: {len (texts)} expressions, {ntoks} tokens, best of {repeat}')
+	print (f'  before: {tref:.3f}s, {ntoks / tref:,.0f} tokens/sec')
+	print (f'  after:  {tnew:.3f}s, {ntoks / tnew:,.0f} tokens/sec ({tref / tnew:.2f}x)')
+
+def bench_tables (parser, texts, repeat):
+	tref = timeit (lambda _: parser.tables_dense (parser._PARSER_TABLES), [None], repeat)
+	tnew = timeit (lambda _: parser.tables_load (), [None], repeat)
+
+	print (f'tables: best of {repeat}{"" if parser.tables_load () else ", NO BINARY TABLES FOUND"}')
+	print (f'  _PARSER_TABLES: {tref * 1000:.1f}ms')
+	print (f'  binary:         {tnew * 1000:.1f}ms ({tref / tnew:.1f}x)')
+
+def bench_parse (parser, texts, repeat):
+	def parse (text):
+		try:
+			parser.parse (text)
+		except SyntaxError:
+			pass
+
+	ntoks = sum (len (parser.tokenize (text)) for text in texts)
+	t     = timeit (parse, texts, repeat)
+
+	print (f'parse: {len (texts)} expressions, {ntoks} tokens, best of {repeat}')
+	print (f'  {t:.3f}s, {len (texts) / t:,.0f} expressions/sec, {ntoks / t:,.0f} tokens/sec')
+
+def bench_clearcache (parser, texts, repeat): # texts ignored, uses _HEAVY_EXPRS
+	asts = [parser.parse (text) [0] for text in _HEAVY_EXPRS]
+	ts   = {}
+
+	for mode in ('always', 'annotated'):
+		sym.set_clear_cache (mode)
+		sym.ast2spt (asts [0]) # clear anything left over from previous mode
+
+		ts [mode] = timeit (sym.ast2spt, asts, repeat)
+
+	sym.set_clear_cache ('annotated')
+
+	print (f'sympy cache clearing: {len (asts)} heavy expressions, best of {repeat}')
+	print (f'  always:    {ts ["always"]:.3f}s')
+	print (f'  annotated: {ts ["annotated"]:.3f}s ({ts ["always"] / ts ["annotated"]:.2f}x)')
+
+def bench_intern (parser, texts, repeat):
+	def nodes (asts): # number of distinct AST objects in trees
+		seen  = set ()
+		stack = list (asts)
+
+		while stack:
+			ast = stack.pop ()
+
+			if isinstance (ast, AST) and id (ast) not in seen:
+				seen.add (id (ast))
+				stack.extend (ast)
+
+		return len (seen)
+
+	asts = [ast for ast in (parser.parse (text) [0] for text in texts) if ast is not None]
+	t    = timeit (lambda _: [AST.intern (ast) for ast in asts], [None], 1)
+	iast = [AST.intern (ast) for ast in asts]
+
+	print (f'intern: {len (asts)} parsed expressions')
+	print (f'  nodes: {nodes (asts)} -> {nodes (iast)}, {len (AST._INTERNED)} interned, {t:.3f}s to intern')
+
+	AST.intern_clear ()
+
+def bench_memory (parser, texts, repeat): # repeat ignored, memory retained by parsed and rendered trees
+	def nodes (asts): # distinct AST objects in trees and how many of them carry an instance __dict__
+		seen  = {}
+		stack = list (asts)
+
+		while stack:
+			ast = stack.pop ()
+
+			if isinstance (ast, AST) and id (ast) not in seen:
+				seen [id (ast)] = any (r.__class__ is dict for r in gc.get_referents (ast)) # get_referents () does not create __dict__ if not already present
+				stack.extend (ast)
+
+		return len (seen), sum (seen.values ())
+
+	def render (ast):
+		for func in (sym.ast2tex, sym.ast2nat, sym.ast2py):
+			try:
+				func (ast)
+			except Exception:
+				pass
+
+	for text in texts: # warm up anything cached globally by parsing or rendering itself
+		render (parser.parse (text) [0])
+
+	tracemalloc.start ()
+
+	t0   = tracemalloc.get_traced_memory () [0]
+	asts = [ast for ast in (parser.parse (text) [0] for text in texts) if ast is not None]
+	t1   = tracemalloc.get_traced_memory () [0]
+
+	for ast in asts:
+		render (ast)
+
+	t2   = tracemalloc.get_traced_memory () [0]
+
+	tracemalloc.stop ()
+
+	n, nd = nodes (asts)
+
+	print (f'memory: {len (asts)} parsed expressions, {n} nodes, {nd} with instance __dict__')
+	print (f'  parsed:   {(t1 - t0) / 1024:,.0f}KB')
+	print (f'  rendered: {(t2 - t1) / 1024:,.0f}KB more for cached attributes')
+
+def bench_deep (parser, texts, repeat): # texts ignored, synthetic deep and wide expressions
+	def passes (text):
+		ast = parser.parse (text) [0]
+
+		ast.free_vars
+		AST.apply_vars (ast, {'x': AST ('#', '2')})
+
+		for func in (sym.ast2tex, sym.ast2nat, sym.ast2py):
+			func (ast)
+
+	exprs = [
+		('sum',   lambda n: ' + '.join (f'x{i}' for i in range (n))),
+		('mul',   lambda n: ' * '.join (f'(x{i} + 1)' for i in range (n))),
+		('paren', lambda n: '(' * n + 'x' + ')' * n),
+		('pow',   lambda n: '^'.join (['x'] * n)),
+		('func',  lambda n: 'sin (' * n + 'x' + ')' * n),
+	]
+
+	print (f'deep: parse, free_vars, apply_vars, render tex/nat/py, best of {repeat}')
+
+	for n in (100, 1000, 5000):
+		print (f'  {n:>5}:', ', '.join (f'{name} {timeit (passes, [func (n)], repeat):.3f}s' for name, func in exprs))
+
+def bench_scopes (parser, texts, repeat): # texts ignored, apply_vars () with many user vars and nested lambdas
+	sparser.set_sp_user_funcs ({'f', 'g', 'h'})
+
+	vars  = {f'v{i}': AST ('+', (('@', 'x'), ('#', str (i)))) for i in range (500)}
+	vars.update ({
+		'f': parser.parse ('lambda x: x**2 + v1') [0],
+		'g': parser.parse ('lambda x, y: f (x) + f (y) + v2') [0],
+		'h': parser.parse ('lambda x: g (x, f (x)) * g (f (x), x)') [0],
+	})
+
+	exprs = [parser.parse (text) [0] for text in (
+		'h (h (h (h (v3))))',
+		'\\sum_{n=0}^{10} h (n) + \\lim_{x \\to 0} g (x, v4)',
+		'lambda z: h (z) + \\int_0^1 g (t, v5) dt',
+		'%%(f (v6)) + f (v7)',
+	)]
+
+	sparser.set_sp_user_funcs (set ())
+
+	t = timeit (lambda ast: AST.apply_vars (ast, vars), exprs, repeat)
+
+	print (f'scopes: apply_vars () over {len (exprs)} lambda expressions with {len (vars)} user vars, best of {repeat}')
+	print (f'  {t * 1000:.1f}ms')
+
+def bench_render (parser, texts, repeat):
+	def separate (ast):
+		for func in (sym.ast2tex, sym.ast2nat, sym.ast2py):
+			func (ast, retxlat = True)
+
+	def combined (ast):
+		sym.ast2all (ast, retxlat = True)
+
+	asts = []
+
+	for text in texts:
+		ast = parser.parse (text) [0]
+
+		try:
+			if ast is not None:
+				separate (ast)
+				asts.append (ast)
+		except Exception:
+			pass
+
+	ts = {func.__name__: timeit (func, asts, repeat) for func in (separate, combined)}
+
+	sym.set_render_cache (len (asts))
+
+	ts ['cached'] = timeit (combined, asts, repeat) # all but first run are repeat renderings as vars panel does
+
+	sym.set_render_cache (0)
+
+	print (f'render: {len (asts)} parsed expressions to tex/nat/py, best of {repeat}')
+	print (f'  separate: {ts ["separate"]:.3f}s')
+	print (f'  ast2all:  {ts ["combined"]:.3f}s ({ts ["separate"] / ts ["combined"]:.2f}x)')
+	print (f'  cached:   {ts ["cached"]:.3f}s ({ts ["separate"] / ts ["cached"]:.2f}x)')
+
+_BENCHES = {
+	'tokenize':   bench_tokenize,
+	'tables':     bench_tables,
+	'parse':      bench_parse,
+	'clearcache': bench_clearcache,
+	'intern':     bench_intern,
+	'memory':     bench_memory,
+	'deep':       bench_deep,
+	'scopes':     bench_scopes,
+	'render':     bench_render,
+}
+
+#...............................................................................................
+def cmdline ():
+	repeat     = 5
+	fnm        = 'test.py'
+	opts, argv = getopt.getopt (sys.argv [1:], 'n:f:', ['repeat=', 'file='])
+
+	for opt, arg in opts:
+		if opt in ('-n', '--repeat'):
+			repeat = int (arg)
+		elif opt in ('-f', '--file'):
+			fnm = arg
+
+	parser = sparser.Parser ()
+	texts  = corpus (fnm)
+
+	for name in (argv or _BENCHES):
+		_BENCHES [name] (parser, texts, repeat)
+
+if __name__ == '__main__':
+	cmdline ()
@@ -1,32 +1,220 @@
 # Parser for PLY generated LALR1 grammar.
 
+from array import array
+import os
 import re
+import sys
+import time
 import types
 
+try:
+	from re import _parser as _sre_parse
+except ImportError: # python < 3.11
+	import sre_parse as _sre_parse
+
+#...............................................................................................
+_TOKFIRST_CATS = {getattr (_sre_parse, f'CATEGORY_{cat}'): re.compile (pat) for cat, pat in \
+		(('DIGIT', r'\d'), ('NOT_DIGIT', r'\D'), ('WORD', r'\w'), ('NOT_WORD', r'\W'), ('SPACE', r'\s'), ('NOT_SPACE', r'\S'))}
+_TOKFIRST_ASCII = frozenset (chr (c) for c in range (128))
+
+def _tokfirst (items): # (set of ASCII chars which can start a match of parsed regex items, nullable), superset of actual chars, assertions ignored
+	first = set ()
+
+	for op, av in items:
+		if op is _sre_parse.LITERAL:
+			return first | {chr (av)} if av < 128 else first, False
+
+		elif op is _sre_parse.IN:
+			chars = set ()
+			neg   = False
+
+			for iop, iav in av:
+				if iop is _sre_parse.NEGATE:
+					neg = True
+				elif iop is _sre_parse.LITERAL:
+					chars.add (chr (iav))
+				elif iop is _sre_parse.RANGE:
+					chars.update (chr (c) for c in range (iav [0], min (iav [1] + 1, 128)))
+				elif iop is _sre_parse.CATEGORY and iav in _TOKFIRST_CATS:
+					chars.update (c for c in _TOKFIRST_ASCII if _TOKFIRST_CATS [iav].match (c))
+				else:
+					return _TOKFIRST_ASCII, False
+
+			return first | (_TOKFIRST_ASCII - chars if neg else chars & _TOKFIRST_ASCII), False
+
+		elif op is _sre_parse.SUBPATTERN:
+			if av [1] & re.IGNORECASE:
+				return _TOKFIRST_ASCII, False
+
+			f, nullable = _tokfirst (av [-1])
+
+		elif op is _sre_parse.BRANCH:
+			f, nullable = set (), False
+
+			for alt in av [1]:
+				af, anullable  = _tokfirst (alt)
+				f             |= af
+				nullable       = nullable or anullable
+
+		elif op in (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT):
+			f, nullable = _tokfirst (av [2])
+			nullable    = nullable or not av [0]
+
+		elif op in (_sre_parse.ASSERT, _sre_parse.ASSERT_NOT, _sre_parse.AT):
+			continue # zero width, only restricts match so safe to ignore
+
+		else: # ANY, NOT_LITERAL, GROUPREF, etc...
+			return _TOKFIRST_ASCII, False
+
+		first |= f
+
+		if not nullable:
+			return first, False
+
+	return first, True
+
+def _tokreinfo (pats, tids): # (compiled alternation of token patterns, [(token or None for ignore, terminal id, group idx, (subgroup idx, ...)) or None, ...] - index by m.lastindex)
+	info  = [None]
+	tokre = []
+
+	for tok, pat in pats:
+		l   = re.compile (pat).groups
+		idx = len (info)
+
+		info.append ((None if tok == 'ignore' else tok, tids.get (tok, len (tids)), idx, tuple (range (idx + 1, idx + 1 + l))))
+		info.extend ([None] * l)
+		tokre.append (f'(?P<{tok}>{pat})')
+
+	return (re.compile ('|'.join (tokre)) if tokre else re.compile ('(?!)')), info
+
+class _TokDispatch (dict): # {ord (first char): (compiled re, info), ...} - per first char regexes for ASCII compiled on first use, full regex for everything else
+	__slots__ = ['tokpats', 'tids', 'full', 'firsts', 'recs']
+
+	def __init__ (self, tokpats, tokrec, tids):
+		self.tokpats = tokpats
+		self.tids    = tids
+		self.full    = (tokrec, None)
+		self.firsts  = None # [set of ASCII first chars, ...] - index by token
+		self.recs    = {} # {(token idx, ...): (compiled re, info), ...} - shared between chars with same candidate tokens
+
+	def __missing__ (self, c):
+		if c >= 128:
+			if self.full [1] is None:
+				self.full = (self.full [0], _tokreinfo (self.tokpats, self.tids) [1])
+
+			self [c] = self.full
+
+			return self.full
+
+		if self.firsts is None:
+			self.firsts = []
+
+			for tok, pat in self.tokpats:
+				p           = _sre_parse.parse (pat)
+				f, nullable = (_TOKFIRST_ASCII, True) if p.state.flags & re.IGNORECASE else _tokfirst (p)
+
+				self.firsts.append (_TOKFIRST_ASCII if nullable else f)
+
+		ch   = chr (c)
+		toks = tuple (i for i, f in enumerate (self.firsts) if ch in f)
+		rec  = self.recs.get (toks)
+
+		if rec is None:
+			rec = self.recs [toks] = _tokreinfo ([self.tokpats [i] for i in toks], self.tids)
+
+		self [c] = rec
+
+		return rec
+
 #...............................................................................................
 class Token (str):
-	__slots__ = ['text', 'pos', 'grp']
+	__slots__ = ['text', 'pos', 'grp', 'tid']
 
-	def __new__ (cls, str_, text = None, pos = None, grps = None):
+	def __new__ (cls, str_, text = None, pos = None, grps = None, tid = None): # tid = terminal id in parser tables, looked up by parser if None
 		self      = str.__new__ (cls, str_)
 		self.text = text or ''
 		self.pos  = pos
 		self.grp  = () if not grps else grps
+		self.tid  = tid
 
 		return self
 
-class State:
-	__slots__ = ['idx', 'sym', 'pos', 'red']
+class State: # parser stack is a persistent linked list of these with shared tails, a State is also the stack it tops
+	__slots__ = ['idx', 'sym', 'pos', 'red', 'prev']
 
-	def __init__ (self, idx, sym, pos = None, red = None): # idx = state index, sym = symbol (TOKEN or 'expression')[, pos = position in text, red = reduction]
+	def __init__ (self, idx, sym, pos = None, red = None, prev = None): # idx = state index, sym = symbol (TOKEN or 'expression')[, pos = position in text, red = reduction, prev = State below on stack]
 		self.idx  = idx
 		self.sym  = sym
 		self.pos  = sym.pos if pos is None else pos
 		self.red  = red
+		self.prev = prev
 
 	def __repr__ (self):
 		return f'({self.idx}, {self.sym}, {self.pos}{"" if self.red is None else f", {self.red}"})'
 
+	def __getitem__ (self, idx): # only negative indexes from top of stack, stack [-1] is self, stack [-2] is self.prev, etc...
+		st = self
+
+		for _ in range (-1 - idx):
+			st = st.prev
+
+			if st is None:
+				break
+
+		if st is None or idx >= 0:
+			raise IndexError ('stack index out of range')
+
+		return st
+
+	def __iter__ (self): # top of stack to bottom
+		st = self
+
+		while st is not None:
+			yield st
+
+			st = st.prev
+
+class Tokens: # immutable token list which shares original tokens and keeps tokens inserted before '$end' as overlay
+	__slots__ = ['toks', 'ins']
+
+	def __init__ (self, toks, ins = ()):
+		self.toks = toks # original tokens from tokenize (), not modified
+		self.ins  = ins # tuple of tokens inserted before final '$end'
+
+	def __len__ (self):
+		return len (self.toks) + len (self.ins)
+
+	def __getitem__ (self, idx):
+		if idx < 0:
+			idx += len (self)
+
+		end = len (self.toks) - 1
+
+		if idx < end:
+			return self.toks [idx]
+
+		idx -= end
+
+		if idx < len (self.ins):
+			return self.ins [idx]
+		elif idx == len (self.ins):
+			return self.toks [-1]
+
+		raise IndexError ('token index out of range')
+
+	def __iter__ (self):
+		yield from self.toks [:-1]
+		yield from self.ins
+		yield self.toks [-1]
+
+	def insert (self, idx, tok): # return new token list with tok inserted at idx, can only insert at or after position of original '$end'
+		idx -= len (self.toks) - 1
+
+		if idx < 0:
+			raise IndexError ('can only insert tokens at end')
+
+		return Tokens (self.toks, self.ins [:idx] + (tok,) + self.ins [idx:])
+
 class Conflict (tuple):
 	def __new__ (cls, conf, pos, tokidx, stidx, tokens, stack, estate):#, keep = False):
 		self      = tuple.__new__ (cls, (conf, pos, tokidx, stidx, tokens, stack, estate))
@@ -53,6 +241,15 @@ class Conflict (tuple):
 # 	def __init__ (self, red):
 # 		self.red = red
 
+class Session: # incremental parse session, pass the same object to successive parse () calls to reuse work up to the first changed token
+	__slots__ = ['src', 'tokens', 'ckpts', 'key']
+
+	def __init__ (self):
+		self.src    = None
+		self.tokens = None
+		self.ckpts  = [] # [(stidx, stack, confs, extra state, global state, pos), ...] - index by tokidx - 1, state first time tokidx was reached
+		self.key    = None # parser configuration at time of last parse, checkpoints invalid if this changes
+
 class PopConfs:
 	__slots__ = ['red']
 
@@ -68,6 +265,9 @@ class Reduce: # returned instantiated will try conflicted reduction before rule,
 
 Reduce.red = Reduce
 
+def _passthru (self, arg): # reference code for reduction functions which just return their single argument, these are not called during parse
+	return arg
+
 class LALR1:
 	_rec_SYMBOL_NUMTAIL     = re.compile (r'(.*[^_\d])_?(\d+)?') # symbol names in code have extra digits at end for uniqueness which are discarded
 
@@ -85,83 +285,150 @@ class LALR1:
 
 		self.tokre   = '|'.join (f'(?P<{tok}>{pat})' for tok, pat in tokpats)
 		self.tokrec  = re.compile (self.tokre)
+		self.tokdisp = _TokDispatch (tokpats, self.tokrec, self.tids)
 
-	def __init__ (self):
-		if isinstance (self._PARSER_TABLES, bytes):
+	@staticmethod
+	def tables_key (tables): # identifies source _PARSER_TABLES which binary tables were built from
+		import zlib
+		return zlib.crc32 (tables if isinstance (tables, bytes) else repr (tables).encode ('utf8'))
+
+	@staticmethod
+	def tables_dense (tables): # (symbols, rules, strules, nterm, nnterm, action, conflicts, goto) with dense array tables from _PARSER_TABLES
+		if isinstance (tables, bytes):
 			import ast, base64, zlib
-			symbols, rules, strules, terms, nterms = ast.literal_eval (zlib.decompress (base64.b64decode (self._PARSER_TABLES)).decode ('utf8'))
-		else:
-			symbols, rules, strules, terms, nterms = self._PARSER_TABLES
+			tables = ast.literal_eval (zlib.decompress (base64.b64decode (tables)).decode ('utf8'))
 
-		self.set_tokens (self.TOKENS)
+		symbols, rules, strules, terms, nterms = tables
 
-		self.rules   = [(0, (symbols [-1]))] + [(symbols [r [0]], tuple (symbols [s] for s in (r [1] if isinstance (r [1], tuple) else (r [1],)))) for r in rules]
-		self.strules = [[t if isinstance (t, tuple) else (t, 0) for t in (sr if isinstance (sr, list) else [sr])] for sr in strules]
-		states       = max (max (max (t [1]) for t in terms), max (max (t [1]) for t in nterms)) + 1
-		self.terms   = [{} for _ in range (states)] # [{'symbol': [+shift or -reduce, conflict +shift or -reduce or None], ...}] - index by state num then terminal
-		self.nterms  = [{} for _ in range (states)] # [{'symbol': +shift or -reduce, ...}] - index by state num then non-terminal
-		self.rfuncs  = [None] # first rule is always None
+		nterm     = len (terms) + 1 # symbols [:nterm - 1] are terminals and last column is always error for tokens not in grammar, non-terminals are symbols [-1 - i] where i indexes goto column
+		nnterm    = len (nterms)
+		states    = max (max (max (t [1]) for t in terms), max (max (t [1]) for t in nterms)) + 1
+		action    = array ('i', bytes (array ('i').itemsize * states * nterm)) # [+shift or -reduce or 0 for error, ...] - index by state * nterm + terminal
+		goto      = array ('i', bytes (array ('i').itemsize * states * nnterm)) # [+shift, ...] - index by state * nnterm + non-terminal
+		conflicts = {} # {state * nterm + terminal: conflict +shift or -reduce, ...}
 
 		for t in terms:
 			sym, sts, acts, confs = t if len (t) == 4 else t + (None,)
-			sym                   = symbols [sym]
 
 			for st, act in zip (sts, acts):
-				self.terms [st] [sym] = (act, None)
+				action [st * nterm + sym] = act
 
 			if confs:
 				for st, act in confs.items ():
-					self.terms [st] [sym] = (self.terms [st] [sym] [0], act)
+					conflicts [st * nterm + sym] = act
 
 		for sym, sts, acts in nterms:
 			for st, act in zip (sts, acts):
-				self.nterms [st] [symbols [sym]] = act
+				goto [st * nnterm - 1 - sym] = act
+
+		return symbols, rules, strules, nterm, nnterm, action, conflicts, goto
+
+	@staticmethod
+	def tables_dumps (tables): # binary tables for fast load, written by make_parser_tables.py
+		import pickle
+		return b'LALR1TB2' + pickle.dumps ((LALR1.tables_key (tables), LALR1.tables_dense (tables)), protocol = 4)
 
+	def tables_load (self): # dense tables from binary file next to module of parser class if present and built from current _PARSER_TABLES, else None
+		fnm = getattr (sys.modules.get (self.__class__.__module__), '__file__', None)
+
+		if not fnm:
+			return None
+
+		try:
+			with open (f'{os.path.splitext (fnm) [0]}.tab', 'rb') as f:
+				data = f.read ()
+
+		except OSError:
+			return None
+
+		if data [:8] != b'LALR1TB2':
+			return None
+
+		import pickle
+
+		try:
+			key, dense = pickle.loads (data [8:])
+		except Exception:
+			return None
+
+		return dense if key == self.tables_key (self._PARSER_TABLES) else None
+
+	def __init__ (self):
+		dense = self.tables_load () or self.tables_dense (self._PARSER_TABLES)
+
+		symbols, rules, strules, nterm, nnterm, action, conflicts, goto = dense
+
+		self.tids      = {sym: tid for tid, sym in enumerate (symbols [:nterm - 1])} # {'TOKEN': terminal id, ...} - tokens not present get error column len (tids)
+
+		self.set_tokens (self.TOKENS)
+
+		self.rules     = [(0, (symbols [-1]))] + [(symbols [r [0]], tuple (symbols [s] for s in (r [1] if isinstance (r [1], tuple) else (r [1],)))) for r in rules]
+		self.strules   = [[t if isinstance (t, tuple) else (t, 0) for t in (sr if isinstance (sr, list) else [sr])] for sr in strules]
+		self.nterm     = nterm # action row length
+		self.nnterm    = nnterm # goto row length
+		self.action    = action # [+shift or -reduce or 0 for error, ...] - index by state * nterm + terminal id
+		self.conflicts = conflicts # {state * nterm + terminal id: conflict +shift or -reduce, ...}
+		self.goto      = goto # [+shift, ...] - index by state * nnterm + goto column
+
+		if '_rplans' not in self.__class__.__dict__: # reduction plans depend only on class so are built once
+			self.__class__._rplans = self._reduction_plans (rules)
+
+		self.rplans = self._rplans
+
+	def _reduction_plans (self, rules): # [None, (production, goto column, number of args, function (self, *args) or None if rule just passes on its single arg), ...] - index by rule num
 		prods = {} # {('production', ('symbol', ...)): func, ...}
 
-		for name in dir (self):
-			obj = getattr (self, name)
+		for cls in reversed (self.__class__.__mro__): # subclass methods override base
+			for name, obj in cls.__dict__.items ():
+				if name [0] != '_' and type (obj) is types.FunctionType and obj.__code__.co_argcount >= 1: # 2: allow empty productions
+					m = LALR1._rec_SYMBOL_NUMTAIL.match (name)
 
-			if name [0] != '_' and type (obj) is types.MethodType and obj.__code__.co_argcount >= 1: # 2: allow empty productions
-				m = LALR1._rec_SYMBOL_NUMTAIL.match (name)
+					if m:
+						parms = tuple (p if p in self.TOKENS else LALR1._rec_SYMBOL_NUMTAIL.match (p).group (1) \
+								for p in obj.__code__.co_varnames [1 : obj.__code__.co_argcount])
+						prods [(m.group (1), parms)] = obj
 
-				if m:
-					parms = tuple (p if p in self.TOKENS else LALR1._rec_SYMBOL_NUMTAIL.match (p).group (1) \
-							for p in obj.__code__.co_varnames [1 : obj.__code__.co_argcount])
-					prods [(m.group (1), parms)] = obj
+		rplans = [None] # first rule is always None
 
 		for irule in range (1, len (self.rules)):
-			func = prods.get (self.rules [irule] [:2])
+			rule = self.rules [irule]
+			func = prods.get (rule)
 
 			if not func:
-				raise NameError (f"no method for rule '{self.rules [irule] [0]} -> {''' '''.join (self.rules [irule] [1])}'")
+				raise NameError (f"no method for rule '{rule [0]} -> {''' '''.join (rule [1])}'")
+
+			if len (rule [1]) == 1 and func.__code__.co_argcount == 2 and func.__code__.co_code == _passthru.__code__.co_code:
+				func = None
 
-			self.rfuncs.append (func)
+			rplans.append ((rule [0], -1 - rules [irule - 1] [0], len (rule [1]), func))
+
+		return rplans
 
 	def tokenize (self, text):
-		tokens = []
-		end    = len (text)
-		pos    = 0
+		tokdisp = self.tokdisp
+		tokens  = []
+		end     = len (text)
+		pos     = 0
 
 		while pos < end:
-			m = self.tokrec.match (text, pos)
+			rec, info = tokdisp [ord (text [pos])]
+			m         = rec.match (text, pos)
 
 			if m is None:
-				tokens.append (Token ('$err', text [pos], pos))
+				tokens.append (Token ('$err', text [pos], pos, None, len (self.tids)))
 
 				break
 
 			else:
-				if m.lastgroup != 'ignore':
-					tok  = m.lastgroup
-					s, e = self.tokgrps [tok]
-					grps = m.groups () [s : e]
+				tok, tid, gidx, idxs = info [m.lastindex]
 
-					tokens.append (Token (tok, grps [0], pos, grps [1:]))
+				if tok is not None:
+					tokens.append (Token (tok, m.group (gidx), pos, \
+							m.group (*idxs) if len (idxs) > 1 else (m.group (idxs [0]),) if idxs else (), tid))
 
-				pos += len (m.group (0))
+				pos = m.end ()
 
-		tokens.append (Token ('$end', '', pos))
+		tokens.append (Token ('$end', '', pos, None, self.tids ['$end']))
 
 		return tokens
 
@@ -179,49 +446,145 @@ class LALR1:
 		'NO PARSE_SUCCESS'
 		return None # True to contunue checking conflict backtracks, False to stop and return
 
-	def parse (self, src):
+	def parse_getglobalstate (self): # state accumulated across all branches (like best result so far), saved for incremental parse checkpoints
+		return None
+
+	def parse_setglobalstate (self, state):
+		pass
+
+	def parse_prune (self, conf): # True if conflict branch can not produce a better result than already found
+		return False
+
+	def parse_sessionkey (self): # tuple of anything other than tokens which can change the result of a parse, elements compared by identity or equality
+		return (self.tokrec,)
+
+	def parse_edit (self, session, offset, remove, insert, budget = None): # reparse last session source with remove chars at offset replaced by insert text
+		src = session.src or ''
+
+		return self.parse (src [:offset] + insert + src [offset + remove:], session, budget)
+
+	def _parse_resume (self, session, tokens): # return checkpoint to resume from for new tokens or None if must start from scratch
+		key, oldkey = self.parse_sessionkey (), session.key
+		session.key = key
+
+		if session.tokens is None or oldkey is None or len (key) != len (oldkey) or any (k is not o and k != o for k, o in zip (key, oldkey)):
+			return None
+
+		for k, (new, old) in enumerate (zip (tokens, session.tokens)): # tokens compare as strings so check everything explicitly
+			if new != old or new.text != old.text or new.pos != old.pos or new.grp != old.grp:
+				break
+		else:
+			k = min (len (tokens), len (session.tokens))
+
+		del session.ckpts [k:]
+
+		return session.ckpts [-1] if session.ckpts else None
+
+	def _parse_memoized (self, conf, memo): # check and mark conflict configuration as explored, continuation from identical configuration can only produce identical results
+		_, _, tokidx, stidx, tokens, stack, estate = conf
+
+		try:
+			key = (conf.conf, tokidx, stidx, tokens.ins, tuple ((st.idx, st.pos, st.red) for st in stack), estate)
+
+			if key in memo:
+				return True
+
+			memo.add (key)
+
+		except TypeError: # unhashable reduction or state, can not memoize
+			pass
+
+		return False
+
+	def parse (self, src, session = None, budget = None): # budget = (max branches or None, max seconds or None) to stop exploring conflicts early
 		has_parse_success = (self.parse_success.__doc__ != 'NO PARSE_SUCCESS')
 
-		rules, terms, nterms, rfuncs = self.rules, self.terms, self.nterms, self.rfuncs
+		rules, rplans                                = self.rules, self.rplans
+		tids, nterm, action, conflicts, nnterm, goto = self.tids, self.nterm, self.action, self.conflicts, self.nnterm, self.goto
+		tiderr                                       = nterm - 1 # terminal id for tokens not in grammar
 
-		tokens = self.tokenize (src)
+		toks   = self.tokenize (src)
+		tokend = len (toks) - 1
+		tokens = self.tokens = Tokens (toks)
 		tokidx = 0
 		confs  = [] # [(action, tokidx, stack, stidx, extra state), ...] # conflict backtrack stack
-		stack  = self.stack = [State (0, None, 0, None)] # [(stidx, symbol, pos, reduction) or (stidx, token), ...]
+		stack  = self.stack = State (0, None, 0, None) # top State of linked stack [(stidx, symbol, pos, reduction) or (stidx, token), ...]
 		stidx  = 0
 		rederr = None # reduction function raised exception (SyntaxError or Incomplete usually)
 		act    = True
 		pos    = 0
+		memo   = set () # {(action, tokidx, stidx, inserted tokens, stack, extra state), ...} - configurations of conflict branches already explored
+		ckpt   = None if session is None else self._parse_resume (session, toks)
+
+		self.parse_explored  = 1 # number of branches explored
+		self.parse_pruned    = 0 # number of branches skipped because they were duplicates of explored branches or could not improve result
+		self.parse_truncated = False # budget ran out before all branches explored
+
+		if budget:
+			maxbranches, maxtime = budget
+			maxtime              = None if maxtime is None else time.time () + maxtime
+
+		if session is not None:
+			ntoks                       = len (toks) # checkpoints only stored for original tokens, not autocomplete inserted
+			session.src, session.tokens = src, toks
+
+			if ckpt is None:
+				del session.ckpts [:]
+
+			else: # resume from checkpoint, conflicts get new tokens which are same up to checkpoint
+				stidx, stack, confs, estate, gstate, pos = ckpt
+				tokidx                                   = len (session.ckpts)
+				self.stack                               = stack
+				confs                                    = [Conflict (c.conf, c.pos, c [2], c [3], tokens, c [5], c [6]) for c in confs]
+
+				self.parse_setextrastate (estate)
+				self.parse_setglobalstate (gstate)
 
 		# if not hasattr (self, 'reds'): # DEBUG
 		# 	self.reds = {} # DEBUG
 
 		while 1:
-			if not rederr and act is not None:
-				tok       = tokens [tokidx]
-				act, conf = terms [stidx].get (tok, (None, None))
+			if not rederr and act:
+				tok = toks [tokidx] if tokidx < tokend else tokens [tokidx] # avoid overlay lookup unless past original tokens
+				tid = tok.tid
 
-			if rederr or act is None:
+				if tid is None: # token created outside of tokenize ()
+					tid = tok.tid = tids.get (tok, tiderr)
+
+				act  = action [stidx * nterm + tid]
+				conf = conflicts.get (stidx * nterm + tid) if act else None
+
+			if rederr or not act:
 				if rederr is not Reduce:
-					self.tokens, self.tokidx, self.confs, self.stidx, self.tok, self.rederr, self.pos = \
-							tokens, tokidx, confs, stidx, tok, rederr, pos
+					self.tokens, self.tokidx, self.confs, self.stidx, self.tok, self.rederr, self.pos, self.stack = \
+							tokens, tokidx, confs, stidx, tok, rederr, pos, stack
 
 					rederr = None
 
-					if tok == '$end' and stidx == 1 and len (stack) == 2 and stack [1].sym == rules [0] [1]:
+					if tok == '$end' and stidx == 1 and stack.prev is not None and stack.prev.prev is None and stack.sym == rules [0] [1]:
 						if not has_parse_success:
-							return stack [1].red
+							return stack.red
 
-						if not self.parse_success (stack [1].red) or not confs:
+						if not self.parse_success (stack.red) or not confs:
 							return None
 
-					elif self.parse_error ():
-						tokidx, stidx = self.tokidx, self.stidx
-						act           = True
-						rederr        = None
+					elif self.parse_error (): # may insert tokens or replace top of stack
+						tokens, tokidx, stidx, stack = self.tokens, self.tokidx, self.stidx, self.stack
+						act                          = True
+						rederr                       = None
 
 						continue
 
+				while confs and (self.parse_prune (confs [-1]) or self._parse_memoized (confs [-1], memo)): # discard branches which can not improve on or would repeat what was already explored
+					confs.pop ()
+
+					self.parse_pruned += 1
+
+				if confs and budget and ((maxbranches is not None and self.parse_explored >= maxbranches) or (maxtime is not None and time.time () >= maxtime)): # out of budget, go with what we have
+					self.parse_truncated = True
+
+					del confs [:]
+
 				if not confs:
 					if has_parse_success: # do not raise SyntaxError if parser relies on parse_success
 						return None
@@ -235,6 +598,7 @@ class LALR1:
 						f'invalid syntax {src [tok.pos : tok.pos + 16]!r}')
 
 				act, _, tokidx, stidx, tokens, stack, estate = confs.pop ()
+				self.parse_explored                         += 1
 				self.stack                                   = stack
 				tok                                          = tokens [tokidx]
 				conf                                         = None
@@ -242,11 +606,11 @@ class LALR1:
 
 				self.parse_setextrastate (estate)
 
-				if act is None:
+				if not act:
 					continue
 
 			if conf is not None:
-				confs.append (Conflict (conf, tok.pos, tokidx, stidx, tokens [:], stack [:], self.parse_getextrastate ()))#, keep = act < 0 and tok in self._PARSER_CONFLICT_REDUCE))
+				confs.append (Conflict (conf, tok.pos, tokidx, stidx, tokens, stack, self.parse_getextrastate ()))#, keep = act < 0 and tok in self._PARSER_CONFLICT_REDUCE))
 
 				# if conf < 0: # DEBUG
 				# 	k             = (act, rules [-conf])
@@ -255,75 +619,98 @@ class LALR1:
 			if act > 0:
 				tokidx += 1
 				stidx   = act
+				stack   = State (stidx, tok, None, None, stack)
 
-				stack.append (State (stidx, tok))
+				if session is not None and tokidx == len (session.ckpts) + 1 and tokidx < ntoks:
+					session.ckpts.append ((stidx, stack, confs [:], self.parse_getextrastate (), self.parse_getglobalstate (), pos))
 
 			else:
-				rule  = rules [-act]
-				rnlen = -len (rule [1])
-				prod  = rule [0]
-				pos   = self.pos = stack [rnlen].pos
+				prod, gcol, nargs, rfunc = rplans [-act]
 
-				try:
-					red = rfuncs [-act] (*((t.sym if t.red is None else t.red for t in stack [rnlen:]) if rnlen else ()))
+				if rfunc is None: # unit rule which just passes on its argument, no call needed
+					red  = stack.sym if stack.red is None else stack.red
+					pos  = stack.pos
+					base = stack.prev
 
-				except SyntaxError as e:
-					rederr = e # or True
+				else:
+					args = []
+					base = stack
+					pos  = 0 # empty production takes position of bottom of stack which is always 0
 
-					continue
+					for _ in range (nargs): # pop states of rule off of stack
+						args.append (base.sym if base.red is None else base.red)
 
-				# except Incomplete as e:
-				# 	rederr = e
-				# 	red    = e.red
+						pos  = base.pos
+						base = base.prev
 
-				else:
-					# if isinstance (red, KeepConf): # mark this conflict to not be removed by PopConf
-					# 	red             = red.red
-					# 	confs [-1].keep = True
+					self.pos, self.stack = pos, stack
 
-					if isinstance (red, Reduce): # successful rule but request to follow conflicted reduction first putting results of rule on conf stack to be picked up later
-						stidx     = nterms [stack [rnlen - 1].idx] [prod]
-						stack     = stack [:rnlen] + [State (stidx, prod, pos, red.then)]
-						tok       = tokens [tokidx]
-						act, conf = terms [stidx].get (tok, (None, None))
-						estate    = self.parse_getextrastate ()
-						rederr    = Reduce
+					args.reverse ()
 
-						if conf is not None:
-							confs.insert (-1, Conflict (conf, tok.pos, tokidx, stidx, tokens [:], stack [:], estate))#, keep = red.keep))
+					try:
+						red = rfunc (self, *args)
 
-						confs.insert (-1, Conflict (act, tok.pos, tokidx, stidx, tokens [:], stack [:], estate))#, keep = red.keep))
+					except SyntaxError as e:
+						rederr = e # or True
 
 						continue
 
-					if red is Reduce or isinstance (red, PopConfs): # pop all conflicts generated from parsing this rule because parse is guaranteed good
-						red   = red.red
-						start = stack [-1].pos if red is Reduce else pos
-						i     = 0
+					# except Incomplete as e:
+					# 	rederr = e
+					# 	red    = e.red
+
+					else:
+						# if isinstance (red, KeepConf): # mark this conflict to not be removed by PopConf
+						# 	red             = red.red
+						# 	confs [-1].keep = True
+
+						if isinstance (red, Reduce): # successful rule but request to follow conflicted reduction first putting results of rule on conf stack to be picked up later
+							stidx  = goto [base.idx * nnterm + gcol]
+							stack  = State (stidx, prod, pos, red.then, base)
+							tok    = tokens [tokidx]
+							tid    = tok.tid
+
+							if tid is None:
+								tid = tok.tid = tids.get (tok, tiderr)
 
-						for i in range (len (confs) - 1, -1, -1):
-							if confs [i].pos <= start:
-								break
+							act    = action [stidx * nterm + tid]
+							conf   = conflicts.get (stidx * nterm + tid) if act else None
+							estate = self.parse_getextrastate ()
+							rederr = Reduce
 
-							# if not confs [i].keep: # dont remove conflicts which are marked for keeping
-							# 	del confs [i]
-							del confs [i]
+							if conf is not None:
+								confs.insert (-1, Conflict (conf, tok.pos, tokidx, stidx, tokens, stack, estate))#, keep = red.keep))
 
-						if red is Reduce: # if reduction only requested then don't store rule result and fall back to previous conflicted reduction
-							rederr = red
+							confs.insert (-1, Conflict (act, tok.pos, tokidx, stidx, tokens, stack, estate))#, keep = red.keep))
 
 							continue
 
-				if rnlen:
-					del stack [rnlen:]
+						if red is Reduce or isinstance (red, PopConfs): # pop all conflicts generated from parsing this rule because parse is guaranteed good
+							red   = red.red
+							start = stack.pos if red is Reduce else pos
+							i     = 0
+
+							for i in range (len (confs) - 1, -1, -1):
+								if confs [i].pos <= start:
+									break
+
+								# if not confs [i].keep: # dont remove conflicts which are marked for keeping
+								# 	del confs [i]
+								del confs [i]
+
+							if red is Reduce: # if reduction only requested then don't store rule result and fall back to previous conflicted reduction
+								rederr = red
 
-				stidx = nterms [stack [-1].idx] [prod]
+								continue
 
-				stack.append (State (stidx, prod, pos, red))
+				stidx = goto [base.idx * nnterm + gcol]
+				stack = State (stidx, prod, pos, red, base)
 
 class lalr1: # for single script
 	Token      = Token
 	State      = State
+	Tokens     = Tokens
+	Session    = Session
 	# Incomplete = Incomplete
 	PopConfs   = PopConfs
 	Reduce     = Reduce
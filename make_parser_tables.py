@@ -145,7 +145,7 @@ def parse_rules (conflict_reduce_first = ()): # conflict_reduce_first = {'TOKEN'
 	return symbols, rules, strules, terms, nterms
 
 #...............................................................................................
-def process (fnm, nodelete = False, compress = False, width = 512):
+def process (fnm, nodelete = False, compress = False, width = 512, binary = True):
 	parser_tables_rec      = re.compile (r'^(\s*)_PARSER_TABLES\s*=')
 	parser_tables_cont_rec = re.compile (r'\\\s*$')
 
@@ -264,6 +264,9 @@ def process (fnm, nodelete = False, compress = False, width = 512):
 
 					open (f'{fnm}.py', 'w').writelines (lines)
 
+					if binary: # dense tables for fast startup, used by LALR1 if built from same _PARSER_TABLES, else falls back to those
+						open (f'{fnm}.tab', 'wb').write (LALR1.tables_dumps (text if compress else qpdata))
+
 					break
 
 			break
@@ -273,19 +276,22 @@ def cmdline ():
 	nodelete   = False
 	width      = 192
 	compress   = True
-	opts, argv = getopt.getopt (sys.argv [1:], 'w:', ['nd', 'nodelete', 'nc', 'nocompress', 'width='])
+	binary     = True
+	opts, argv = getopt.getopt (sys.argv [1:], 'w:', ['nd', 'nodelete', 'nc', 'nocompress', 'nb', 'nobinary', 'width='])
 
 	for opt, arg in opts:
 		if opt in ('--nd', '--nodelete'):
 			nodelete = True
 		elif opt in ('--nc', '--nocompress'):
 			compress = False
+		elif opt in ('--nb', '--nobinary'):
+			binary = False
 		elif opt in ('-w', '--width'):
 			width = int (arg)
 
 	fnm = argv [0] if argv else 'sparser'
 
-	process (fnm, nodelete = nodelete, compress = compress, width = width)
+	process (fnm, nodelete = nodelete, compress = compress, width = width, binary = binary)
 
 if __name__ == '__main__':
 	cmdline ()
@@ -45,12 +45,90 @@
 # ('-subs', expr, ((s1, d1), ...))                    - substitution - replace all s? with d? in expr
 
 from collections import OrderedDict
+from operator import itemgetter
 import re
+import sys
+import threading
 import types
 
 import sympy as sp
 
 #...............................................................................................
+class _Lazy: # non-data descriptor for attribute calculated by self._name () on first access, stored in instance __dict__ which takes precedence from then on
+	__slots__ = ('name', 'fname')
+
+	def __init__ (self, name):
+		self.name, self.fname = name, f'_{name}'
+
+	def __get__ (self, obj, cls):
+		if obj is None:
+			return self
+
+		val = obj.__dict__ [self.name] = getattr (obj, self.fname) ()
+
+		return val
+
+def _bottom_up (ast, name, node_func): # synthesize attribute name for nodes in tree which do not have it cached yet, node_func (node) computes it from children which already have it, iterative so tree depth doesn't matter
+	root  = ast
+	stack = [ast]
+
+	while stack:
+		ast  = stack [-1]
+		todo = [a for a in ast if isinstance (a, AST) and name not in a.__dict__]
+
+		if todo:
+			stack.extend (todo)
+
+		else:
+			stack.pop ()
+
+			if name not in ast.__dict__: # shared subtree may have been on stack more than once
+				ast.__dict__ [name] = node_func (ast)
+
+	return root.__dict__ [name]
+
+def _optional (idx, default = None): # structural field which may not be present in tuple
+	return property (lambda self: self [idx] if len (self) > idx else default)
+
+class _Scope: # variables for AST.apply_vars (), names defined in this scope layered over scope below without copying it
+	__slots__ = ('below', 'new', 'count', 'vals')
+
+	def __init__ (self, below, new, count, vals = None): # vals = all visible names if materialized by scopeout
+		self.below, self.new, self.count, self.vals = below, new, count, vals
+
+	def __bool__ (self): # only an empty base scope is false
+		return self.below is not None or self.vals is not None or bool (self.new)
+
+	def get (self, name):
+		scope = self
+
+		while scope is not None:
+			if scope.vals is not None:
+				return scope.vals.get (name)
+
+			if name in scope.new:
+				return scope.new [name]
+
+			scope = scope.below
+
+		return None
+
+	def names (self): # all visible names
+		names = set ()
+		scope = self
+
+		while scope is not None:
+			if scope.vals is not None:
+				names.update (scope.vals)
+
+				break
+
+			names.update (scope.new)
+
+			scope = scope.below
+
+		return names
+
 class AST (tuple):
 	op      = None
 
@@ -60,11 +138,23 @@ class AST (tuple):
 	_OP2CLS = {}
 	_CLS2OP = {}
 
+	_INTERNED = {} # {(class, (id (canonical child) or leaf value, ...)): canonical ast, ...} - structurally equal ASTs, see intern ()
+
+	_MAX_DEPTH   = 100000 # trampoline () call depth after which RecursionError is raised, for circular references which would otherwise never end
+	_DEEP_FRAMES = 16 # conservative estimate of Python frames per tree level used by passes which are still recursive like the renderers and SymPy itself
+	_DEEP_LOCK   = threading.Lock ()
+	_DEEP_CALLS  = [0, None] # [number of call_deep () threads running, recursion limit before first one started]
+
+	_FROZEN_EMPTY = frozenset ()
+
+	_fields = () # names of structural fields in tuple following op, read by descriptors installed in register_AST ()
+	_kw     = () # names of attributes set with setkw () or creation kw
+
 	_rec_identifier = re.compile (r'^[a-zA-Z]\w*$')
 
 	def __new__ (cls, *args, **kw):
 		op       = AST._CLS2OP.get (cls)
-		cls_args = tuple (AST (*arg) if arg.__class__ is tuple else arg for arg in args)
+		cls_args = AST.trampoline (AST._tuples2asts (args)) if tuple in map (type, args) else args
 
 		if op:
 			args = (op,) + cls_args
@@ -91,28 +181,245 @@ class AST (tuple):
 				self._init (*cls_args)
 
 		if kw:
-			self.__dict__.update (kw)
+			self.setkw (**kw)
 
 		return self
 
+	@staticmethod
+	def _tuples2asts (args): # convert plain tuples in args to ASTs bottom-up, generator for trampoline ()
+		args = list (args)
+
+		for i, arg in enumerate (args):
+			if arg.__class__ is tuple:
+				args [i] = AST (*(yield AST._tuples2asts (arg)))
+
+		return tuple (args)
+
+	@staticmethod
+	def trampoline (gen): # run recursive pass written as generator iteratively, gen yields generators for recursive calls and gets their return values sent back, deep trees do not hit recursion limit
+		stack = [gen]
+		ret   = exc = None
+
+		while 1:
+			try:
+				if exc is None:
+					sub = stack [-1].send (ret)
+				else:
+					sub, exc = stack [-1].throw (exc), None
+
+			except StopIteration as e:
+				stack.pop ()
+
+				if not stack:
+					return e.value
+
+				ret = e.value
+
+			except Exception as e: # pass on to generator which made the call
+				stack.pop ()
+
+				if not stack:
+					raise
+
+				exc = e
+
+			else:
+				stack.append (sub)
+
+				ret = None
+
+				if len (stack) > AST._MAX_DEPTH:
+					raise RecursionError ('maximum tree depth exceeded')
+
+	@staticmethod
+	def depth (ast): # maximum nesting depth of AST instances in tree
+		depth = 0
+		stack = [(ast, 1)]
+
+		while stack:
+			ast, d = stack.pop ()
+
+			if isinstance (ast, AST):
+				depth = max (depth, d)
+
+				stack.extend ((a, d + 1) for a in ast if isinstance (a, AST))
+
+		return depth
+
+	@staticmethod
+	def call_deep (depth, func, *args, **kw): # call recursive func for tree of given depth, if too deep for recursion limit then do it in a thread with raised limit and large enough stack
+		need = depth * AST._DEEP_FRAMES
+
+		if need < sys.getrecursionlimit () // 2:
+			return func (*args, **kw)
+
+		res = []
+
+		def run ():
+			try:
+				res.append ((func (*args, **kw), None))
+			except BaseException as e:
+				res.append ((None, e))
+
+		with AST._DEEP_LOCK:
+			if not AST._DEEP_CALLS [0]:
+				AST._DEEP_CALLS [1] = sys.getrecursionlimit ()
+
+			AST._DEEP_CALLS [0] += 1
+
+			sys.setrecursionlimit (max (sys.getrecursionlimit (), need + AST._DEEP_CALLS [1]))
+
+		try:
+			with AST._DEEP_LOCK: # stack_size () is global for new threads
+				stack_size = threading.stack_size (min (need * 4096, 0x40000000))
+				thread     = threading.Thread (target = run, daemon = True)
+
+				try:
+					thread.start ()
+				finally:
+					threading.stack_size (stack_size)
+
+			thread.join ()
+
+		finally:
+			with AST._DEEP_LOCK:
+				AST._DEEP_CALLS [0] -= 1
+
+				if not AST._DEEP_CALLS [0]:
+					sys.setrecursionlimit (AST._DEEP_CALLS [1])
+
+		val, exc = res [0]
+
+		if exc is not None:
+			raise exc
+
+		return val
+
 	def __add__ (self, other):
 		if not isinstance (other, tuple):
 			raise TypeError (f'can only concatenate tuple (not "{type (other).__name__}") to AST')
 
 		return self if not other else AST (*tuple.__add__ (self, other))
 
-	def __getattr__ (self, name): # calculate value for nonexistent self.name by calling self._name () and store
-		func                 = getattr (self, f'_{name}') if name [0] != '_' else None
-		val                  = func and func ()
-		self.__dict__ [name] = val
+	def __getattr__ (self, name): # only reached for names which are not fields, lazy or explicitly set attributes, these are None for the whole class
+		if name [0] != '_':
+			if name != 'init' and isinstance (getattr (self.__class__, f'_{name}', None), types.FunctionType): # _name () added to class after registration, like sparser does for tail_differential
+				setattr (next (c for c in self.__class__.__mro__ if f'_{name}' in c.__dict__), name, _Lazy (name))
 
-		return val
+				return getattr (self, name)
+
+			setattr (self.__class__, name, None)
+
+		return None
+
+	def __hash__ (self): # cached because trees are immutable, can be large and are used as dict keys
+		h = self.__dict__.get ('_hash_')
+
+		if h is None:
+			try:
+				h = self.__dict__ ['_hash_'] = tuple.__hash__ (self)
+
+			except RecursionError: # too deep, hash uncached subtrees bottom-up so that tuple.__hash__ () only goes one level deep
+				todo  = []
+				stack = [self]
+
+				while stack:
+					ast = stack.pop ()
+
+					todo.append (ast)
+					stack.extend (a for a in ast if isinstance (a, AST) and a.__class__.__hash__ is AST.__hash__ and '_hash_' not in a.__dict__)
+
+				for ast in reversed (todo):
+					h = ast.__dict__ ['_hash_'] = tuple.__hash__ (ast)
+
+		return h
+
+	def _init (self, *args): # structural fields are not stored, they are read from tuple by descriptors for _fields, classes which need to store something define their own
+		if len (args) != len (self._fields):
+			raise TypeError (f'{self.__class__.__name__} takes {len (self._fields)} argument(s) ({len (args)} given)')
 
 	def setkw (self, **kw):
 		self.__dict__.update (kw)
 
+		self._kw = tuple (dict.fromkeys (self._kw + tuple (kw)))
+
 		return self # convenience
 
+	def explicit_kw (self): # attributes set with setkw () or creation kw as opposed to structural fields and those calculated on demand
+		return {k: getattr (self, k) for k in self._kw}
+
+	def __reduce__ (self): # pickle as flat post-order list of nodes so depth doesn't matter, shared subtrees stay shared, lazily calculated attributes are not kept
+		nodes = [] # [(args, (arg ref idx, ...), kw, (kw ref name, ...)), ...] - refs are indexes of child nodes earlier in list
+		index = {} # {id (ast): index in nodes, ...}
+		stack = [(self, False)]
+
+		while stack:
+			ast, children_done = stack.pop ()
+
+			if id (ast) in index: # shared subtree may have been on stack more than once
+				continue
+
+			kw = ast.explicit_kw () if ast._kw else {}
+
+			if not children_done:
+				stack.append ((ast, True))
+				stack.extend ((a, False) for a in (*ast, *kw.values ()) if isinstance (a, AST) and id (a) not in index)
+
+			else:
+				index [id (ast)] = len (nodes)
+
+				nodes.append ((tuple (index [id (a)] if isinstance (a, AST) else a for a in ast), tuple (i for i, a in enumerate (ast) if isinstance (a, AST)),
+					{k: index [id (a)] if isinstance (a, AST) else a for k, a in kw.items ()}, tuple (k for k, a in kw.items () if isinstance (a, AST))))
+
+		return (AST._unpickle, (nodes,))
+
+	@staticmethod
+	def _unpickle (nodes):
+		asts = []
+
+		for args, arefs, kw, krefs in nodes:
+			if arefs:
+				args = list (args)
+
+				for i in arefs:
+					args [i] = asts [args [i]]
+
+			for k in krefs:
+				kw [k] = asts [kw [k]]
+
+			asts.append (AST (*args, **kw))
+
+		return asts [-1]
+
+	@staticmethod
+	def intern (ast): # return canonical instance of structurally equal ast with all subtrees canonical as well, nodes with explicit attributes are rebuilt but never shared
+		def intern (ast):
+			args = []
+
+			for a in ast:
+				args.append ((yield intern (a)) if isinstance (a, AST) else a)
+
+			kw = ast.explicit_kw ()
+
+			if any (a is not b for a, b in zip (args, ast)):
+				ast = AST (*args, **kw)
+
+			if kw:
+				return ast
+
+			key = (ast.__class__, tuple (id (a) if isinstance (a, AST) else a for a in args)) # children already canonical so identity is structure, hashing does not recurse
+
+			try:
+				return AST._INTERNED.setdefault (key, ast)
+			except TypeError: # unhashable leaf value
+				return ast
+
+		return AST.trampoline (intern (ast)) if isinstance (ast, AST) else ast
+
+	@staticmethod
+	def intern_clear ():
+		AST._INTERNED.clear ()
+
 	def _is_single_unit (self): # is single positive digit, fraction or single non-differential non-subscripted variable?
 		if self.op == '/':
 			return True
@@ -136,44 +443,45 @@ class AST (tuple):
 		return args [0] if len (args) == 1 else AST (',', tuple (args))
 
 	def _no_curlys (self): # remove ALL curlys from entire tree, not just top level
-		if self.is_curly:
-			return self.curly.no_curlys
-		else:
-			return AST (*tuple (a.no_curlys if isinstance (a, AST) else a for a in self))#, **self._kw)
+		def no_curlys (ast):
+			args = []
 
-	def _flat (self, op = None, seq = None, exp = None): # flatten trees of '+', '*', '||', '^^', '&&', '-or' and '-and' into single ASTs
-		def subflat (op, seq, exp):
-			if self.is_mul:
-				for i in range (self.mul.len):
-					if i in self.exp:
-						exp.add (len (seq))
+			for a in ast:
+				args.append ((yield no_curlys (a)) if isinstance (a, AST) else a)
 
-					self.mul [i]._flat (self.op, seq, exp)
+			return args [1] if ast.is_curly else AST (*args)
 
-			else:
-				for e in self [1]:
-					e._flat (self.op, seq, exp)
+		return AST.trampoline (no_curlys (self))
 
-		# start here
-		if self.op in {'+', '*', '||', '^^', '&&', '-or', '-and'}: # specifically not '<>' because that would be different meaning
-			if self.op == op:
-				subflat (op, seq, exp)
+	def _flat (self): # flatten trees of '+', '*', '||', '^^', '&&', '-or' and '-and' into single ASTs
+		def flat (ast):
+			args = []
 
-				return
+			for a in ast:
+				args.append ((yield flat (a)) if isinstance (a, AST) else a)
 
-			seq2, exp2 = [], set ()
+			if ast.op not in {'+', '*', '||', '^^', '&&', '-or', '-and'}: # specifically not '<>' because that would be different meaning
+				return AST (*args)
 
-			subflat (self.op, seq2, exp2)
+			seq, exp = [], set ()
 
-			ast = AST (self.op, tuple (seq2), exp2) if self.is_mul else AST (self.op, tuple (seq2))
+			for i, e in enumerate (args [1]): # children already flat so only one level of same op to merge
+				if ast.is_mul and i in ast.exp:
+					exp.add (len (seq))
 
-		else:
-			ast = AST (*tuple (a.flat if isinstance (a, AST) else a for a in self))
+				if e.op != ast.op:
+					seq.append (e)
 
-		if op:
-			seq.append (ast)
-		else:
-			return ast
+				else:
+					for j, f in enumerate (e [1]):
+						if e.is_mul and j in e.exp:
+							exp.add (len (seq))
+
+						seq.append (f)
+
+			return AST (ast.op, tuple (seq), exp) if ast.is_mul else AST (ast.op, tuple (seq))
+
+		return AST.trampoline (flat (self))
 
 	def neg (self, stack = False): # stack means stack negatives ('-', ('-', ('#', '-1')))
 		if stack:
@@ -401,60 +709,71 @@ class AST (tuple):
 
 		return tuple (args), tuple (sorted (kw.items ()))
 
-	def _free_vars (self): # return set of unique unbound variables found in tree, not reliable especially if used before sxlat due to things like ('-func', 'Derivative', ...), '-subs' is particularly problematic
-		def _free_vars (ast, vars):
-			if isinstance (ast, AST):
-				if ast.is_var:
-					if ast.is_var_nonconst and ast.var:
-						vars.add (ast)
+	def _free_vars (self): # frozenset of unique unbound variables found in tree, built bottom-up from cached free_vars of children so only nodes not queried before are visited, not reliable especially if used before sxlat due to things like ('-func', 'Derivative', ...)
+		return _bottom_up (self, 'free_vars', AST._free_vars_node)
 
-				elif ast.is_lamb:
-					_free_vars (ast.lamb, vars)
-					vars.difference_update (('@', v) for v in ast.vars)
+	def _free_vars_node (self): # free vars of this node from free_vars already cached in children
+		if self.is_var:
+			return frozenset ((self,)) if self.is_var_nonconst and self.var else AST._FROZEN_EMPTY
 
-				elif ast.is_subs:
-					_free_vars (ast.expr, vars)
+		elif self.is_lamb:
+			return self.lamb.free_vars.difference (('@', v) for v in self.vars)
 
-					for src, dst in ast.subs:
-						if not src.is_var_nonconst:
-							present = False
+		elif self.is_subs:
+			vars = set (self.expr.free_vars)
 
-						else:
-							present = src in vars
+			for src, dst in self.subs:
+				if src.is_var_nonconst and src in vars:
+					vars.remove (src)
+					vars.update (dst.free_vars)
 
-							if present:
-								vars.remove (src)
+			return frozenset (vars)
 
-						if present:
-							_free_vars (dst, vars)
+		elif self.is_intg:
+			vars = self.intg.free_vars if self.intg is not None else AST._FROZEN_EMPTY
 
-				else:
-					try:
-						if ast.is_intg:
-							_free_vars (ast.intg, vars)
+			if self.is_intg_definite:
+				return (vars - {self.dv.as_var}).union (self.from_.free_vars, self.to.free_vars)
+			else:
+				return vars.union ((self.dv.as_var,))
 
-							if ast.is_intg_definite:
-								vars.remove (ast.dv.as_var)
-							else:
-								vars.add (ast.dv.as_var)
+		elif self.is_lim:
+			return (self.lim.free_vars - {self.lvar}) | self.to.free_vars
 
-						else:
-							for e in ast:
-								_free_vars (e, vars)
+		elif self.is_sum:
+			return (self.sum.free_vars - {self.svar}).union (self.from_.free_vars, self.to.free_vars)
+
+		vars = [a.free_vars for a in self if isinstance (a, AST)]
+		vars = [v for v in vars if v]
 
-							if ast.is_lim:
-								vars.remove (ast.lvar)
-							elif ast.is_sum:
-								vars.remove (ast.svar)
+		return vars [0] if len (vars) == 1 else AST._FROZEN_EMPTY.union (*vars) # share child set if only one contributes
 
-					except KeyError:
-						pass
+	def _num_prec (self): # length of longest numeric literal string in tree, used as SymPy float precision
+		return _bottom_up (self, 'num_prec', AST._num_prec_node)
 
-		vars = set ()
+	def _num_prec_node (self):
+		return len (self.num) if self.is_num else max ((a.num_prec for a in self if isinstance (a, AST)), default = 0)
+
+	def _func_names (self): # frozenset of names of functions called in tree, attribute function calls are present as '.name'
+		return _bottom_up (self, 'func_names', AST._func_names_node)
+
+	def _func_names_node (self):
+		return AST._union_children (self, 'func_names', self.func if self.is_func else f'.{self.attr}' if self.is_attr_func else None)
+
+	def _var_names (self): # frozenset of names of variables, symbols and undefined functions in tree
+		return _bottom_up (self, 'var_names', AST._var_names_node)
+
+	def _var_names_node (self):
+		return AST._union_children (self, 'var_names', self.var if self.is_var else self.sym if self.is_sym else self.ufunc if self.is_ufunc else None)
+
+	@staticmethod
+	def _union_children (ast, name, own = None): # union of frozenset attribute name of children plus own element if not None, shares child set where possible
+		sets = [s for s in (a.__dict__ [name] for a in ast if isinstance (a, AST)) if s]
 
-		_free_vars (self, vars)
+		if own is not None and not any (own in s for s in sets):
+			sets.append (frozenset ((own,)))
 
-		return vars
+		return sets [0] if len (sets) == 1 else AST._FROZEN_EMPTY.union (*sets)
 
 	@staticmethod
 	def args2kwargs (args, func = None, ass2cmp = False): # ass2cmp means convert assignment to comparison so it can be represented as Eq() in the py representation of argument list of functions
@@ -520,46 +839,39 @@ class AST (tuple):
 	@staticmethod
 	def apply_vars (ast, vars, parent = None, mode = True): # remap vars to assigned expressions and 'execute' funcs which map to lambda vars
 		# print ('/n'.join (f'{v} ... {a}' for v, a in vars.items ()) + f'\n{ast}')
-		def push (vars, newvars): # create new frame and add new variables, this is really overkill
-			frame       = vars.copy ()
-			frame ['<'] = vars
-			frame ['>'] = newvars
+		def push (vars, newvars): # create new scope with new variables
+			return _Scope (vars, newvars, vars.count)
 
-			frame.update (newvars)
-
-			return frame
-
-		def pop (vars, var): # find variable and return frame just below it
-			prev = vars.get ('<')
+		def pop (vars, var): # find variable and return scope just below it
+			prev = vars.below
 
 			while prev:
-				if var in prev.get ('>', {}):
+				if var in prev.new:
 					return prev
 
 				vars = prev
-				prev = vars.get ('<')
+				prev = vars.below
 
 			return vars
 
-		def scopeout (vars): # scope out one layer of variables (not frames) and create new frame
-			count = vars.get ('#', 1)
-			frame = {'<': vars.get ('<', {}), '>': vars.get ('>', vars), '#': count + 1}
+		def scopeout (vars): # scope out one layer of variables (not scopes) and create new scope
+			count = vars.count
+			vals  = {}
 
-			for v in vars:
-				if v not in '<>#':
-					f = vars
+			for v in vars.names ():
+				f = vars
 
-					for _ in range (count):
-						while f:
-							nvs = f.get ('>', f)
-							f   = f.get ('<', {})
+				for _ in range (count):
+					while f:
+						nvs = f.new
+						f   = f.below
 
-							if not f or v in nvs:
-								break
+						if not f or v in nvs:
+							break
 
-					frame [v] = f.get (v)
+				vals [v] = f.get (v) if f is not None else None
 
-			return frame
+			return _Scope (vars.below, vars.new, count + 1, vals)
 
 		def index_by_is (seq, obj):
 			for i, o in enumerate (seq):
@@ -568,116 +880,148 @@ class AST (tuple):
 
 			return None
 
-		# start here
-		if not isinstance (ast, AST): # or (ast.is_func and ast.func == AST.Func.NOREMAP): # non-AST, ufunc definition or stop remap
-			return ast
+		def apply (ast, vars, parent, mode): # generator for trampoline (), yields are recursive calls
+			if not isinstance (ast, AST): # or (ast.is_func and ast.func == AST.Func.NOREMAP): # non-AST, ufunc definition or stop remap
+				return ast
+
+			if ast.is_ufunc: # possibly convert non-explicit ufunc to concrete function call if signature matches destination lambda
+				if not ((mode is True and not ast.is_ufunc_explicit) or mode == 'lambexec'): # do not map ufuncs to func calls when mapping vars onto themselves, inside lambda definition or is explicit
+					return ast
+
+				lamb = vars.get (ast.ufunc)
+
+				if not (lamb and lamb.is_lamb and ast.matches_lamb_sig (lamb)):
+					if mode != 'lambexec':
+						return ast
+
+					args = []
+
+					for a in ast.vars:
+						args.append ((yield apply (a, vars, ast, mode)))
+
+					return AST ('-ufunc', ast.ufunc_full, tuple (args), ast.kw)
+
+				ast = AST ('-func', ast.ufunc, ast.vars)
 
-		if ast.is_ufunc: # possibly convert non-explicit ufunc to concrete function call if signature matches destination lambda
-			if not ((mode is True and not ast.is_ufunc_explicit) or mode == 'lambexec'): # do not map ufuncs to func calls when mapping vars onto themselves, inside lambda definition or is explicit
+			if ast.is_num:
 				return ast
 
-			lamb = vars.get (ast.ufunc)
+			elif ast.is_var: # regular var substitution?
+				expr = vars.get (ast.var)
 
-			if not (lamb and lamb.is_lamb and ast.matches_lamb_sig (lamb)):
-				if mode != 'lambexec':
+				if not expr:
 					return ast
-				else:
-					return AST ('-ufunc', ast.ufunc_full, tuple (AST.apply_vars (a, vars, ast, mode) for a in ast.vars), ast.kw)
+				elif not expr.is_lamb:
+					return (yield apply (expr, pop (vars, ast.var), ast, mode))
 
-			ast = AST ('-func', ast.ufunc, ast.vars)
+				if parent is None:
+					parent = AST.Null
 
-		if ast.is_num:
-			return ast
+				i = index_by_is (parent.mul, ast) if parent.is_mul else None
 
-		elif ast.is_var: # regular var substitution?
-			expr = vars.get (ast.var)
+				if (parent.op in {None, ';', '@', ',', '[', '-func', '-lamb', '-set', '-dict'} or
+						(parent.is_piece and any (p [0] is ast for p in parent.piece)) or
+						(i is not None and i < (parent.mul.len - 1) and parent.mul [i + 1].is_paren and (i + 1) not in parent.exp)): # if followed by implicit mul paren then is call not multiply
+					return expr
 
-			if not expr:
-				return ast
-			elif not expr.is_lamb:
-				return AST.apply_vars (expr, pop (vars, ast.var), ast, mode)
+				vars = push (vars, {v: False for v in expr.vars})
+
+				return (yield apply (expr.lamb, vars, ast, mode))
 
-			if parent is None:
-				parent = AST.Null
+			elif ast.is_subs:
+				expr = yield apply (ast.expr, vars, ast, mode)
+				subs = []
 
-			i = index_by_is (parent.mul, ast) if parent.is_mul else None
+				for src, dst in ast.subs: # without mapping src
+					subs.append ((src, (yield apply (dst, vars, ast, mode))))
 
-			if (parent.op in {None, ';', '@', ',', '[', '-func', '-lamb', '-set', '-dict'} or
-					(parent.is_piece and any (p [0] is ast for p in parent.piece)) or
-					(i is not None and i < (parent.mul.len - 1) and parent.mul [i + 1].is_paren and (i + 1) not in parent.exp)): # if followed by implicit mul paren then is call not multiply
-				return expr
+				return AST ('-subs', expr, tuple (subs))
 
-			vars = push (vars, {v: False for v in expr.vars})
+			elif ast.op in {'-lim', '-sum'}:
+				vars = push (vars, {ast [2].var: False})
+				args = [(yield apply (ast [1], vars, ast, mode)), ast [2]]
 
-			return AST.apply_vars (expr.lamb, vars, ast, mode)
+				for a in ast [3:]:
+					args.append ((yield apply (a, vars, ast, mode)))
 
-		elif ast.is_subs:
-			return AST ('-subs', AST.apply_vars (ast.expr, vars, ast, mode), tuple ((src, AST.apply_vars (dst, vars, ast, mode)) for src, dst in ast.subs)) # without mapping src
+				return AST (ast.op, *args)
 
-		elif ast.op in {'-lim', '-sum'}:
-			vars = push (vars, {ast [2].var: False})
+			elif ast.is_diff:
+				dvs = []
 
-			return AST (ast.op, AST.apply_vars (ast [1], vars, ast, mode), ast [2], *(AST.apply_vars (a, vars, ast, mode) for a in ast [3:]))
+				for v, p in ast.dvs: # remap differentials if possible
+					a = vars.get (v)
 
-		elif ast.is_diff:
-			dvs = []
+					if a:
+						if a.is_var_nonconst:
+							v = a.var
 
-			for v, p in ast.dvs: # remap differentials if possible
-				a = vars.get (v)
+					dvs.append ((v, p))
 
-				if a:
-					if a.is_var_nonconst:
-						v = a.var
+				return AST ('-diff', (yield apply (ast.diff, vars, ast, mode)), ast.d, tuple (dvs))
 
-				dvs.append ((v, p))
+			elif ast.is_intg:
+				dv = ast.dv
 
-			return AST ('-diff', AST.apply_vars (ast.diff, vars, ast, mode), ast.d, tuple (dvs))
+				if ast.is_intg_definite: # don't map bound var
+					v    = dv.var_name
+					vars = push (vars, {dv.var_name: False})
 
-		elif ast.is_intg:
-			dv = ast.dv
+				else: # remap differential if indefinite integral and possible
+					a = vars.get (ast.dv.var_name)
 
-			if ast.is_intg_definite: # don't map bound var
-				v    = dv.var_name
-				vars = push (vars, {dv.var_name: False})
+					if a:
+						if a.is_var_nonconst:
+							dv = AST ('@', f'd{a.var}')
+						else:
+							dv = ast.dv
 
-			else: # remap differential if indefinite integral and possible
-				a = vars.get (ast.dv.var_name)
+				args = [(yield apply (ast.intg, vars, ast, mode)), dv]
 
-				if a:
-					if a.is_var_nonconst:
-						dv = AST ('@', f'd{a.var}')
-					else:
-						dv = ast.dv
+				for a in ast [3:]:
+					args.append ((yield apply (a, vars, ast, mode)))
 
-			return AST ('-intg', AST.apply_vars (ast.intg, vars, ast, mode), dv, *(AST.apply_vars (a, vars, ast, mode) for a in ast [3:]))
+				return AST ('-intg', *args)
 
-		elif ast.is_lamb: # lambda definition
-			vars = push (vars, {v: False for v in ast.vars})
+			elif ast.is_lamb: # lambda definition
+				vars = push (vars, {v: False for v in ast.vars})
 
-			return AST ('-lamb', AST.apply_vars (ast.lamb, vars, ast, mode and 'lambdef'), ast.vars)
+				return AST ('-lamb', (yield apply (ast.lamb, vars, ast, mode and 'lambdef')), ast.vars)
 
-		elif ast.is_func: # function, might be user lambda call
-			if ast.func == AST.Func.NOREMAP:
-				return AST.apply_vars (ast.args [0], scopeout (vars), ast, mode)
+			elif ast.is_func: # function, might be user lambda call
+				if ast.func == AST.Func.NOREMAP:
+					return (yield apply (ast.args [0], scopeout (vars), ast, mode))
 
-			else:
-				lamb = vars.get (ast.func)
+				else:
+					lamb = vars.get (ast.func)
+
+					if lamb and lamb.is_lamb: # 'execute' user lambda
+						if ast.args.len == lamb.vars.len:
+							vars = push (vars, dict (zip (lamb.vars, ast.args)))
+
+							return (yield apply (lamb.lamb, vars, ast, mode and 'lambexec')) # remap lambda vars in body to func args and return body
+
+						elif mode:
+							raise TypeError (f"lambda function '{ast.func}' takes {lamb.vars.len} argument(s)")
+
+						args = []
+
+						for a in ast.args:
+							b = yield apply (a, vars, ast, mode)
 
-				if lamb and lamb.is_lamb: # 'execute' user lambda
-					if ast.args.len == lamb.vars.len:
-						vars = push (vars, dict (zip (lamb.vars, ast.args)))
+							args.append (('(', b) if a.is_var and (vars.get (a.var) or AST.VarNull).is_ass else b) # wrap var assignment args in parens to avoid creating kwargs
 
-						return AST.apply_vars (lamb.lamb, vars, ast, mode and 'lambexec') # remap lambda vars in body to func args and return body
+						return AST ('-func', ast.func, tuple (args))
 
-					elif mode:
-						raise TypeError (f"lambda function '{ast.func}' takes {lamb.vars.len} argument(s)")
+			args = []
 
-					return AST ('-func', ast.func,
-							tuple (('(', AST.apply_vars (a, vars, ast, mode))
-							if (a.is_var and (vars.get (a.var) or AST.VarNull).is_ass)
-							else AST.apply_vars (a, vars, ast, mode) for a in ast.args)) # wrap var assignment args in parens to avoid creating kwargs
+			for a in ast:
+				args.append ((yield apply (a, vars, ast if ast.op else parent, mode)) if isinstance (a, AST) else a)
 
-		return AST (*(AST.apply_vars (a, vars, ast if ast.op else parent, mode) for a in ast))#, **ast._kw)
+			return AST (*args)#, **ast._kw)
+
+		# start here
+		return AST.trampoline (apply (ast, _Scope (None, vars, 1), parent, mode))
 
 	@staticmethod
 	def register_AST (cls):
@@ -688,6 +1032,17 @@ class AST (tuple):
 
 		setattr (AST, cls.__name__ [4:], cls)
 
+		for idx, name in enumerate (cls._fields, 1):
+			setattr (cls, name, property (itemgetter (idx)))
+
+		AST.register_lazy (cls)
+
+	@staticmethod
+	def register_lazy (cls): # install lazy attribute descriptors for _name () methods of cls, inherited ones are already installed in base class
+		for fname, func in list (cls.__dict__.items ()):
+			if fname [0] == '_' and fname [1] != '_' and fname != '_init' and isinstance (func, types.FunctionType) and fname [1:] not in cls.__dict__:
+				setattr (cls, fname [1:], _Lazy (fname [1:]))
+
 	@staticmethod
 	def EI (state = True):
 		AST.CONSTS.difference_update ((AST.E, AST.I))
@@ -700,14 +1055,12 @@ class AST (tuple):
 class AST_SColon (AST):
 	op, is_scolon = ';', True
 
-	def _init (self, scolon):
-		self.scolon = scolon
+	_fields = ('scolon',)
 
 class AST_Ass (AST):
 	op, is_ass = '=', True
 
-	def _init (self, lhs, rhs):
-		self.lhs, self.rhs = lhs, rhs # should be py form
+	_fields = ('lhs', 'rhs') # should be py form
 
 	@staticmethod
 	def ufunc2lamb (ufunc, lamb):
@@ -717,11 +1070,11 @@ class AST_Ass (AST):
 		def verify (ast, lhs, multi = False):
 			for lhs in (lhs if multi else (lhs,)):
 				if lhs.is_var_const:
-					ast.error = 'The only thing that is constant is change - Heraclitus; Except for constants, they never change - Math...'
+					ast.setkw (error = 'The only thing that is constant is change - Heraclitus; Except for constants, they never change - Math...')
 				# elif lhs.is_ufunc_explicit:
 				# 	ast.error = 'cannot define an undefined function, by definition'
 				elif lhs.is_ufunc_impure:
-					ast.error = 'cannot assign to a function containing non-variable parameters'
+					ast.setkw (error = 'cannot assign to a function containing non-variable parameters')
 				# elif lhs.is_ufunc_anonymous:
 				# 	ast.error = 'cannot assign to an anonymous function'
 				else:
@@ -770,18 +1123,19 @@ class AST_Cmp (AST):
 	PY2TEX = {'!=': '\\ne', '<=': '\\le', '>=': '\\ge', 'in': '\\in', 'notin': '\\notin'}
 	PYFMT  = {'notin': 'not in'}
 
-	def _init (self, lhs, cmp):
-		self.lhs, self.cmp = lhs, cmp # should be py forms (('!=', expr), ('<=', expr), ...)
+	_fields = ('lhs', 'cmp') # should be py forms (('!=', expr), ('<=', expr), ...)
 
 	_is_cmp_in = lambda self: self.cmp.len == 1 and self.cmp [0] [0] in {'in', 'notin'}
 
 class AST_Num (AST):
 	op, is_num = '#', True
 
-	_rec_num   = re.compile (r'^(-?)(\d*[^0.e])?(0*)(?:(\.)(0*)(\d*[^0e])?(0*))?(?:([eE])([+-]?)(\d+))?$') # -101000.000101000e+123 -> (-) (101) (000) (.) (000) (101) (000) (e) (+) (123)
+	__hash__ = tuple.__hash__ # leaf, cheaper to hash again than to cache in instance __dict__
+	_fields  = ('num',)
+	_rec_num = re.compile (r'^(-?)(\d*[^0.e])?(0*)(?:(\.)(0*)(\d*[^0e])?(0*))?(?:([eE])([+-]?)(\d+))?$') # -101000.000101000e+123 -> (-) (101) (000) (.) (000) (101) (000) (e) (+) (123)
 
-	def _init (self, num):
-		self.num = str (num)
+	def __new__ (cls, num):
+		return tuple.__new__ (cls, ('#', str (num)))
 
 	_grp              = lambda self: [g or '' for g in AST_Num._rec_num.match (self.num).groups ()]
 	_is_num_pos       = lambda self: not self.grp [0]
@@ -820,8 +1174,8 @@ class AST_Var (AST):
 
 	_rec_groups = re.compile (r"^(?:(?:(d(?!elta))|(partial))(?!_)(?!['\d]))?((.*)(?<!\d)(\d*))$")
 
-	def _init (self, var):
-		self.var = var
+	__hash__ = tuple.__hash__ # leaf, cheaper to hash again than to cache in instance __dict__
+	_fields  = ('var',)
 
 	_grp                  = lambda self: [g or '' for g in AST_Var._rec_groups.match (self.var).groups ()]
 	_is_var_null          = lambda self: not self.var
@@ -849,11 +1203,11 @@ class AST_Var (AST):
 class AST_Attr (AST):
 	op, is_attr = '.', True
 
-	def __new__ (cls, obj, attr, args = None):
-		self                           = tuple.__new__ (cls, ('.', obj, attr) if args is None else ('.', obj, attr, args))
-		self.obj, self.attr, self.args = obj, attr, args
+	_fields = ('obj', 'attr')
+	args    = _optional (3)
 
-		return self
+	def __new__ (cls, obj, attr, args = None):
+		return tuple.__new__ (cls, ('.', obj, attr) if args is None else ('.', obj, attr, args))
 
 	_is_attr_var  = lambda self: self.args is None
 	_is_attr_func = lambda self: self.args is not None
@@ -861,31 +1215,28 @@ class AST_Attr (AST):
 class AST_Str (AST):
 	op, is_str = '"', True
 
-	def _init (self, str_):
-		self.str_ = str_
+	_fields = ('str_',)
 
 class AST_Comma (AST):
 	op, is_comma = ',', True
 
-	def _init (self, comma):
-		self.comma = comma
+	_fields = ('comma',)
 
 	_is_comma_empty = lambda self: not (self.comma.len)
 
 class AST_Curly (AST):
 	op, is_curly = '{', True
 
-	def _init (self, curly):
-		self.curly = curly
+	_fields = ('curly',)
 
 class AST_Paren (AST):
 	op, is_paren = '(', True
 
-	def __new__ (cls, paren, isolated = False):
-		self                      = tuple.__new__ (cls, ('(', paren) if not isolated else ('(', paren, True))
-		self.paren, self.isolated = paren, isolated
+	_fields  = ('paren',)
+	isolated = _optional (2, False)
 
-		return self
+	def __new__ (cls, paren, isolated = False):
+		return tuple.__new__ (cls, ('(', paren) if not isolated else ('(', paren, True))
 
 	_is_paren_isolated = lambda self: self.isolated
 	_is_paren_free     = lambda self: not self.isolated
@@ -893,42 +1244,38 @@ class AST_Paren (AST):
 class AST_Brack (AST):
 	op, is_brack = '[', True
 
-	def _init (self, brack):
-		self.brack = brack
+	_fields = ('brack',)
 
 class AST_Abs (AST):
 	op, is_abs = '|', True
 
-	def _init (self, abs):
-		self.abs = abs
+	_fields = ('abs',)
 
 class AST_Minus (AST):
 	op, is_minus = '-', True
 
-	def _init (self, minus):
-		self.minus = minus
+	_fields = ('minus',)
 
 class AST_Fact (AST):
 	op, is_fact = '!', True
 
-	def _init (self, fact):
-		self.fact = fact
+	_fields = ('fact',)
 
 class AST_Add (AST):
 	op, is_add = '+', True
 
-	def _init (self, add):
-		self.add = add
+	_fields = ('add',)
 
 class AST_Mul (AST):
 	op, is_mul = '*', True
 
+	_fields = ('mul',)
+	exp     = _optional (2, frozenset ()) # optional set of indices of rhses of explicitly specified multiplications
+
 	def __new__ (cls, mul, exp = frozenset ()):
-		exp                = frozenset (exp)
-		self               = tuple.__new__ (cls, ('*', mul, exp) if exp else ('*', mul))
-		self.mul, self.exp = mul, exp # exp is optional set of indices of rhses of explicitly specified multiplications
+		exp = frozenset (exp)
 
-		return self
+		return tuple.__new__ (cls, ('*', mul, exp) if exp else ('*', mul))
 
 	def __repr__ (self):
 		if not self.exp:
@@ -944,20 +1291,17 @@ class AST_Mul (AST):
 class AST_MulExp (AST): # temporary for isolating explicit multiplications from implicit mul grammar rewriting rules, used only during parsing
 	op, is_mulexp = '*exp', True
 
-	def _init (self, mul):
-		self.mul = mul
+	_fields = ('mul',)
 
 class AST_Div (AST):
 	op, is_div = '/', True
 
-	def _init (self, numer, denom):
-		self.numer, self.denom = numer, denom
+	_fields = ('numer', 'denom')
 
 class AST_Pow (AST):
 	op, is_pow = '^', True
 
-	def _init (self, base, exp):
-		self.base, self.exp = base, exp
+	_fields = ('base', 'exp')
 
 class AST_Log (AST):
 	op, is_log = '-log', True
@@ -1010,8 +1354,7 @@ class AST_Func (AST):
 	PY                = PYALL - {'sqrt', 'log', 'ln', 'beta', 'gamma', 'zeta', 'Lambda', 'Function', 'Symbol'}
 	TEX               = TEXNATIVE | TEX_TRIGH_INV | (TRIGH - {'sech', 'csch'})
 
-	def _init (self, func, args):
-		self.func, self.args = func, args
+	_fields = ('func', 'args')
 
 	_is_func_pseudo       = lambda self: self.func in {AST_Func.NOREMAP, AST_Func.NOEVAL}
 	_is_func_trigh        = lambda self: self.func in AST_Func.PY_TRIGH_ALL
@@ -1021,23 +1364,21 @@ class AST_Func (AST):
 class AST_Lim (AST):
 	op, is_lim = '-lim', True
 
-	def __new__ (cls, lim, lvar, to, dir = None):
-		self                                   = tuple.__new__ (cls, ('-lim', lim, lvar, to) if dir is None else ('-lim', lim, lvar, to, dir))
-		self.lim, self.lvar, self.to, self.dir = lim, lvar, to, dir
+	_fields = ('lim', 'lvar', 'to')
+	dir     = _optional (4)
 
-		return self
+	def __new__ (cls, lim, lvar, to, dir = None):
+		return tuple.__new__ (cls, ('-lim', lim, lvar, to) if dir is None else ('-lim', lim, lvar, to, dir))
 
 class AST_Sum (AST):
 	op, is_sum = '-sum', True
 
-	def _init (self, sum, svar, from_, to):
-		self.sum, self.svar, self.from_, self.to = sum, svar, from_, to
+	_fields = ('sum', 'svar', 'from_', 'to')
 
 class AST_Diff (AST):
 	op, is_diff = '-diff', True
 
-	def _init (self, diff, d, dvs):
-		self.diff, self.d, self.dvs = diff, d, dvs
+	_fields = ('diff', 'd', 'dvs')
 
 	_is_diff_d         = lambda self: self.d == 'd'
 	_is_diff_partial   = lambda self: self.d == 'partial'
@@ -1048,8 +1389,7 @@ class AST_Diff (AST):
 class AST_DiffP (AST):
 	op, is_diffp = '-diffp', True
 
-	def _init (self, diffp, count):
-		self.diffp, self.count = diffp, count
+	_fields = ('diffp', 'count')
 
 	_is_diff_any_ufunc = lambda self: self.diffp.is_ufunc
 	_diff_any          = lambda self: self.diffp
@@ -1057,19 +1397,19 @@ class AST_DiffP (AST):
 class AST_Intg (AST):
 	op, is_intg = '-intg', True
 
-	def __new__ (cls, intg, dv, from_ = None, to = None):
-		self                                    = tuple.__new__ (cls, ('-intg', intg, dv) if from_ is None else ('-intg', intg, dv, from_, to))
-		self.intg, self.dv, self.from_, self.to = intg, dv, from_, to
+	_fields = ('intg', 'dv')
+	from_   = _optional (3)
+	to      = _optional (4)
 
-		return self
+	def __new__ (cls, intg, dv, from_ = None, to = None):
+		return tuple.__new__ (cls, ('-intg', intg, dv) if from_ is None else ('-intg', intg, dv, from_, to))
 
 	_is_intg_definite = lambda self: self.from_ is not None
 
 class AST_Mat (AST):
 	op, is_mat = '-mat', True
 
-	def _init (self, mat):
-		self.mat = mat
+	_fields = ('mat',)
 
 	_rows          = lambda self: self.mat.len
 	_cols          = lambda self: self.mat [0].len if self.mat else 0
@@ -1078,74 +1418,62 @@ class AST_Mat (AST):
 class AST_Piece (AST):
 	op, is_piece = '-piece', True
 
-	def _init (self, piece):
-		self.piece = piece
+	_fields = ('piece',)
 
 class AST_Lamb (AST):
 	op, is_lamb = '-lamb', True
 
-	def _init (self, lamb, vars):
-		self.lamb, self.vars = lamb, vars
+	_fields = ('lamb', 'vars')
 
 class AST_Idx (AST):
 	op, is_idx = '-idx', True
 
-	def _init (self, obj, idx):
-		self.obj, self.idx = obj, idx
+	_fields = ('obj', 'idx')
 
 class AST_Slice (AST):
 	op, is_slice = '-slice', True
 
-	def _init (self, start, stop, step):
-		self.start, self.stop, self.step = start, stop, step
+	_fields = ('start', 'stop', 'step')
 
 class AST_Set (AST):
 	op, is_set = '-set', True
 
-	def _init (self, set):
-		self.set = set
+	_fields = ('set',)
 
 class AST_Dict (AST):
 	op, is_dict = '-dict', True
 
-	def _init (self, dict):
-		self.dict = dict
+	_fields = ('dict',)
 
 class AST_Union (AST):
 	op, is_union = '||', True
 
-	def _init (self, union):
-		self.union = union
+	_fields = ('union',)
 
 class AST_SDiff (AST): # symmetric difference
 	op, is_sdiff = '^^', True
 
-	def _init (self, sdiff):
-		self.sdiff = sdiff
+	_fields = ('sdiff',)
 
 class AST_XSect (AST): # intersection
 	op, is_xsect = '&&', True
 
-	def _init (self, xsect):
-		self.xsect = xsect
+	_fields = ('xsect',)
 
 class AST_Or (AST):
 	op, is_or = '-or', True
 
-	def _init (self, or_):
-		self.or_ = or_
+	_fields = ('or_',)
 
 class AST_And (AST):
 	op, is_and = '-and', True
 
-	def _init (self, and_):
-		self.and_ = and_
+	_fields = ('and_',)
 
 class AST_Not (AST):
 	op, is_not = '-not', True
 
-	def _init (self, not_):
-		self.not_ = not_
+	_fields = ('not_',)
 
 class AST_UFunc (AST):
 	op, is_ufunc = '-ufunc', True
@@ -1195,8 +1523,7 @@ class AST_UFunc (AST):
 class AST_Subs (AST):
 	op, is_subs = '-subs', True
 
-	def _init (self, expr, subs):
-		self.expr, self.subs = expr, subs
+	_fields = ('expr', 'subs')
 
 	_is_subs_diff_ufunc     = lambda self: self.expr.is_diff and self.expr.diff.strip_paren1.is_ufunc
 	_is_subs_diffp_ufunc    = lambda self: self.expr.is_diffp and self.expr.diffp.is_ufunc
@@ -1206,11 +1533,11 @@ class AST_Subs (AST):
 class AST_Sym (AST):
 	op, is_sym = '-sym', True
 
-	def __new__ (cls, sym, kw = ()):
-		self              = tuple.__new__ (cls, ('-sym', sym, kw) if kw else ('-sym', sym))
-		self.sym, self.kw = sym, kw
+	_fields = ('sym',)
+	kw      = _optional (2, ())
 
-		return self
+	def __new__ (cls, sym, kw = ()):
+		return tuple.__new__ (cls, ('-sym', sym, kw) if kw else ('-sym', sym))
 
 	_is_sym_anonymous   = lambda self: not self.sym
 	_is_sym_unqualified = lambda self: not self.kw
@@ -1221,6 +1548,8 @@ _AST_CLASSES = [AST_SColon, AST_Ass, AST_Cmp, AST_Num, AST_Var, AST_Attr, AST_St
 	AST_Lim, AST_Sum, AST_Diff, AST_DiffP, AST_Intg, AST_Mat, AST_Piece, AST_Lamb, AST_Idx, AST_Slice, AST_Set, AST_Dict,
 	AST_Union, AST_SDiff, AST_XSect, AST_Or, AST_And, AST_Not, AST_UFunc, AST_Subs, AST_Sym]
 
+AST.register_lazy (AST)
+
 for _cls in _AST_CLASSES:
 	AST.register_AST (_cls)
 
@@ -16,6 +16,10 @@ LogIdx           = 0;
 UniqueID         = 1;
 
 LastValidation   = null;
+ValidateDelay    = 100; // ms to wait for more typing before sending validation
+ValidatePending  = null; // {idx, text, timer} of validation waiting for typing to pause
+ValidateXHR      = null; // last validation request sent and not answered yet
+SubmitPending    = false; // enter was pressed while validation of input still outstanding
 Validations      = [undefined];
 Evaluations      = [undefined];
 ErrorIdx         = null;
@@ -251,8 +255,8 @@ function updateOverlay (text, erridx, autocomplete) {
 
 //...............................................................................................
 function ajaxValidate (resp) {
-	if (Validations [resp.idx] !== undefined && Validations [resp.idx].subidx >= resp.subidx) {
-		return; // ignore out of order responses (which should never happen with single threaded server)
+	if (resp.superseded || (Validations [resp.idx] !== undefined && Validations [resp.idx].subidx >= resp.subidx)) {
+		return; // ignore out of order responses and those server skipped because newer ones were already waiting
 	}
 
 	LastValidation = resp;
@@ -300,7 +304,7 @@ function ajaxValidate (resp) {
 }
 
 function ajaxEvaluate (resp) {
-	Variables.update (resp.vars);
+	Variables.update (resp);
 
 	Evaluations [resp.idx] = resp;
 	let eLogEval           = document.getElementById ('LogEval' + resp.idx);
@@ -421,19 +425,67 @@ function inputting (text, reset = false) {
 
 	updateOverlay (text, ErrorIdx, Autocomplete);
 
-	$.ajax ({
+	SubmitPending = false;
+
+	if (ValidatePending !== null) {
+		if (ValidatePending.idx === LogIdx) {
+			clearTimeout (ValidatePending.timer);
+		} else {
+			validateFlush (); // different line, not superseded by this one
+		}
+	}
+
+	ValidatePending = {idx: LogIdx, text: text, timer: setTimeout (validateFlush, ValidateDelay)};
+
+	if (reset) {
+		validateFlush ();
+	}
+}
+
+function validateFlush () { // send pending validation now, aborting request for same line still outstanding since its response would be stale
+	if (ValidatePending === null) {
+		return;
+	}
+
+	let {idx, text, timer} = ValidatePending;
+	ValidatePending        = null;
+
+	clearTimeout (timer);
+
+	if (ValidateXHR !== null && ValidateXHR.idx === idx) {
+		let xhr     = ValidateXHR;
+		ValidateXHR = null;
+
+		xhr.abort ();
+	}
+
+	let xhr = $.ajax ({
 		url: URL,
 		type: 'POST',
 		cache: false,
 		dataType: 'json',
 		success: ajaxValidate,
+		complete: function () {
+			if (ValidateXHR === xhr) {
+				ValidateXHR = null;
+
+				if (SubmitPending && ValidatePending === null) { // enter was waiting for this validation
+					SubmitPending = false;
+
+					inputKeypress ({which: 13});
+				}
+			}
+		},
 		data: {
 			mode: 'validate',
-			idx: LogIdx,
+			idx: idx,
 			subidx: UniqueID ++,
 			text: text,
 		},
 	});
+
+	xhr.idx     = idx;
+	ValidateXHR = xhr;
 }
 
 function inputted (text) {
@@ -447,12 +499,13 @@ function inputted (text) {
 			mode: 'evaluate',
 			idx: LogIdx,
 			text: text,
+			vars_rev: Variables.rev,
 		},
 	});
 
 	$('#LogEntry' + LogIdx).append (`
 			<div class="LogEval" id="LogEval${LogIdx}">
-				<img class="LogWait" id="LogEvalWait${LogIdx}" src="${WaitIcon}" width="16">
+				<img class="LogWait" id="LogEvalWait${LogIdx}" src="${WaitIcon}" width="16" title="Click or press Escape to cancel" onclick="cancelEvaluation (${LogIdx})" style="cursor: pointer">
 			</div>`);
 
 	History.push (text);
@@ -464,9 +517,34 @@ function inputted (text) {
 	scrollToEnd ();
 }
 
+function cancelEvaluation (idx = null) { // cancel evaluation idx or all evaluations still running if null, server responds to evaluate request with error
+	for (let i = (idx === null ? 0 : idx); i <= (idx === null ? LogIdx : idx); i ++) {
+		if (Evaluations [i] === undefined && document.getElementById ('LogEvalWait' + i)) {
+			$.ajax ({
+				url: URL,
+				type: 'POST',
+				cache: false,
+				dataType: 'json',
+				data: {
+					mode: 'cancel',
+					idx: i,
+				},
+			});
+		}
+	}
+}
+
 //...............................................................................................
 function inputKeypress (e) {
 	if (e.which == 13) {
+		if (ValidatePending !== null || ValidateXHR !== null) { // error and autocomplete state of what was typed not known yet, submit when it is
+			SubmitPending = true;
+
+			validateFlush ();
+
+			return false;
+		}
+
 		s = JQInput.val ().trim ();
 
 		if ((s && ErrorIdx === null) || s === '?') {
@@ -520,6 +598,8 @@ function inputKeydown (e) {
 			return false;
 		}
 
+		cancelEvaluation ();
+
 	} else if (e.code == 'Tab') {
 		e.preventDefault ();
 		$(this).focus ();
@@ -577,6 +657,8 @@ class _Variables {
 		this.queued_update = null;
 		this.display       = true;
 		this.vars          = new Map ();
+		this.entries       = new Map (); // server entries by variable name, kept up to date from partial responses
+		this.rev           = '';
 	}
 
 	_update (vars) {
@@ -642,7 +724,23 @@ class _Variables {
 		}
 	}
 
-	update (vars) {
+	update (resp) { // resp.vars is full list, otherwise resp.vars_changed and resp.vars_deleted since revision this.rev
+		if (resp.vars !== undefined) {
+			this.entries = new Map (resp.vars.map (function (e) { return [e.name, e]; }));
+
+		} else {
+			for (let n of resp.vars_deleted) {
+				this.entries.delete (n);
+			}
+
+			for (let e of resp.vars_changed) {
+				this.entries.set (e.name, e);
+			}
+		}
+
+		this.rev = resp.vars_rev;
+		let vars = Array.from (this.entries.values ());
+
 		if (this.display) {
 			this._update (vars);
 		} else {
@@ -694,7 +792,7 @@ $(function () {
 		if (MJQueue === null) { // wait for MathJax ready
 			setTimeout (function () { first_vars_update (resp); }, 50);
 		} else {
-			Variables.update (resp.vars);
+			Variables.update (resp);
 		}
 	}
 
@@ -6,8 +6,12 @@
 import getopt
 import io
 import json
+import multiprocessing
 import os
+import pickle
 import re
+import secrets
+import signal
 import subprocess
 import sys
 import time
@@ -15,8 +19,11 @@ import threading
 import traceback
 import webbrowser
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from http.cookies import SimpleCookie
 from http.server import HTTPServer, SimpleHTTPRequestHandler
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
 from socketserver import ThreadingMixIn
 from urllib.parse import parse_qs
 
@@ -28,7 +35,7 @@ _ONE_FUNCS       = {'N', 'O', 'S', 'beta', 'gamma', 'Gamma', 'Lambda', 'zeta'}
 _ENV_OPTS        = {'EI', 'quick', 'pyS', 'simplify', 'matsimp', 'ufuncmap', 'prodrat', 'doit', 'strict', *_ONE_FUNCS}
 _ENV_OPTS_ALL    = _ENV_OPTS.union (f'no{opt}' for opt in _ENV_OPTS)
 
-__OPTS, __ARGV   = getopt.getopt (sys.argv [1:], 'hvnudr', ['child', 'firstrun', 'help', 'version', 'nobrowser', 'ugly', 'debug', 'restert', *_ENV_OPTS_ALL])
+__OPTS, __ARGV   = getopt.getopt (sys.argv [1:], 'hvnudr', ['child', 'firstrun', 'help', 'version', 'nobrowser', 'ugly', 'debug', 'restert', 'timeout=', 'nowarm', *_ENV_OPTS_ALL])
 __IS_MAIN        = __name__ == '__main__'
 __IS_MODULE_RUN  = sys.argv [0] == '-m'
 
@@ -42,6 +49,7 @@ _SYMPAD_FIRSTRUN = not _SYMPAD_RESTART or ('--firstrun', '') in __OPTS
 _SYMPAD_DEBUG    = os.environ.get ('SYMPAD_DEBUG')
 
 _DEFAULT_ADDRESS = ('localhost', 9000)
+_SESSION_COOKIE  = 'sympad_session'
 _FILES           = {} # pylint food # AUTO_REMOVE_IN_SINGLE_SCRIPT
 _STATIC_FILES    = {'/style.css': 'text/css', '/script.js': 'text/javascript', '/index.html': 'text/html',
 	'/help.html': 'text/html', '/bg.png': 'image/png', '/wait.webp': 'image/webp'}
@@ -54,6 +62,8 @@ _HELP            = f'usage: sympad [options] [host:port | host | :port]' '''
   -u, --ugly               - Start in draft display style (only on command line)
   -d, --debug              - Dump debug info to server log
   -r, --restart            - Restart server on source file changes (for development)
+  --timeout=seconds        - Kill evaluations which take longer than this, default no limit
+  --nowarm                 - Don't warm up SymPy caches before starting evaluation processes
   --EI, --noEI             - Start with SymPy constants 'E' and 'I' or regular 'e' and 'i'
   --quick, --noquick       - Start in/not quick input mode
   --pyS, --nopyS           - Start with/out Python S escaping
@@ -86,32 +96,157 @@ if _SYMPAD_CHILD: # sympy slow to import so don't do it for watcher process as i
 
 	_SYS_STDOUT    = sys.stdout
 	_DISPLAYSTYLE  = [1] # use "\displaystyle{}" formatting in MathJax
-	_HISTORY       = []  # persistent history across browser closings
 
-	_UFUNC_MAPBACK = True # map undefined functions from SymPy back to variables if possible
-	_UFUNC_MAP     = {} # map of ufunc asts to ordered sequence of variable names
-	_SYM_MAP       = {} # map of sym asts to ordered sequence of variable names
-	_SYM_VARS      = set () # set of all variables mapped to symbols
-
-	_PARSER        = sparser.Parser ()
+	_PARSER        = sparser.Parser (cache_size = 256) # cache so evaluate after validate and retyping recent text do not reparse
+	_PARSE_BUDGET  = (None, 1) # (max branches, max seconds) for validation parse, best result so far is displayed if exceeded
+	_RENDERS_NUM   = 1024 # top level renderings sym caches while a session is active, vars panel re-renders every variable after each evaluate, mostly unchanged
 	_START_ENV     = OrderedDict ([
 		('EI', False), ('quick', False), ('pyS', True), ('simplify', False), ('matsimp', True), ('ufuncmap', True), ('prodrat', False), ('doit', True), ('strict', False),
 		('N', True), ('O', True), ('S', True), ('beta', True), ('gamma', True), ('Gamma', True), ('Lambda', True), ('zeta', True)])
 
-	_ENV           = _START_ENV.copy () # This is individual session STATE! Threading can corrupt this! It is GLOBAL to survive multiple Handlers.
-	_VARS          = {'_': AST.Zero} # This also!
-	_VARS_FLAT     = _VARS.copy () # Flattened vars.
+	_SESSIONS      = {} # {session id: _Session, ...} - session None is used by clients which don't send a session cookie and is never evicted
+	_SESSION_LOCK  = threading.Lock () # sym, sparser, spatch and AST configuration is global so only one session can be active at a time
+	_SESSION_ACT   = [None] # session whose configuration is currently loaded into the global modules
+	_SESSION_CNT   = [0] # number of sessions created, for session revision epoch
+	_SESSION_IDLE  = 24 * 60 * 60 # seconds after which a session not accessed is evicted
+	_SESSION_EVICT = [0] # time of last eviction check
+	_VALIDATING    = {} # {(session id, idx): [newest subidx, count], ...} - validations of input line waiting for or holding the session lock, only for clients with session cookie
+	_VALIDATE_LOCK = threading.Lock ()
+	_INTERN_LIMIT  = [4096] # AST intern table size above which it is cleared and all vars of session being updated flattened anew
+
+	_SESSION_EVAL_STATE = ('env', 'vars', 'vars_flat', 'vars_prev', 'vars_refs', 'vars_users', 'vars_funcs', 'user_funcs', 'ufunc_map', 'sym_map', 'sym_vars')
+
+	_MP            = multiprocessing.get_context ('fork' if 'fork' in multiprocessing.get_all_start_methods () else 'spawn') # fork shares already imported SymPy with workers
+	_WORKERS       = deque () # idle evaluation worker processes, None for one which could not be started and is tried again when needed
+	_WORKERS_COND  = threading.Condition () # guards _WORKERS, notified when worker is put back
+	_ZYGOTE        = [None] # process which forks evaluation workers if fork is available
+	_EVAL_TIMEOUT  = [None] # seconds after which an evaluation is killed, None for no limit
+	_WORKERS_NUM   = max (2, min (4, os.cpu_count () or 1)) # number of evaluations which can run at once, at least two so one long evaluation doesn't hold up everyone else
+	_WORKER_STATES = 8 # number of sessions whose state each worker keeps so that it doesn't need to be sent with every evaluation
+
+#...............................................................................................
+class _Session: # state of one client, configuration of the global modules is loaded from the session being used by activate ()
+	def __init__ (self, sid):
+		_SESSION_CNT [0] += 1
+
+		self.sid           = sid
+		self.epoch         = f'{os.getpid ()}.{_SESSION_CNT [0]}' # revisions from a different server process or session are not valid
+		self.atime         = time.time () # last access time for idle eviction
+		self.history       = [] # persistent history across browser closings
+		self.parse_session = lalr1.Session () # incremental parse state for validation of text being typed
+
+		self.env           = _START_ENV.copy ()
+		self.vars          = {'_': AST.Zero}
+		self.vars_flat     = self.vars.copy () # flattened vars
+		self.vars_prev     = {} # {name: ast, ...} - vars as of last _vars_updated (), changed vars are found by identity
+		self.vars_refs     = {} # {name: {name, ...}, ...} - names each stored var may look up when flattened
+		self.vars_users    = {} # {name: {name, ...}, ...} - reverse of vars_refs, vars to re-flatten when name changes
+		self.vars_funcs    = set () # flattened vars which are user lambdas or assigned to concrete functions
+		self.user_funcs    = set () # vars_funcs plus hidden functions enabled in env, as passed to sym and sparser
+		self.ufunc_map     = {} # map of ufunc asts to ordered sequence of variable names
+		self.sym_map       = {} # map of sym asts to ordered sequence of variable names
+		self.sym_vars      = set () # set of all variables mapped to symbols
+		self.state_rev     = 0 # revision of state above, incremented when evaluation changes it, workers which have the current revision are only sent the text
+		self.vars_sent     = {} # {name: (rev, {'name': name, 'tex': tex, 'nat': nat, 'py': py}), ...} - current presented vars and revision they last changed at
+		self.vars_deleted  = {} # {name: rev, ...} - presented vars deleted since and revision of deletion
+		self.vars_rev      = 0 # revision of presented vars, incremented per changed var
+		self.turn          = threading.Condition () # evaluations of session are done one at a time in order of arrival
+		self.tickets       = [0, 0] # [next ticket to hand out, ticket being evaluated]
+		self.evals         = {} # {ticket: [idx, None if waiting for turn, worker if evaluating or False if cancelled], ...} - evaluations of session not finished yet
+
+	def eval_state (self): # state needed and changed by evaluation in worker process
+		return {name: getattr (self, name) for name in _SESSION_EVAL_STATE}
+
+	def load_state (self, state): # whole state in worker process, configuration of global modules needs reloading
+		self.__dict__.update (state)
+
+		if _SESSION_ACT [0] is self:
+			_SESSION_ACT [0] = None
+
+	def apply_delta (self, delta): # changes made by evaluation in worker process from _state_delta ()
+		for name, val in delta.items ():
+			if isinstance (getattr (self, name), dict): # new dict rather than update since sym and sparser may hold the old one
+				changed, deleted = val
+				val              = {k: v for k, v in getattr (self, name).items () if k not in deleted}
+
+				val.update (changed)
+
+			setattr (self, name, val)
+
+		self.state_rev += 1
+
+		if _SESSION_ACT [0] is self:
+			_SESSION_ACT [0] = None
+
+	def activate (self): # make this the session the global modules are configured for, must hold _SESSION_LOCK
+		self.atime = time.time ()
+
+		if _SESSION_ACT [0] is not self:
+			_SESSION_ACT [0] = self
+
+			sym.set_render_cache (_RENDERS_NUM) # here rather than at import so global modules are only configured once server is in use
+
+			for var, state in self.env.items ():
+				_env_apply (var, state)
+
+			sym.set_sym_user_funcs (self.user_funcs)
+			sym.set_sym_user_vars (self.vars_flat)
+			sparser.set_sp_user_funcs (self.user_funcs)
+			sparser.set_sp_user_vars (self.vars_flat)
+
+def _session (sid): # get or create and activate session, evicts sessions idle for too long, must hold _SESSION_LOCK
+	now = time.time ()
+
+	if now - _SESSION_EVICT [0] > 60:
+		_SESSION_EVICT [0] = now
+
+		for s in [s for s in _SESSIONS.values () if s.sid is not None and now - s.atime > _SESSION_IDLE]:
+			del _SESSIONS [s.sid]
+
+	sess = _SESSIONS.get (sid)
+
+	if sess is not None:
+		sess.activate ()
+
+	else:
+		sess = _SESSIONS [sid] = _Session (sid)
+
+		sess.activate ()
+		_vars_updated (sess)
+
+	return sess
+
+def _env_apply (var, state): # load environment setting into global module configuration
+	if var == 'EI':
+		AST.EI (state)
+
+	elif var == 'quick':
+		sym.set_quick (state)
+		_PARSER.set_quick (state)
+
+	elif var == 'pyS':
+		sym.set_pyS (state)
+	elif var == 'simplify':
+		sym.set_simplify (state)
+	elif var == 'matsimp':
+		spatch.set_matmulsimp (state)
+	elif var == 'prodrat':
+		sym.set_prodrat (state)
+	elif var == 'doit':
+		sym.set_doit (state)
+	elif var == 'strict':
+		sym.set_strict (state)
 
 #...............................................................................................
-def _admin_vars (*args):
-	asts = _sorted_vars ()
+def _admin_vars (sess, *args):
+	asts = _sorted_vars (sess)
 
 	if not asts:
 		return 'No variables defined.'
 
 	return asts
 
-def _admin_del (*args):
+def _admin_del (sess, *args):
 	vars = OrderedDict ()
 	msgs = []
 
@@ -121,7 +256,7 @@ def _admin_del (*args):
 		if var is None or var == '_':
 			raise TypeError (f'invalid argument {sym.ast2nat (arg)!r}')
 
-		vars [var] = _VARS.get (var)
+		vars [var] = sess.vars.get (var)
 
 		if vars [var] is None:
 			raise AE35UnitError (f'Variable {var!r} is not defined, it can only be attributable to human error.')
@@ -129,27 +264,27 @@ def _admin_del (*args):
 	for var, ast in vars.items ():
 		msgs.append (f'{"Lambda function" if ast.is_lamb else "Undefined function" if ast.is_ufunc else "Variable"} {var!r} deleted.')
 
-		del _VARS [var]
+		del sess.vars [var]
 
-	_vars_updated ()
+	_vars_updated (sess)
 
 	if not msgs:
 		msgs.append ('No variables specified!')
 
 	return msgs
 
-def _admin_delall (*args):
-	last_var    = _VARS ['_']
+def _admin_delall (sess, *args):
+	last_var        = sess.vars ['_']
 
-	_VARS.clear ()
+	sess.vars.clear ()
 
-	_VARS ['_'] = last_var
+	sess.vars ['_'] = last_var
 
-	_vars_updated ()
+	_vars_updated (sess)
 
 	return 'All variables deleted.'
 
-def _admin_env (*args):
+def _admin_env (sess, *args):
 	vars_updated = False
 
 	def _envop (env, apply):
@@ -159,70 +294,39 @@ def _admin_env (*args):
 
 		for var, state in env.items ():
 			if apply:
-				_ENV [var] = state
+				sess.env [var] = state
+
+				_env_apply (var, state)
 
 			if var == 'EI':
 				msgs.append (f'Uppercase E and I is {"on" if state else "off"}.')
 
 				if apply:
-					AST.EI (state)
-
 					for var in (AST.E.var, AST.I.var):
-						if var in _VARS:
-							del _VARS [var]
+						if var in sess.vars:
+							del sess.vars [var]
 
 			elif var == 'quick':
 				msgs.append (f'Quick input mode is {"on" if state else "off"}.')
 
 				if apply:
-					sym.set_quick (state)
-					_PARSER.set_quick (state)
-
 					vars_updated = True
 
 			elif var == 'pyS':
 				msgs.append (f'Python S escaping is {"on" if state else "off"}.')
-
-				if apply:
-					sym.set_pyS (state)
-
 			elif var == 'simplify':
 				msgs.append (f'Post-evaluation simplify is {"on" if state else "off"}.')
-
-				if apply:
-					sym.set_simplify (state)
-
 			elif var == 'matsimp':
 				msgs.append (f'Matrix simplify is {"broken" if not spatch.SPATCHED else "on" if state else "off"}.')
-
-				if apply:
-					spatch.set_matmulsimp (state)
-
 			elif var == 'ufuncmap':
 				msgs.append (f'Undefined function map to variable is {"on" if state else "off"}.')
-
-				if apply:
-					global _UFUNC_MAPBACK
-					_UFUNC_MAPBACK = state
-
 			elif var == 'prodrat':
 				msgs.append (f'Leading product rational is {"on" if state else "off"}.')
-
-				if apply:
-					sym.set_prodrat (state)
-
 			elif var == 'doit':
 				msgs.append (f'Expression doit is {"on" if state else "off"}.')
-
-				if apply:
-					sym.set_doit (state)
-
 			elif var == 'strict':
 				msgs.append (f'Strict LaTeX formatting is {"on" if state else "off"}.')
 
-				if apply:
-					sym.set_strict (state)
-
 			elif var in _ONE_FUNCS:
 				msgs.append (f'Function {var} is {"on" if state else "off"}.')
 
@@ -233,7 +337,7 @@ def _admin_env (*args):
 
 	# start here
 	if not args:
-		return _envop (_ENV, False)
+		return _envop (sess.env, False)
 
 	env = OrderedDict ()
 
@@ -263,59 +367,72 @@ def _admin_env (*args):
 	ret = _envop (env, True)
 
 	if vars_updated:
-		_vars_updated ()
+		_vars_updated (sess)
 
 	return ret
 
-def _admin_envreset (*args):
-	return ['Environment has been reset.'] + _admin_env (*(AST ('@', var if state else f'no{var}') for var, state in _START_ENV.items ()))
+def _admin_envreset (sess, *args):
+	return ['Environment has been reset.'] + _admin_env (sess, *(AST ('@', var if state else f'no{var}') for var, state in _START_ENV.items ()))
 
 #...............................................................................................
 class RealityRedefinitionError (NameError):	pass
 class CircularReferenceError (RecursionError): pass
 class AE35UnitError (Exception): pass
 
-def _mapback (ast, assvar = None, exclude = set ()): # map back ufuncs and symbols to the variables they are assigned to if possible
-	if not isinstance (ast, AST):
-		return ast
+def _mapback (sess, ast, assvar = None, exclude = set ()): # map back ufuncs and symbols to the variables they are assigned to if possible
+	names = sess.sym_vars.union ((s.sym for s in sess.sym_map), (u.ufunc for u in sess.ufunc_map) if sess.env ['ufuncmap'] else ()) # subtrees without any of these can not change
 
-	if ast.is_var:
-		if ast.var not in _SYM_VARS:
+	def mapback (ast):
+		if not isinstance (ast, AST) or names.isdisjoint (ast.var_names):
 			return ast
 
-		if ast.var == assvar:
-			raise CircularReferenceError ('trying to assign unqualified symbol to variable of the same name')
+		if ast.is_var:
+			if ast.var not in sess.sym_vars:
+				return ast
 
-		return AST ('-sym', ast.var)
+			if ast.var == assvar:
+				raise CircularReferenceError ('trying to assign unqualified symbol to variable of the same name')
 
-	if ast.is_sym:
-		vars = _SYM_MAP.get (ast)
+			return AST ('-sym', ast.var)
 
-		if not vars:
-			return ast
+		if ast.is_sym:
+			vars = sess.sym_map.get (ast)
+
+			if not vars:
+				return ast
+
+			if ast.sym in vars:
+				return AST ('@', ast.sym)
+
+			return AST ('@', next (iter (vars)))
+
+		if sess.env ['ufuncmap']:
+			if ast.is_ass and ast.lhs.is_ufunc:
+				rhs = mapback (ast.rhs)
 
-		if ast.sym in vars:
-			return AST ('@', ast.sym)
+				return ast if rhs is ast.rhs else AST ('=', ast.lhs, rhs)
 
-		return AST ('@', next (iter (vars)))
+			elif not ast.is_ufunc:
+				return mapback_children (ast)
 
-	if _UFUNC_MAPBACK:
-		if ast.is_ass and ast.lhs.is_ufunc:
-			return AST ('=', ast.lhs, _mapback (ast.rhs, assvar, exclude))
-		elif not ast.is_ufunc:
-			return AST (*(_mapback (a, assvar, exclude) for a in ast))
+			vars = sess.ufunc_map.get (ast)
 
-		vars = _UFUNC_MAP.get (ast)
+			if vars: # prevent mapping to self on assignment
+				if ast.ufunc in vars and ast.ufunc not in exclude:
+					return AST ('@', ast.ufunc)
 
-		if vars: # prevent mapping to self on assignment
-			if ast.ufunc in vars and ast.ufunc not in exclude:
-				return AST ('@', ast.ufunc)
+				for var in vars:
+					if var not in exclude:
+						return AST ('@', var)
 
-			for var in vars:
-				if var not in exclude:
-					return AST ('@', var)
+		return mapback_children (ast)
 
-	return AST (*(_mapback (a, assvar, exclude) for a in ast))
+	def mapback_children (ast): # copy on write, ast returned as is if no children changed
+		args = [mapback (a) for a in ast]
+
+		return AST (*args) if any (x is not a for x, a in zip (args, ast)) else ast
+
+	return mapback (ast)
 
 def _present_vars (vars):
 	asts = []
@@ -329,39 +446,144 @@ def _present_vars (vars):
 
 	return asts
 
-def _sorted_vars ():
-	return _present_vars (sorted (_VARS.items (), key = lambda kv: (kv [1].op not in {'-lamb', '-ufunc'}, kv [0])))
+def _sorted_vars (sess):
+	return _present_vars (sorted (sess.vars.items (), key = lambda kv: (kv [1].op not in {'-lamb', '-ufunc'}, kv [0])))
 
-def _vars_updated ():
-	global _VARS_FLAT
+def _vars_revise (sess): # render presented vars and stamp changed ones with new revision, returns names in presentation order
+	names = []
 
-	vars    = {v: a if a.is_lamb else AST.apply_vars (a, _VARS, mode = False) for v, a in _VARS.items ()} # flattened vars so sym and sparser don't need to do apply_vars()
-	one     = (f for f in filter (lambda f: _ENV.get (f), _ONE_FUNCS)) # hidden functions for stuff like Gamma
-	lamb    = (va [0] for va in filter (lambda va: va [1].is_lamb, vars.items ())) # user lambda functions
-	assfunc = (va [0] for va in filter (lambda va: va [1].is_var and va [1].var in AST.Func.PYBASE, vars.items ())) # user variables assigned to concrete functions
-	funcs   = {*one, *lamb, *assfunc}
+	for ast in _sorted_vars (sess):
+		name = ast.lhs.var if ast.lhs.is_var else ast.lhs.ufunc
+		math = dict (zip (('name', 'tex', 'nat', 'py'), (name, *sym.ast2all (ast))))
+		sent = sess.vars_sent.get (name)
 
-	sym.set_sym_user_vars (vars)
-	sym.set_sym_user_funcs (funcs)
-	sparser.set_sp_user_vars (vars)
-	sparser.set_sp_user_funcs (funcs)
+		names.append (name)
 
-	_UFUNC_MAP.clear ()
-	_SYM_MAP.clear ()
-	_SYM_VARS.clear ()
+		if sent is None or sent [1] != math:
+			sess.vars_rev         += 1
+			sess.vars_sent [name]  = (sess.vars_rev, math)
 
-	_VARS_FLAT = vars
+			sess.vars_deleted.pop (name, None)
 
-	for v, a in vars.items (): # build ufunc and sym mapback dict
-		if v != '_':
+	for name in set (sess.vars_sent) - set (names):
+		sess.vars_rev             += 1
+		sess.vars_deleted [name]  = sess.vars_rev
+
+		del sess.vars_sent [name]
+
+	return names
+
+def _var_refs (ast): # names an expression may look up in vars when flattened by AST.apply_vars (), conservative
+	refs  = set ()
+	stack = [ast]
+
+	while stack:
+		ast = stack.pop ()
+
+		if isinstance (ast, AST):
+			if ast.is_var:
+				refs.update ((ast.var, ast.var_name))
+			elif ast.is_func:
+				refs.add (ast.func)
+			elif ast.is_ufunc:
+				refs.add (ast.ufunc)
+			elif ast.is_diff:
+				refs.update (v for v, _ in ast.dvs)
+
+			stack.extend (ast)
+
+	return refs
+
+def _vars_updated (sess): # re-flatten vars which changed and those which refer to them directly or through other vars, sess must be active
+	if len (AST._INTERNED) > _INTERN_LIMIT [0]: # only keep canonical ASTs for current vars, shares common subtrees between stored and flattened vars
+		AST.intern_clear ()
+
+		for state in (sess.vars_refs, sess.vars_users, sess.vars_funcs, sess.ufunc_map, sess.sym_map, sess.sym_vars):
+			state.clear ()
+
+		sess.vars_flat, sess.vars_prev = {}, {}
+		full                           = True
+
+	else:
+		full = False
+
+	changed = {v for v in sess.vars.keys () | sess.vars_prev.keys () if sess.vars.get (v) is not sess.vars_prev.get (v)}
+
+	for v in changed:
+		for r in sess.vars_refs.pop (v, ()):
+			sess.vars_users [r].discard (v)
+
+		if v in sess.vars:
+			sess.vars [v]      = AST.intern (sess.vars [v])
+			sess.vars_refs [v] = _var_refs (sess.vars [v])
+
+			for r in sess.vars_refs [v]:
+				sess.vars_users.setdefault (r, set ()).add (v)
+
+	affected = set ()
+	todo     = list (changed)
+
+	while todo:
+		v = todo.pop ()
+
+		if v not in affected:
+			affected.add (v)
+			todo.extend (sess.vars_users.get (v, ()))
+
+	flat = {v: AST.intern (a if a.is_lamb else AST.apply_vars (a, sess.vars, mode = False)) for v, a in ((v, sess.vars [v]) for v in affected if v in sess.vars)} # flattened vars so sym and sparser don't need to do apply_vars()
+	vars = sess.vars_flat.copy ()
+
+	for v in affected: # update ufunc and sym mapback dicts and user funcs for re-flattened vars
+		a = vars.pop (v, None)
+
+		if a is not None and v != '_':
 			if a.is_ufunc:
-				_UFUNC_MAP.setdefault (a, set ()).add (v)
+				sess.ufunc_map [a].discard (v)
+
+				if not sess.ufunc_map [a]:
+					del sess.ufunc_map [a]
 
 			elif a.is_sym:
-				_SYM_MAP.setdefault (a, set ()).add (v)
-				_SYM_VARS.add (v)
+				sess.sym_map [a].discard (v)
+				sess.sym_vars.discard (v)
+
+				if not sess.sym_map [a]:
+					del sess.sym_map [a]
+
+		sess.vars_funcs.discard (v)
+
+		a = flat.get (v)
+
+		if a is not None:
+			vars [v] = a
+
+			if a.is_lamb or (a.is_var and a.var in AST.Func.PYBASE): # user lambda functions or variables assigned to concrete functions
+				sess.vars_funcs.add (v)
+
+			if v != '_':
+				if a.is_ufunc:
+					sess.ufunc_map.setdefault (a, set ()).add (v)
+
+				elif a.is_sym:
+					sess.sym_map.setdefault (a, set ()).add (v)
+					sess.sym_vars.add (v)
+
+	one   = (f for f in filter (lambda f: sess.env.get (f), _ONE_FUNCS)) # hidden functions for stuff like Gamma
+	funcs = {*one, *sess.vars_funcs}
+
+	sym.set_sym_user_vars (vars)
+	sym.set_sym_user_funcs (funcs)
+	sparser.set_sp_user_vars (vars)
+	sparser.set_sp_user_funcs (funcs)
+
+	sess.vars_flat  = vars
+	sess.vars_prev  = sess.vars.copy ()
+	sess.user_funcs = funcs
 
-def _prepare_ass (ast): # check and prepare for simple or tuple assignment
+	if full:
+		_INTERN_LIMIT [0] = 2 * len (AST._INTERNED) + 4096
+
+def _prepare_ass (sess, ast): # check and prepare for simple or tuple assignment
 	if not ast.ass_valid:
 		vars = None
 	elif ast.ass_valid.error:
@@ -371,9 +593,9 @@ def _prepare_ass (ast): # check and prepare for simple or tuple assignment
 		vars, ast = ast.ass_valid.lhs, ast.ass_valid.rhs
 		vars      = list (vars.comma) if vars.is_comma else [vars]
 
-	return AST.apply_vars (ast, _VARS_FLAT), vars
+	return AST.apply_vars (ast, sess.vars_flat), vars
 
-def _execute_ass (ast, vars): # execute assignment if it was detected
+def _execute_ass (sess, ast, vars): # execute assignment if it was detected
 	def set_vars (vars):
 		nvars = {}
 
@@ -396,28 +618,28 @@ def _execute_ass (ast, vars): # execute assignment if it was detected
 			nvars [v] = a
 
 		try: # check for circular references
-			AST.apply_vars (AST (',', tuple (('@', v) for v in nvars)), {**_VARS, **nvars})
+			AST.apply_vars (AST (',', tuple (('@', v) for v in nvars)), {**sess.vars, **nvars})
 		except RecursionError:
 			raise CircularReferenceError ("I'm sorry, Dave. I'm afraid I can't do that.") from None
 
-		_VARS.update (nvars)
+		sess.vars.update (nvars)
 
 		return list (nvars.items ())
 
 	# start here
 	if not vars: # no assignment
 		if not ast.is_ufunc:
-			ast = _mapback (ast)
+			ast = _mapback (sess, ast)
 
-		_VARS ['_'] = ast
+		sess.vars ['_'] = ast
 
-		_vars_updated ()
+		_vars_updated (sess)
 
 		return [ast]
 
 	if len (vars) == 1: # simple assignment
 		if ast.op not in {'-ufunc', '-sym'}:
-			ast = _mapback (ast, vars [0].var, {vars [0].var})
+			ast = _mapback (sess, ast, vars [0].var, {vars [0].var})
 
 		vars = set_vars ({vars [0]: ast})
 
@@ -452,167 +674,510 @@ def _execute_ass (ast, vars): # execute assignment if it was detected
 
 		vasts   = list (zip (vars, asts))
 		exclude = set (va [0].var for va in filter (lambda va: va [1].is_ufunc, vasts))
-		asts    = [a if a.op in {'-ufunc', '-sym'} else _mapback (a, v.var, exclude) for v, a in vasts]
+		asts    = [a if a.op in {'-ufunc', '-sym'} else _mapback (sess, a, v.var, exclude) for v, a in vasts]
 		vars    = set_vars (dict (zip (vars, asts)))
 
-	_vars_updated ()
+	_vars_updated (sess)
 
 	return _present_vars (vars)
 
-#...............................................................................................
-class Handler (SimpleHTTPRequestHandler):
-	def vars (self, request):
-		asts = _sorted_vars ()
+def _evaluate (sess, text, ast = None): # evaluate text or already parsed ast of text for session, sess must be active
+	def evalexpr (ast):
+		prec = ast.num_prec # float precision from numbers as entered, not as they wind up after variable substitution
 
-		return {'vars': [{
-			'tex': sym.ast2tex (ast),
-			'nat': sym.ast2nat (ast),
-			'py' : sym.ast2py (ast),
-			} for ast in asts]}
+		if ast.is_func and ast.func in AST.Func.PLOT: # plotting?
+			args, kw = AST.args2kwargs (AST.apply_vars (ast.args, sess.vars), lambda a: sym.ast2spt (a, prec = prec))
+			ret      = getattr (splot, ast.func) (*args, **kw)
 
-	def validate (self, request):
-		ast, erridx, autocomplete, error = _PARSER.parse (request ['text'])
-		tex = nat = py                   = None
+			return {'msg': ['Plotting not available because matplotlib is not installed.']} if ret is None else {'img': ret}
 
-		if ast is not None:
-			tex, xlattex = sym.ast2tex (ast, retxlat = True)
-			nat, xlatnat = sym.ast2nat (ast, retxlat = True)
-			py, xlatpy  = sym.ast2py (ast, retxlat = True)
+		elif ast.op in {'@', '-func'} and ast [1] in AST.Func.ADMIN: # special admin function?
+			asts = globals () [f'_admin_{ast [1]}'] (sess, *(ast.args if ast.is_func else ()))
+
+			if isinstance (asts, str):
+				return {'msg': [asts]}
+			elif isinstance (asts, list) and isinstance (asts [0], str):
+				return {'msg': asts}
+
+		else: # not admin function, normal evaluation
+			ast, vars = _prepare_ass (sess, ast)
 
 			if _SYMPAD_DEBUG:
-				print ('free:', list (v.var for v in ast.free_vars), file = sys.stderr)
-				print ('ast: ', ast, file = sys.stderr)
+				print ('ast:       ', ast, file = sys.stderr)
 
-				if xlattex:
-					print ('astt:', repr (xlattex), file = sys.stderr)
+			try:
+				spt, xlat = sym.ast2spt (ast, retxlat = True, prec = prec) # , sess.vars)
 
-				if xlatnat:
-					print ('astn:', repr (xlatnat), file = sys.stderr)
+				if _SYMPAD_DEBUG and xlat:
+					print ('xlat:      ', xlat, file = sys.stderr)
 
-				if xlatpy:
-					print ('astp:', repr (xlatpy), file = sys.stderr)
+				sptast = sym.spt2ast (spt)
 
-				print ('tex: ', tex, file = sys.stderr)
-				print ('nat: ', nat, file = sys.stderr)
-				print ('py:  ', py, file = sys.stderr)
+			except:
+				if _SYMPAD_DEBUG:
+					print (file = sys.stderr)
+
+				raise
+
+			if _SYMPAD_DEBUG:
+				try:
+					print ('spt:       ', repr (spt), file = sys.stderr)
+				except:
+					pass
+
+				print ('spt type:  ', type (spt), file = sys.stderr)
+
+				try:
+					print ('spt args:  ', repr (spt.args), file = sys.stderr)
+				except:
+					pass
+
+				print ('spt latex: ', sp.latex (spt), file = sys.stderr)
+				print ('spt ast:   ', sptast, file = sys.stderr)
+				print ('spt tex:   ', sym.ast2tex (sptast), file = sys.stderr)
+				print ('spt nat:   ', sym.ast2nat (sptast), file = sys.stderr)
+				print ('spt py:    ', sym.ast2py (sptast), file = sys.stderr)
 				print (file = sys.stderr)
 
-		if isinstance (error, Exception):
-			error = (f'{error.__class__.__name__}: ' if not isinstance (error, SyntaxError) else '') + error.args [0].replace ('\n', ' ').strip ()
+			asts = _execute_ass (sess, sptast, vars)
 
-		return {
-			'tex'         : tex,
-			'nat'         : nat,
-			'py'          : py,
-			'erridx'      : erridx,
-			'autocomplete': autocomplete,
-			'error'       : error,
-		}
+		response = {}
 
-	def evaluate (self, request):
-		def evalexpr (ast):
-			sym.ast2spt.set_precision (ast)
+		if asts and asts [0] != AST.None_:
+			response.update ({'math': [dict (zip (('tex', 'nat', 'py'), sym.ast2all (ast))) for ast in asts]})
 
-			if ast.is_func and ast.func in AST.Func.PLOT: # plotting?
-				args, kw = AST.args2kwargs (AST.apply_vars (ast.args, _VARS), sym.ast2spt)
-				ret      = getattr (splot, ast.func) (*args, **kw)
+		return response
 
-				return {'msg': ['Plotting not available because matplotlib is not installed.']} if ret is None else {'img': ret}
+	# start here
+	responses = []
 
-			elif ast.op in {'@', '-func'} and ast [1] in AST.Func.ADMIN: # special admin function?
-				asts = globals () [f'_admin_{ast [1]}'] (*(ast.args if ast.is_func else ()))
+	try:
+		if ast is None:
+			ast, _, _, _ = _PARSER.parse (text)
 
-				if isinstance (asts, str):
-					return {'msg': [asts]}
-				elif isinstance (asts, list) and isinstance (asts [0], str):
-					return {'msg': asts}
+		if ast:
+			for ast in (ast.scolon if ast.is_scolon else (ast,)):
+				sys.stdout = _SYS_STDOUT if _SERVER_DEBUG else io.StringIO ()
+				response   = evalexpr (ast)
 
-			else: # not admin function, normal evaluation
-				ast, vars = _prepare_ass (ast)
+				if sys.stdout.tell ():
+					responses.append ({'msg': sys.stdout.getvalue ().strip ().split ('\n')})
 
-				if _SYMPAD_DEBUG:
-					print ('ast:       ', ast, file = sys.stderr)
+				responses.append (response)
 
-				try:
-					spt, xlat = sym.ast2spt (ast, retxlat = True) # , _VARS)
+	except Exception:
+		if sys.stdout is not _SYS_STDOUT and sys.stdout.tell (): # flush any printed messages before exception
+			responses.append ({'msg': sys.stdout.getvalue ().strip ().split ('\n')})
 
-					if _SYMPAD_DEBUG and xlat:
-						print ('xlat:      ', xlat, file = sys.stderr)
+		etype, exc, tb = sys.exc_info ()
 
-					sptast = sym.spt2ast (spt)
+		if exc.args and isinstance (exc.args [0], str):
+			exc = etype (exc.args [0].replace ('\n', ' ').strip (), *exc.args [1:]).with_traceback (tb) # reformat text to remove newlines
 
-				except:
-					if _SYMPAD_DEBUG:
-						print (file = sys.stderr)
+		responses.append ({'err': ''.join (traceback.format_exception (etype, exc, tb)).strip ().split ('\n')})
 
-					raise
+	finally:
+		sys.stdout = _SYS_STDOUT
 
-				if _SYMPAD_DEBUG:
-					try:
-						print ('spt:       ', repr (spt), file = sys.stderr)
-					except:
-						pass
+	return {'data': responses} if responses else {}
 
-					print ('spt type:  ', type (spt), file = sys.stderr)
+#...............................................................................................
+class WorkerError (RuntimeError): pass
 
-					try:
-						print ('spt args:  ', repr (spt.args), file = sys.stderr)
-					except:
-						pass
-
-					print ('spt latex: ', sp.latex (spt), file = sys.stderr)
-					print ('spt ast:   ', sptast, file = sys.stderr)
-					print ('spt tex:   ', sym.ast2tex (sptast), file = sys.stderr)
-					print ('spt nat:   ', sym.ast2nat (sptast), file = sys.stderr)
-					print ('spt py:    ', sym.ast2py (sptast), file = sys.stderr)
-					print (file = sys.stderr)
+class _Worker: # evaluation worker process, keeps states of recently used sessions so requests only carry one when it doesn't have the current revision
+	def __init__ (self):
+		self.conn, conn = _MP.Pipe ()
+		self.killed     = None # reason process was killed
+		self.states     = OrderedDict () # {session epoch: state rev, ...} - session states process has, same order and limit as it keeps them
+
+		if _ZYGOTE [0]:
+			self.proc = None
+			self.pid  = _ZYGOTE [0].fork (conn)
+
+		else:
+			self.proc = _MP.Process (target = _worker_main, args = (conn,), daemon = True)
 
-				asts = _execute_ass (sptast, vars)
+			self.proc.start ()
 
-			response = {}
+			self.pid  = self.proc.pid
 
-			if asts and asts [0] != AST.None_:
-				response.update ({'math': [{
-					'tex': sym.ast2tex (ast),
-					'nat': sym.ast2nat (ast),
-					'py' : sym.ast2py (ast),
-					} for ast in asts]})
+		conn.close ()
 
-			return response
+	def evaluate (self, data): # pickled (epoch, state rev, session state or None, text, ast) -> pickled (state delta or None, response), killed if it takes longer than timeout
+		self.conn.send_bytes (data)
 
-		# start here
-		responses = []
+		if not self.conn.poll (_EVAL_TIMEOUT [0]):
+			self.kill (f'evaluation timed out after {_EVAL_TIMEOUT [0]:g} seconds')
+
+		return self.conn.recv_bytes () # EOFError if killed
+
+	def kill (self, reason):
+		if self.killed is None:
+			self.killed = reason
+
+			try:
+				os.kill (self.pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+
+	def close (self):
+		self.conn.close ()
+
+		if self.proc:
+			self.proc.join ()
+
+class _Zygote: # single threaded process with SymPy caches warmed up which forks workers on request, cheaper and safer than forking the threaded server
+	def __init__ (self, warm = True):
+		self.conn, conn = _MP.Pipe ()
+		self.lock       = threading.Lock ()
+		self.proc       = _MP.Process (target = _zygote_main, args = (conn, warm), daemon = True)
+
+		self.proc.start ()
+		conn.close ()
+
+	def fork (self, conn): # start worker process serving other end of conn, returns its pid
+		with self.lock:
+			reduction.send_handle (self.conn, conn.fileno (), self.proc.pid)
+
+			return self.conn.recv ()
+
+_ZYGOTE_WARM = ( # evaluated once in zygote so that workers start with SymPy caches hot
+	'\\int x sin x dx',
+	'\\int_0^\\infty e^{-x^2} dx',
+	"dsolve (y (x)'' + y (x))",
+	'solve (x**2 - 1, x)',
+	'\\lim_{x \\to 0} \\frac{\\sin x}{x}',
+	'\\sum_{n=1}^\\infty \\frac{1}{n^2}',
+	'simplify (sin (x)**2 + cos (x)**2)',
+	'\\frac{d}{dx} \\tan x',
+	'\\[[1, 2], [3, 4]]**-1',
+)
+
+def _zygote_main (conn, warm):
+	global _SESSION_LOCK
+
+	_SESSION_LOCK = threading.Lock ()
+
+	signal.signal (signal.SIGINT, signal.SIG_IGN) # server process handles ^C, workers see EOF when it exits
+	signal.signal (signal.SIGCHLD, signal.SIG_IGN) # workers are reaped automatically
+
+	if warm:
+		with _SESSION_LOCK:
+			sess = _Session (None) # fresh session with starting environment, same as a new client gets
+
+			sess.activate ()
+			_vars_updated (sess)
+
+			for text in _ZYGOTE_WARM:
+				_evaluate (sess, text)
+
+	while 1:
+		try:
+			fd = reduction.recv_handle (conn)
+		except EOFError:
+			break
+
+		pid = os.fork ()
+
+		if not pid:
+			try:
+				signal.signal (signal.SIGCHLD, signal.SIG_DFL)
+				conn.close ()
+				_worker_main (Connection (fd))
+			finally:
+				os._exit (0)
+
+		os.close (fd)
+		conn.send (pid)
+
+def _state_copy (state): # copy of session eval state to find what evaluation changed, sets in dicts are changed in place so those are copied too
+	return {name: {k: set (v) if isinstance (v, set) else v for k, v in val.items ()} if isinstance (val, dict) else set (val) if isinstance (val, set) else val
+		for name, val in state.items ()}
+
+def _state_delta (old, new): # {name: value or (changed {key: value, ...}, deleted {key, ...}) if dict, ...} - ASTs compared by identity
+	def same (a, b):
+		return a is b or (isinstance (a, (set, bool)) and a == b)
+
+	delta = {}
+
+	for name, val in new.items ():
+		prev = old [name]
+
+		if isinstance (val, dict):
+			changed = {k: v for k, v in val.items () if k not in prev or not same (prev [k], v)}
+			deleted = prev.keys () - val.keys ()
+
+			if changed or deleted:
+				delta [name] = (changed, deleted)
+
+		elif not same (prev, val):
+			delta [name] = val
+
+	return delta
+
+def _worker_main (conn):
+	global _SESSION_LOCK
+
+	_SESSION_LOCK = threading.Lock () # another thread of the server may have been holding it when this process was forked
+	sessions      = OrderedDict () # {epoch: [state rev, session], ...} - least recently used first, mirrored by _Worker.states in server process
+
+	while 1:
+		try:
+			epoch, rev, state, text, ast = pickle.loads (conn.recv_bytes ())
+		except EOFError:
+			break
+
+		with _SESSION_LOCK:
+			if state is not None:
+				sess = _Session (None)
+
+				sess.load_state (state)
+
+				sessions [epoch] = [rev, sess]
+
+			elif sessions.get (epoch, (None,)) [0] != rev:
+				sessions.pop (epoch, None)
+				conn.send_bytes (pickle.dumps ((None, {'data': [{'err': ['WorkerError: session state missing in evaluation process']}]})))
+
+				continue
+
+			sessions.move_to_end (epoch)
+
+			if len (sessions) > _WORKER_STATES:
+				sessions.popitem (last = False)
+
+			sess = sessions [epoch] [1]
+
+			sess.activate ()
+
+			old      = _state_copy (sess.eval_state ())
+			response = _evaluate (sess, text, ast)
+
+		try:
+			data                 = pickle.dumps ((_state_delta (old, sess.eval_state ()), response))
+			sessions [epoch] [0] = rev + 1
+
+		except Exception as e: # server keeps session state as it was before evaluation so this copy is no good anymore
+			del sessions [epoch]
+
+			data = pickle.dumps ((None, {'data': [{'err': [f'WorkerError: evaluation result could not be sent back: {e.__class__.__name__}: {e}']}]}))
+
+		conn.send_bytes (data)
+
+def _worker_new (): # new worker process or None if it could not be started, zygote may have died
+	try:
+		return _Worker ()
+	except (EOFError, OSError):
+		return None
+
+def _worker_put (worker): # back to idle pool
+	with _WORKERS_COND:
+		_WORKERS.append (worker)
+		_WORKERS_COND.notify ()
+
+def _worker_get (prefer = None): # wait for idle worker, one for which prefer (worker) is true if any
+	with _WORKERS_COND:
+		_WORKERS_COND.wait_for (lambda: _WORKERS)
+
+		worker = next ((w for w in _WORKERS if w is not None and prefer (w)), None) if prefer else None
+
+		if worker is None:
+			worker = _WORKERS.popleft ()
+		else:
+			_WORKERS.remove (worker)
+
+	if worker is None: # slot whose worker could not be started before, slot is kept for next try if it fails again
+		worker = _worker_new ()
+
+		if worker is None:
+			_worker_put (None)
+
+			raise WorkerError ('evaluation process could not be started')
+
+	return worker
+
+def _worker_evaluate (data, started = None, finished = None, prefer = None): # evaluate in idle worker process, waits for one if all are busy, data is pickled request or function (worker) which returns it
+	worker = _worker_get (prefer)
+	dead   = False
+
+	try:
+		if started:
+			started (worker)
+
+		return worker.evaluate (data (worker) if callable (data) else data)
+
+	except (EOFError, OSError): # worker process died or was killed
+		dead = True
+
+		raise WorkerError (worker.killed or 'evaluation process terminated unexpectedly') from None
+
+	finally:
+		if finished:
+			finished ()
+
+		if dead or worker.killed is not None: # killed may have come too late to stop answer, process is going away regardless so replace it
+			worker.close ()
+
+			worker = _worker_new ()
+
+		_worker_put (worker)
+
+class _ThreadingHTTPServer (ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+#...............................................................................................
+class Handler (SimpleHTTPRequestHandler):
+	def sid (self, create = False): # session id from session cookie of request, clients without cookie get default session None unless create
+		cookie = SimpleCookie (self.headers.get ('Cookie', ''))
+
+		return cookie [_SESSION_COOKIE].value if _SESSION_COOKIE in cookie else secrets.token_urlsafe (16) if create else None
+
+	def session (self, create = False): # activated session for session cookie of request
+		return _session (self.sid (create))
+
+	def vars (self, sess, request): # all vars or only those changed since revision 'vars_rev' if present and from this server session
+		names         = _vars_revise (sess)
+		epoch, _, rev = (request.get ('vars_rev') or '').partition (':')
+		rev           = int (rev) if epoch == sess.epoch and rev.isdigit () and int (rev) <= sess.vars_rev else None
+		response      = {'vars_rev': f'{sess.epoch}:{sess.vars_rev}'}
+
+		if rev is None:
+			response ['vars'] = [sess.vars_sent [name] [1] for name in names]
+
+		else:
+			response ['vars_changed'] = [math for r, math in sess.vars_sent.values () if r > rev]
+			response ['vars_deleted'] = [name for name, r in sess.vars_deleted.items () if r > rev]
+
+		return response
+
+	def cancel (self, sess, request): # kill worker processes evaluating requests idx of session or drop them if still waiting for their turn, session state stays as before them
+		idx = request ['idx']
+
+		with sess.turn:
+			evals = [e for e in sess.evals.values () if e [0] == idx] # same input may have been evaluated again before first finished
+
+			for e in evals:
+				if e [1]:
+					e [1].kill ('evaluation cancelled')
+				else:
+					e [1] = False
+
+		return {'idx': idx, 'cancelled': bool (evals)}
+
+	def evaluate (self, sess, request): # in worker process without holding _SESSION_LOCK, one at a time per session in order of arrival
+		def started (worker):
+			with sess.turn:
+				if sess.evals [ticket] [1] is False:
+					raise WorkerError ('evaluation cancelled')
+
+				sess.evals [ticket] [1] = worker
+
+		def finished (): # before worker goes back to pool so a late cancel can't kill it while it serves someone else
+			with sess.turn:
+				sess.evals.pop (ticket, None)
+
+		def data (w): # pickled request for worker, session state only if worker doesn't have its current revision already
+			nonlocal worker
+
+			with _SESSION_LOCK:
+				try:
+					req = pickle.dumps ((sess.epoch, sess.state_rev, None if w.states.get (sess.epoch) == sess.state_rev else sess.eval_state (), request ['text'], ast))
+				except Exception as e:
+					raise WorkerError (f'evaluation could not be sent to worker process: {e.__class__.__name__}: {e}') from None
+
+				worker                = w
+				w.states [sess.epoch] = sess.state_rev
+
+				w.states.move_to_end (sess.epoch) # same as worker process does with its copies
+
+				if len (w.states) > _WORKER_STATES:
+					w.states.popitem (last = False)
+
+				return req
+
+		worker = None
+
+		with sess.turn:
+			ticket              = sess.tickets [0]
+			sess.tickets [0]   += 1
+			sess.evals [ticket] = [request ['idx'], None]
+
+			sess.turn.wait_for (lambda: sess.tickets [1] == ticket)
 
 		try:
-			_HISTORY.append (request ['text'])
+			try:
+				with _SESSION_LOCK:
+					sess.activate ()
+					sess.history.append (request ['text'])
 
-			ast, _, _, _ = _PARSER.parse (request ['text'])
+					try:
+						ast, _, _, _ = _PARSER.parse (request ['text']) # probably cached from validate
+					except Exception:
+						ast          = None # reproduce error in worker
 
-			if ast:
-				for ast in (ast.scolon if ast.is_scolon else (ast,)):
-					sys.stdout = _SYS_STDOUT if _SERVER_DEBUG else io.StringIO ()
-					response   = evalexpr (ast)
+				delta, response = pickle.loads (_worker_evaluate (data, started, finished, lambda w: w.states.get (sess.epoch) == sess.state_rev))
 
-					if sys.stdout.tell ():
-						responses.append ({'msg': sys.stdout.getvalue ().strip ().split ('\n')})
+			except WorkerError as e:
+				delta, response = None, {'data': [{'err': [f'{e.__class__.__name__}: {e}']}]}
+				worker          = None # dead or never got request
 
-					responses.append (response)
+			with _SESSION_LOCK:
+				if delta is not None:
+					sess.apply_delta (delta)
 
-		except Exception:
-			if sys.stdout is not _SYS_STDOUT and sys.stdout.tell (): # flush any printed messages before exception
-				responses.append ({'msg': sys.stdout.getvalue ().strip ().split ('\n')})
+					if sess.epoch in worker.states: # may have been pushed out by another session meanwhile, as in worker process
+						worker.states [sess.epoch] = sess.state_rev
 
-			etype, exc, tb = sys.exc_info ()
+				elif worker is not None: # worker process dropped session state
+					worker.states.pop (sess.epoch, None)
 
-			if exc.args and isinstance (exc.args [0], str):
-				exc = etype (exc.args [0].replace ('\n', ' ').strip (), *exc.args [1:]).with_traceback (tb) # reformat text to remove newlines
+				sess.activate ()
 
-			responses.append ({'err': ''.join (traceback.format_exception (etype, exc, tb)).strip ().split ('\n')})
+				return {**response, **self.vars (sess, request)}
 
 		finally:
-			sys.stdout = _SYS_STDOUT
+			with sess.turn:
+				sess.tickets [1] += 1
+
+				sess.evals.pop (ticket, None)
+				sess.turn.notify_all ()
+
+	def validate (self, sess, request):
+		ast, erridx, autocomplete, error = _PARSER.parse (request ['text'], sess.parse_session, _PARSE_BUDGET)
+		tex = nat = py                   = None
+
+		if ast is not None:
+			(tex, nat, py), (xlattex, xlatnat, xlatpy) = sym.ast2all (ast, retxlat = True)
 
-		return {'data': responses} if responses else {}
+			if _SYMPAD_DEBUG:
+				print ('free:', list (v.var for v in ast.free_vars), file = sys.stderr)
+				print ('ast: ', ast, file = sys.stderr)
+
+				if xlattex:
+					print ('astt:', repr (xlattex), file = sys.stderr)
+
+				if xlatnat:
+					print ('astn:', repr (xlatnat), file = sys.stderr)
+
+				if xlatpy:
+					print ('astp:', repr (xlatpy), file = sys.stderr)
+
+				print ('tex: ', tex, file = sys.stderr)
+				print ('nat: ', nat, file = sys.stderr)
+				print ('py:  ', py, file = sys.stderr)
+				print (file = sys.stderr)
+
+		if isinstance (error, Exception):
+			error = (f'{error.__class__.__name__}: ' if not isinstance (error, SyntaxError) else '') + error.args [0].replace ('\n', ' ').strip ()
+
+		return {
+			'tex'         : tex,
+			'nat'         : nat,
+			'py'          : py,
+			'erridx'      : erridx,
+			'autocomplete': autocomplete,
+			'error'       : error,
+		}
 
 	def do_GET (self):
 		if self.path == '/':
@@ -627,10 +1192,14 @@ class Handler (SimpleHTTPRequestHandler):
 			self.send_response (200)
 
 			if self.path == '/env.js':
+				with _SESSION_LOCK:
+					sess = self.session (create = True)
+
 				content = 'text/javascript'
-				data    = f'History = {_HISTORY}\nHistIdx = {len (_HISTORY)}\nVersion = {_VERSION!r}\nSymPyVersion = {sp.__version__!r}\nDisplayStyle = {_DISPLAYSTYLE [0]}'.encode ('utf8')
+				data    = f'History = {sess.history}\nHistIdx = {len (sess.history)}\nVersion = {_VERSION!r}\nSymPyVersion = {sp.__version__!r}\nDisplayStyle = {_DISPLAYSTYLE [0]}'.encode ('utf8')
 
 				self.send_header ('Cache-Control', 'no-store')
+				self.send_header ('Set-Cookie', f'{_SESSION_COOKIE}={sess.sid}; Max-Age={_SESSION_IDLE}; Path=/; HttpOnly; SameSite=Strict') # refresh expiry on every page load
 
 			else:
 				content = _STATIC_FILES [self.path]
@@ -651,18 +1220,48 @@ class Handler (SimpleHTTPRequestHandler):
 			if isinstance (val, list) and len (val) == 1:
 				request [key] = val [0]
 
-		if request ['mode'] == 'vars':
-			response = self.vars (request)
+		key = None
 
-		else:
-			if request ['mode'] == 'validate':
-				response = self.validate (request)
-			else: # if request ['mode'] == 'evaluate':
-				response = {**self.evaluate (request), **self.vars (request)}
+		if request ['mode'] == 'validate': # validation which is still waiting for the lock when a newer one of the same input line from the same client arrives is not parsed
+			sid    = self.sid ()
+			subidx = int (request.get ('subidx') or 0)
+
+			if sid is not None: # clients without session cookie all share session None and can't be told apart so are never superseded
+				key = (sid, request ['idx'])
+
+				with _VALIDATE_LOCK:
+					newest, count     = _VALIDATING.get (key, (subidx, 0))
+					_VALIDATING [key] = [max (newest, subidx), count + 1]
+
+		try:
+			with _SESSION_LOCK:
+				sess = self.session ()
+
+				if request ['mode'] == 'vars':
+					response = self.vars (sess, request)
+				elif request ['mode'] == 'validate':
+					response = {'superseded': True} if key and _VALIDATING [key] [0] > subidx else self.validate (sess, request)
+
+		finally:
+			if key:
+				with _VALIDATE_LOCK:
+					_VALIDATING [key] [1] -= 1
+
+					if not _VALIDATING [key] [1]:
+						del _VALIDATING [key]
+
+		if request ['mode'] == 'evaluate':
+			response = self.evaluate (sess, request)
+		elif request ['mode'] == 'cancel':
+			response = self.cancel (sess, request)
 
+		if request ['mode'] in {'validate', 'evaluate'}:
 			response ['idx']  = request ['idx']
 			response ['text'] = request ['text']
 
+		if request ['mode'] == 'validate':
+			response ['subidx'] = subidx
+
 		response ['mode'] = request ['mode']
 
 		self.send_response (200)
@@ -680,14 +1279,15 @@ def start_server (logging = True):
 	if ('--ugly', '') in __OPTS or ('-u', '') in __OPTS:
 		_DISPLAYSTYLE [0] = 0
 
-	for opt, _ in __OPTS:
+	for opt, arg in __OPTS:
+		if opt == '--timeout':
+			_EVAL_TIMEOUT [0] = float (arg) or None
+
+	for opt, _ in __OPTS: # starting environment of all sessions, default session for clients which don't send a cookie is created on first use like the others
 		opt = opt.lstrip ('-')
 
 		if opt in _ENV_OPTS_ALL:
-			_admin_env (AST ('@', opt))
-
-	_START_ENV.update (_ENV)
-	_vars_updated ()
+			_START_ENV [opt [2:] if opt [:2] == 'no' else opt] = opt [:2] != 'no'
 
 	if not __ARGV:
 		host, port = _DEFAULT_ADDRESS
@@ -695,8 +1295,17 @@ def start_server (logging = True):
 		host, port = (re.split (r'(?<=\]):' if __ARGV [0].startswith ('[') else ':', __ARGV [0]) + [_DEFAULT_ADDRESS [1]]) [:2]
 		host, port = host.strip ('[]'), int (port)
 
+	if _MP.get_start_method () == 'fork' and not _ZYGOTE [0]: # before server socket exists so forked processes don't inherit it
+		_ZYGOTE [0] = _Zygote (('--nowarm', '') not in __OPTS)
+
+	def start_workers (): # in background while zygote warms up, evaluations wait for the first one
+		for _ in range (_WORKERS_NUM):
+			_worker_put (_worker_new ())
+
+	threading.Thread (target = start_workers, daemon = True).start ()
+
 	try:
-		httpd  = HTTPServer ((host, port), Handler)
+		httpd  = _ThreadingHTTPServer ((host, port), Handler)
 		thread = threading.Thread (target = httpd.serve_forever, daemon = True)
 
 		thread.start ()
@@ -763,7 +1372,7 @@ def parent ():
 
 	# continue as parent process and wait for child process to return due to file changes and restart it
 	base      = [sys.executable] + sys.argv [:1] + ['--child'] # (['--child'] if __IS_MAIN else ['sympad', '--child'])
-	opts      = [o [0] for o in __OPTS]
+	opts      = [f'{o}={a}' if a else o for o, a in __OPTS]
 	first_run = ['--firstrun']
 
 	try:
@@ -782,14 +1391,15 @@ def parent ():
 if _SERVER_DEBUG: # DEBUG!
 	Handler.__init__ = lambda self: None
 
-	h = Handler ()
+	h    = Handler ()
+	sess = _session (None)
 
-	# _VARS ['_'] = AST ('[', (('=', ('-ufunc', 'x', (('@', 't'),)), ('*', (('+', (('@', 'C1'), ('*', (('#', '8'), ('@', 'C2'), ('-intg', ('/', ('^', ('@', 'e'), ('/', ('*', (('#', '19'), ('^', ('@', 't'), ('#', '2')))), ('#', '2'))), ('^', ('-ufunc', 'x0', (('@', 't'),)), ('#', '2'))), ('@', 'dt')))))), ('-ufunc', 'x0', (('@', 't'),))))), ('=', ('-ufunc', 'y', (('@', 't'),)), ('+', (('*', (('@', 'C1'), ('-ufunc', 'y0', (('@', 't'),)))), ('*', (('@', 'C2'), ('+', (('/', ('^', ('@', 'e'), ('/', ('*', (('#', '19'), ('^', ('@', 't'), ('#', '2')))), ('#', '2'))), ('-ufunc', 'x0', (('@', 't'),))), ('*', (('#', '8'), ('-intg', ('/', ('^', ('@', 'e'), ('/', ('*', (('#', '19'), ('^', ('@', 't'), ('#', '2')))), ('#', '2'))), ('^', ('-ufunc', 'x0', (('@', 't'),)), ('#', '2'))), ('@', 'dt')), ('-ufunc', 'y0', (('@', 't'),))), {2}))))))))))
-	_VARS ['_'] = AST.Zero
+	# sess.vars ['_'] = AST ('[', (('=', ('-ufunc', 'x', (('@', 't'),)), ('*', (('+', (('@', 'C1'), ('*', (('#', '8'), ('@', 'C2'), ('-intg', ('/', ('^', ('@', 'e'), ('/', ('*', (('#', '19'), ('^', ('@', 't'), ('#', '2')))), ('#', '2'))), ('^', ('-ufunc', 'x0', (('@', 't'),)), ('#', '2'))), ('@', 'dt')))))), ('-ufunc', 'x0', (('@', 't'),))))), ('=', ('-ufunc', 'y', (('@', 't'),)), ('+', (('*', (('@', 'C1'), ('-ufunc', 'y0', (('@', 't'),)))), ('*', (('@', 'C2'), ('+', (('/', ('^', ('@', 'e'), ('/', ('*', (('#', '19'), ('^', ('@', 't'), ('#', '2')))), ('#', '2'))), ('-ufunc', 'x0', (('@', 't'),))), ('*', (('#', '8'), ('-intg', ('/', ('^', ('@', 'e'), ('/', ('*', (('#', '19'), ('^', ('@', 't'), ('#', '2')))), ('#', '2'))), ('^', ('-ufunc', 'x0', (('@', 't'),)), ('#', '2'))), ('@', 'dt')), ('-ufunc', 'y0', (('@', 't'),))), {2}))))))))))
+	sess.vars ['_'] = AST.Zero
 
-	# print (h.validate ({'text': r'f = g'}))
-	print (h.evaluate ({'text': r'sin = ?(x)'}))
-	print (h.evaluate ({'text': r'sin (2)'}))
+	# print (h.validate (sess, {'text': r'f = g'}))
+	print (_evaluate (sess, r'sin = ?(x)'))
+	print (_evaluate (sess, r'sin (2)'))
 
 	sys.exit (0)
 # AUTO_REMOVE_IN_SINGLE_SCRIPT_BLOCK_END
@@ -6,7 +6,7 @@ import os
 import re
 import sys
 
-from lalr1 import Token, State, PopConfs, Reduce, LALR1 # , KeepConf # AUTO_REMOVE_IN_SINGLE_SCRIPT
+from lalr1 import Token, State, Session, PopConfs, Reduce, LALR1 # , KeepConf # AUTO_REMOVE_IN_SINGLE_SCRIPT
 from sast import AST # AUTO_REMOVE_IN_SINGLE_SCRIPT
 import sxlat         # AUTO_REMOVE_IN_SINGLE_SCRIPT
 import sym           # AUTO_REMOVE_IN_SINGLE_SCRIPT
@@ -17,7 +17,9 @@ RESERVED_WORDS = {'in', 'if', 'else', 'or', 'and', 'not', 'Function', 'Symbol'}
 RESERVED_ALL   = RESERVED_WORDS | RESERVED_FUNCS
 
 _SP_USER_VARS  = {} # flattened user vars {name: ast, ...}
+_SP_USER_PARSE = {} # {name: ast if ufunc or lambda else None, ...} - what of user vars affects parsing, to bump version only if that changes
 _SP_USER_FUNCS = set () # set of user funcs present {name, ...} - including hidden Gamma and the like
+_SP_ENV_VER    = 0 # bumped whenever anything other than text which affects parse changes, keys parse cache and incremental sessions
 
 def _raise (exc):
 	raise exc
@@ -116,12 +118,15 @@ def _ast_pre_slice (pre, post):
 	raise SyntaxError ('invalid slice')
 
 def _ast_mulexps_to_muls (ast): # convert explicit multiplication ASTs to normal multiplication ASTs with index information for explicit muls
-	if not isinstance (ast, AST):
-		return ast
-	elif ast.is_mulexp:
-		return AST ('*', tuple (_ast_mulexps_to_muls (a) for a in ast.mul), frozenset (range (1, ast.mul.len)))
-	else:
-		return AST (*tuple (_ast_mulexps_to_muls (a) for a in ast))
+	def mulexps_to_muls (ast): # generator for AST.trampoline (), yields are recursive calls
+		args = []
+
+		for a in ast:
+			args.append ((yield mulexps_to_muls (a)) if isinstance (a, AST) else a)
+
+		return AST ('*', args [1], frozenset (range (1, ast.mul.len))) if ast.is_mulexp else AST (*args)
+
+	return AST.trampoline (mulexps_to_muls (ast)) if isinstance (ast, AST) else ast
 
 def _ast_tail_differential (self, want_pre = False, from_add = False): # find first instance of concatenated differential for integral expression -> pre, dv, wrap -> wrap (\int pre dv), pre may be None, if dv is None then rest are undefined
 	lself = lambda a: a
@@ -789,14 +794,34 @@ def _expr_num (NUM):
 
 #...............................................................................................
 class Parser (LALR1):
-	def __init__ (self):
+	def __init__ (self, cache_size = 0): # cache_size = max number of parse results to keep keyed by text and environment, 0 for no caching
 		LALR1.__init__ (self)
 
 		self.TOKENS_LONG.update ([(v, self.TOKENS [v]) for v in self.TOKENS_QUICK])
 
+		self.quick        = False
+		self.cache_size   = cache_size
+		self.cache        = OrderedDict () # {(text, _sp_env_key ()): result, ...} - least recently used first
+		self.cache_hits   = 0
+		self.cache_misses = 0
+
 	def set_quick (self, state = True):
+		if bool (state) == self.quick:
+			return
+
+		self.quick = bool (state)
+
 		self.TOKENS.update (self.TOKENS_QUICK if state else self.TOKENS_LONG)
 		self.set_tokens (self.TOKENS)
+		_bump_env_ver ()
+
+	def cache_info (self): # (hits, misses, current size, max size)
+		return (self.cache_hits, self.cache_misses, len (self.cache), self.cache_size)
+
+	def cache_clear (self):
+		self.cache.clear ()
+
+		self.cache_hits = self.cache_misses = 0
 
 	_PARSER_TABLES = \
 			b'eJztnXmP5DaW4L/MAl0FKACKpCgp/ysfPWtM+RgfvdMoGEb56IGxvuBre9CY777vpEgFFYorIyMyiFSkJIri+fh+FPVIvXjzl8/e/fj1xx/9pfnL//rup29hp6fvfvHp67+/hoPXX33y6tP3P8LDePD6q3c+ffXuv+NhPPjir1989O4nf9cj2H/08efw/7Mv' \
@@ -1309,7 +1334,7 @@ class Parser (LALR1):
 		return any (st.sym == sym for st in self.stack)
 
 	def in_intg (self):
-		for st in reversed (self.stack):
+		for st in self.stack: # top to bottom
 			if st.sym == 'INTG':
 				return True
 
@@ -1366,7 +1391,7 @@ class Parser (LALR1):
 
 		for sym in ((sym,) if isinstance (sym, str) else sym):
 			if sym in self.TOKENS:
-				self.tokens.insert (tokidx, sym if isinstance (sym, Token) else Token (self._AUTOCOMPLETE_SUBSTITUTE.get (sym, sym), '', self.tok.pos))
+				self.tokens = self.tokens.insert (tokidx, sym if isinstance (sym, Token) else Token (self._AUTOCOMPLETE_SUBSTITUTE.get (sym, sym), '', self.tok.pos))
 
 				if self.autocompleting:
 					if sym not in self._AUTOCOMPLETE_CONTINUE:
@@ -1375,7 +1400,7 @@ class Parser (LALR1):
 						self.autocomplete.append (self._AUTOCOMPLETE_CONTINUE [sym])
 
 			else:
-				self.tokens.insert (tokidx, Token (self._AUTOCOMPLETE_SUBSTITUTE.get (sym, 'VAR'), '', self.tok.pos, ('', '', '', '', '')))
+				self.tokens = self.tokens.insert (tokidx, Token (self._AUTOCOMPLETE_SUBSTITUTE.get (sym, 'VAR'), '', self.tok.pos, ('', '', '', '', '')))
 				self._mark_error ()
 
 			tokidx += 1
@@ -1401,8 +1426,8 @@ class Parser (LALR1):
 		return self._insert_symbol (self._AUTOCOMPLETE_COMMA_CLOSE [self.stack [idx].sym])
 
 	def _parse_autocomplete_expr_intg (self):
-		s               = self.stack [-1]
-		self.stack [-1] = State (s.idx, s.sym, s.pos, AST ('*', (s.red, AST.VarNull)))
+		s          = self.stack
+		self.stack = State (s.idx, s.sym, s.pos, AST ('*', (s.red, AST.VarNull)), s.prev)
 
 		if self.autocompleting:
 			vars = set (filter (lambda a: not (a.is_differential or a.is_part_any or a.var == '_'), s.red.free_vars))
@@ -1417,10 +1442,38 @@ class Parser (LALR1):
 		return True
 
 	def parse_getextrastate (self):
-		return (self.autocomplete [:], self.autocompleting, self.erridx, self.has_error, self.incomplete)
+		return (tuple (self.autocomplete), self.autocompleting, self.erridx, self.has_error, self.incomplete)
 
 	def parse_setextrastate (self, state):
 		self.autocomplete, self.autocompleting, self.erridx, self.has_error, self.incomplete = state
+		self.autocomplete                                                                = list (self.autocomplete)
+
+	def parse_getglobalstate (self):
+		return (self.parse_idx, self.parse_best)
+
+	def parse_setglobalstate (self, state):
+		self.parse_idx, self.parse_best = state
+
+	def parse_prune (self, conf): # optimistic bound on best result this branch can produce vs. best so far, autocomplete only grows and erridx only set once
+		if self.parse_best is None:
+			return False
+
+		autocomplete, _, erridx, _, incomplete = conf [6]
+
+		if self.parse_can_incomplete is None: # only vectors can mark parse incomplete
+			self.parse_can_incomplete = 'SLASHBRACKL' in self.tokens.toks
+
+		if incomplete is not None:
+			bound = (False, False, -incomplete, len (autocomplete))
+		elif self.parse_can_incomplete:
+			bound = (False, False, -self.tokens.toks [-1].pos, len (autocomplete))
+		else:
+			bound = (False, True, -erridx if erridx is not None else float ('-inf'), len (autocomplete))
+
+		return bound >= self.parse_best [:4]
+
+	def parse_sessionkey (self):
+		return _sp_env_key ()
 
 	def parse_result (self, red, erridx, autocomplete, rederr = None):
 		res             = (red is None, not rederr, -erridx if erridx is not None else float ('-inf'), len (autocomplete), self.parse_idx, (red, erridx, autocomplete, rederr))
@@ -1485,25 +1538,46 @@ class Parser (LALR1):
 
 		return True # continue parsing if conflict branches remain to find best resolution
 
-	def parse (self, text):
+	def parse (self, text, session = None, budget = None): # session = lalr1.Session () to reuse work from previous parse of similar text, budget = (max branches, max seconds)
 		def postprocess (res):
 			return (_ast_mulexps_to_muls (res [0].no_curlys).flat.setkw (pre_parse_postprocess = res [0]),) + res [1:] if isinstance (res [0], AST) else res
 
 		if not text.strip:
 			return (AST.VarNull, 0, [])
 
-		self.parse_idx      = 0
-		self.parse_best     = None # (sort keys ..., (reduction, erridx, autocomplete, rederr))
-		self.autocomplete   = []
-		self.autocompleting = True
-		self.erridx         = None
-		self.has_error      = False
-		self.incomplete     = None # None or index of start of incomplete
+		if self.cache_size:
+			key = (text, _sp_env_key ())
+			res = self.cache.get (key)
+
+			if res is not None: # same result as full parse so also good for budgeted or session parse
+				self.cache.move_to_end (key)
+
+				self.cache_hits      += 1
+				self.parse_explored   = self.parse_pruned = 0
+				self.parse_truncated  = False
+
+				if session is not None: # session must reflect this text for parse_edit (), its tokens and checkpoints are for something else so start over next time
+					session.src, session.tokens, session.key = text, None, None
+
+					del session.ckpts [:]
+
+				return res [:2] + (res [2] [:],) + res [3:]
+
+			self.cache_misses += 1
+
+		self.parse_idx            = 0
+		self.parse_best           = None # (sort keys ..., (reduction, erridx, autocomplete, rederr))
+		self.parse_can_incomplete = None # whether any branch can mark parse incomplete, determined on demand
+		self.autocomplete         = []
+		self.autocompleting       = True
+		self.erridx               = None
+		self.has_error            = False
+		self.incomplete           = None # None or index of start of incomplete
 
 		if os.environ.get ('SYMPAD_DEBUG'):
 			print (file = sys.stderr)
 
-		LALR1.parse (self, text)
+		LALR1.parse (self, text, session, budget)
 
 		res = self.parse_best [-1] if self.parse_best is not None else (None, 0, [], None)
 
@@ -1513,16 +1587,44 @@ class Parser (LALR1):
 			elif self.parse_best is None:
 				print (f'no parse', file = sys.stderr)
 
+			print (f'branches: {self.parse_explored} explored, {self.parse_pruned} pruned{", budget exceeded" if self.parse_truncated else ""}', file = sys.stderr)
 			print (file = sys.stderr)
 
-		return postprocess (res)
+		res = postprocess (res)
+
+		if self.cache_size and not self.parse_truncated: # truncated result may not be best possible so is not cached
+			self.cache [key] = res
+
+			if len (self.cache) > self.cache_size:
+				self.cache.popitem (last = False)
 
-def set_sp_user_vars (user_vars):
-	global _SP_USER_VARS
-	_SP_USER_VARS = user_vars
+			res = res [:2] + (res [2] [:],) + res [3:]
+
+		return res
+
+def _bump_env_ver ():
+	global _SP_ENV_VER
+	_SP_ENV_VER += 1
+
+def _sp_env_key (): # parse environment, E / I state is set through AST.EI () which doesn't bump version
+	return (_SP_ENV_VER, AST.E)
+
+def set_sp_user_vars (user_vars): # only which names are defined and ufunc and lambda values affect parsing, other changes keep parse cache
+	global _SP_USER_VARS, _SP_USER_PARSE
+
+	parse = {n: a if a.is_ufunc or a.is_lamb else None for n, a in user_vars.items ()}
+
+	if parse.keys () != _SP_USER_PARSE.keys () or any (a is not _SP_USER_PARSE [n] for n, a in parse.items ()): # identity, equal but different ASTs just bump
+		_bump_env_ver ()
+
+	_SP_USER_VARS, _SP_USER_PARSE = user_vars, parse
 
 def set_sp_user_funcs (user_funcs):
 	global _SP_USER_FUNCS
+
+	if user_funcs != _SP_USER_FUNCS:
+		_bump_env_ver ()
+
 	_SP_USER_FUNCS = user_funcs
 
 class sparser: # for single script
@@ -1531,6 +1633,7 @@ class sparser: # for single script
 	RESERVED_ALL      = RESERVED_ALL
 	set_sp_user_vars  = set_sp_user_vars
 	set_sp_user_funcs = set_sp_user_funcs
+	Session           = Session
 	Parser            = Parser
 
 # AUTO_REMOVE_IN_SINGLE_SCRIPT_BLOCK_START
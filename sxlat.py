@@ -251,7 +251,7 @@ def _xlat_f2a_Integral (ast = None, dvab = None, *args, **kw):
 		vars = ast.free_vars
 
 		if len (vars) == 1:
-			return AST ('-intg', ast, ('@', f'd{vars.pop ().var}'))
+			return AST ('-intg', ast, ('@', f'd{next (iter (vars)).var}'))
 
 		return AST ('-intg', ast, AST.VarNull)
 
@@ -480,46 +480,92 @@ XLAT_FUNC2AST_SPARSER = {
 
 XLAT_FUNC2AST_SPT = XLAT_FUNC2AST_PY
 
-def xlat_funcs2asts (ast, xlat, func_call = None, recurse = True): # translate eligible functions in tree to other AST representations
-	if not isinstance (ast, AST):
-		return ast
-
+def _xlat_func_args (ast, xlat): # (xact, args) for function or attribute function call ast, xact None if not eligible for translation by xlat
 	if ast.is_func:
-		xact = xlat.get (ast.func)
-		args = ast.args
-		ret  = lambda: AST ('-func', ast.func, args)
-
+		return xlat.get (ast.func), ast.args
 	elif ast.is_attr_func:
-		xact = xlat.get (f'.{ast.attr}')
-		args = (ast.obj,) + ast.args
-		ret  = lambda: AST ('.', args [0], ast.attr, tuple (args [1:]))
+		return xlat.get (f'.{ast.attr}'), (ast.obj,) + ast.args
 
-	else:
-		xact = None
+	return None, None
+
+def _xlat_func (ast, xact, args, func_call): # translate eligible function call ast using xact with already translated args
+	try:
+		if xact is True: # True means execute function and use return value for ast, only happens for -func
+			return func_call (ast.func, args) # not checking func_call None because that should never happen
+
+		xargs, xkw = AST.args2kwargs (args)
+		ast2       = xact (*xargs, **xkw)
+
+		if ast2 is not None:
+			return ast2
+
+	except:
+		pass
+
+	return AST ('-func', ast.func, args) if ast.is_func else AST ('.', args [0], ast.attr, tuple (args [1:]))
+
+def xlat_funcs2asts (ast, xlat, func_call = None, recurse = True): # translate eligible functions in tree to other AST representations, subtrees which don't change are returned as is
+	def xlat_funcs (ast): # generator for AST.trampoline (), yields are recursive calls
+		if not isinstance (ast, AST) or xlat.keys ().isdisjoint (ast.func_names):
+			return ast
+
+		xact, args = _xlat_func_args (ast, xlat)
+
+		if xact is not None:
+			if recurse:
+				xargs = []
+
+				for a in args:
+					xargs.append ((yield xlat_funcs (a)))
+
+				args = AST (*xargs)
+
+			return _xlat_func (ast, xact, args, func_call)
 
-	if xact is not None:
 		if recurse:
-			args = AST (*(xlat_funcs2asts (a, xlat, func_call = func_call) for a in args))
+			args = []
 
-		try:
-			if xact is True: # True means execute function and use return value for ast, only happens for -func
-				return func_call (ast.func, args) # not checking func_call None because that should never happen
+			for a in ast:
+				args.append ((yield xlat_funcs (a)) if isinstance (a, AST) else a)
 
-			xargs, xkw = AST.args2kwargs (args)
-			ast2       = xact (*xargs, **xkw)
+			if any (x is not a for x, a in zip (args, ast)):
+				return AST (*args)#, **ast._kw)
 
-			if ast2 is not None:
-				return ast2
+		return ast
 
-		except:
-			pass
+	return AST.trampoline (xlat_funcs (ast))
+
+def xlat_funcs2asts_multi (ast, xlats, func_call = None): # translate tree for several xlat tables in one walk, returns tuple of trees, untranslated subtrees are shared with ast
+	def xlat_funcs (ast): # generator for AST.trampoline (), returns tuple of one translated ast per xlat
+		if all (xlat.keys ().isdisjoint (ast.func_names) for xlat in xlats):
+			return (ast,) * len (xlats)
+
+		xasts = [] # per-child tuples of translations, None for non-AST elements
+
+		for a in ast:
+			xasts.append ((yield xlat_funcs (a)) if isinstance (a, AST) else None)
 
-		return ret ()
+		rets = []
 
-	if recurse:
-		return AST (*(xlat_funcs2asts (a, xlat, func_call = func_call) for a in ast))#, **ast._kw)
+		for i, xlat in enumerate (xlats):
+			xact, _ = _xlat_func_args (ast, xlat)
+
+			if xact is not None:
+				xa = [a if x is None else x [i] for a, x in zip (ast, xasts)]
+				rets.append (_xlat_func (ast, xact, xa [2] if ast.is_func else AST (xa [1], *xa [3]), func_call))
+
+			elif all (x is None or x [i] is a for a, x in zip (ast, xasts)):
+				rets.append (ast)
+
+			else:
+				rets.append (AST (*(a if x is None else x [i] for a, x in zip (ast, xasts))))
+
+		return tuple (rets)
+
+	if not isinstance (ast, AST):
+		return (ast,) * len (xlats)
 
-	return ast
+	return AST.trampoline (xlat_funcs (ast))
 
 #...............................................................................................
 _XLAT_FUNC2TEX = {
@@ -28,9 +28,31 @@ _DOIT           = True # expression doit()
 _MUL_RATIONAL   = False # products should lead with a rational fraction if one is present instead of absorbing into it
 _STRICT_TEX     = False # strict LaTeX formatting to assure copy-in ability of generated tex
 _QUICK_MODE     = False # quick input mode affects variable spacing in products
+_CLEAR_CACHE    = 'annotated' # when to clear SymPy cache before conversion: 'always', 'annotated' - only if objects have been annotated since last clear, 'never'
+
+_SPT_ANNOTATED  = False # SymPy objects which may be shared through SymPy cache have been given attributes since cache was last cleared
+
+_RENDER_CACHE       = OrderedDict () # {(renderer, args, ast, flags): (result, user deps), ...} - least recently used first
+_RENDER_CACHE_SIZE  = 0 # max number of top level renderings to keep, 0 for no caching
+_RENDER_CACHE_STATS = [0, 0] # [hits, misses]
 
 _None = object () # unique non-None None sentinel
 
+def _spt_annotate (spt, **kw): # set attributes on SymPy object, these can stick to objects returned from SymPy cache so mark cache for clearing before next conversion
+	global _SPT_ANNOTATED
+	_SPT_ANNOTATED = True
+
+	for attr, val in kw.items ():
+		setattr (spt, attr, val)
+
+	return spt
+
+def _clear_cache ():
+	global _SPT_ANNOTATED
+	_SPT_ANNOTATED = False
+
+	clear_cache ()
+
 class AST_Text (AST): # for displaying elements we do not know how to handle, only returned from SymPy processing, not passed in
 	op, is_text = '-text', True
 
@@ -75,6 +97,21 @@ class Callable: # for wrapping SymPy concrete functions mapped to variables
 def _raise (exc):
 	raise exc
 
+def _spt_depth (spt): # maximum nesting depth of SymPy tree, also through Python containers
+	depth = 0
+	stack = [(spt, 1)]
+
+	while stack:
+		spt, d = stack.pop ()
+		depth  = max (depth, d)
+
+		if isinstance (spt, (list, tuple, set)):
+			stack.extend ((a, d + 1) for a in spt)
+		elif isinstance (spt, sp.Basic):
+			stack.extend ((a, d + 1) for a in spt.args)
+
+	return depth
+
 def _sympify (spt, sympify = sp.sympify, fallback = None): # try to sympify argument with optional fallback conversion function
 	try:
 		return sympify (spt)
@@ -163,7 +200,7 @@ def _subs (spt, subs): # extend sympy .subs() into standard python containers, s
 	elif isinstance (spt, sp.Derivative) and isinstance (spt.args [0], sp_AppliedUndef): # do not subs derivative of appliedundef (d/dx (f (x, y))) to preserve info about variables
 		vars     = set (spt.args [0].args)
 		spt      = sp.Subs (spt, *zip (*filter (lambda sd: sd [0] in vars, subs)))
-		spt.doit = lambda self = spt, *args, **kw: self # disable doit because loses information
+		_spt_annotate (spt, doit = lambda self = spt, *args, **kw: self) # disable doit because loses information
 
 	else:
 		try:
@@ -210,6 +247,51 @@ def _ast_is_neg (ast):
 def _ast_is_neg_nominus (ast):
 	return ast.is_num_neg or (ast.is_mul and _ast_is_neg (ast.mul [0]))
 
+def _ast_user_deps (ast): # ((name, user var or func, is user func), ...) for every name in tree which rendering may look up in user vars and funcs
+	names = set ()
+	stack = [ast]
+
+	while stack:
+		ast = stack.pop ()
+
+		if isinstance (ast, AST):
+			if ast.is_var:
+				names.add (ast.var)
+			elif ast.is_func:
+				names.add (ast.func)
+			elif ast.is_ufunc:
+				names.add (ast.ufunc)
+
+			stack.extend (ast)
+
+	return tuple ((name, _SYM_USER_ALL.get (name), name in _SYM_USER_FUNCS) for name in names)
+
+def _render_cached (key, ast, render, *args): # cached render (*args) of ast for renderer and args in key, entries are keyed by formatting flags and checked against user vars and funcs the tree refers to
+	if not _RENDER_CACHE_SIZE or not isinstance (ast, AST):
+		return render (*args)
+
+	key = key + (ast, AST.E.var, _PYS, _DOIT, _POST_SIMPLIFY, _MUL_RATIONAL, _STRICT_TEX, _QUICK_MODE, _SYM_MARK_PY_ASS_EQ)
+	res = _RENDER_CACHE.get (key)
+
+	if res is not None and all (_SYM_USER_ALL.get (name) == user and (name in _SYM_USER_FUNCS) == func for name, user, func in res [1]):
+		_RENDER_CACHE.move_to_end (key)
+
+		_RENDER_CACHE_STATS [0] += 1
+
+		return res [0]
+
+	_RENDER_CACHE_STATS [1] += 1
+
+	res                 = render (*args)
+	_RENDER_CACHE [key] = (res, _ast_user_deps (ast))
+
+	_RENDER_CACHE.move_to_end (key)
+
+	if len (_RENDER_CACHE) > _RENDER_CACHE_SIZE:
+		_RENDER_CACHE.popitem (last = False)
+
+	return res
+
 def _ast_is_top_ass_lhs (self, ast):
 	return (self.parent.is_ass and ast is self.parent.lhs and self.parents [-2].op in {None, ';'}) or \
 		(self.parent.is_comma and self.parents [-2].is_ass and self.parent is self.parents [-2].lhs and self.parents [-3].op in {None, ';'})
@@ -255,6 +337,9 @@ def _ast_func_call (func, args, _ast2spt = None):
 
 	return func (*pyargs, **pykw)
 
+def _xlat_func_call (func, args): # for XLAT_FUNC2AST_TEX functions which are executed for their result
+	return spt2ast (_ast_func_call (getattr (sp, func), args))
+
 def _ast_has_open_differential (ast, istex):
 	if ast.is_differential or (not istex and
 			((ast.is_diff_d and (not ast.is_diff_dvdv and ast.dvs [-1] [-1] == 1)) or
@@ -302,17 +387,22 @@ def _ast_subs2func (ast): # ast is '-subs'
 class ast2tex: # abstract syntax tree -> LaTeX text
 	def __init__ (self): self.parent = self.ast = None # pylint medication
 	def __new__ (cls, ast, retxlat = False):
-		def func_call (func, args):
-			return spt2ast (_ast_func_call (getattr (sp, func), args))
+		return _render_cached (('tex', retxlat), ast, cls._render, ast, retxlat)
 
+	@classmethod
+	def _render (cls, ast, retxlat):
+		astx = sxlat.xlat_funcs2asts (ast, sxlat.XLAT_FUNC2AST_TEX, func_call = _xlat_func_call)
+		tex  = AST.call_deep (AST.depth (astx), cls._xlated, astx)
+
+		return tex if not retxlat else (tex, (astx if astx != ast else None))
+
+	@classmethod
+	def _xlated (cls, astx): # render already translated tree
 		self         = super ().__new__ (cls)
 		self.parents = [None]
 		self.parent  = self.ast = AST.Null
 
-		astx = sxlat.xlat_funcs2asts (ast, sxlat.XLAT_FUNC2AST_TEX, func_call = func_call)
-		tex  = self._ast2tex (astx)
-
-		return tex if not retxlat else (tex, (astx if astx != ast else None))
+		return self._ast2tex (astx)
 
 	def _ast2tex (self, ast):
 		self.parents.append (self.ast)
@@ -740,15 +830,23 @@ class ast2tex: # abstract syntax tree -> LaTeX text
 class ast2nat: # abstract syntax tree -> native text
 	def __init__ (self): self.parent = self.ast = None # pylint droppings
 	def __new__ (cls, ast, retxlat = False):
-		self         = super ().__new__ (cls)
-		self.parents = [None]
-		self.parent  = self.ast = AST.Null
+		return _render_cached (('nat', retxlat), ast, cls._render, ast, retxlat)
 
+	@classmethod
+	def _render (cls, ast, retxlat):
 		astx = sxlat.xlat_funcs2asts (ast, sxlat.XLAT_FUNC2AST_NAT)
-		nat  = self._ast2nat (astx)
+		nat  = AST.call_deep (AST.depth (astx), cls._xlated, astx)
 
 		return nat if not retxlat else (nat, (astx if astx != ast else None))
 
+	@classmethod
+	def _xlated (cls, astx): # render already translated tree
+		self         = super ().__new__ (cls)
+		self.parents = [None]
+		self.parent  = self.ast = AST.Null
+
+		return self._ast2nat (astx)
+
 	def _ast2nat (self, ast):
 		self.parents.append (self.ast)
 
@@ -1110,17 +1208,24 @@ class ast2nat: # abstract syntax tree -> native text
 class ast2py: # abstract syntax tree -> Python code text
 	def __init__ (self): self.parent = self.ast = None # pylint droppings
 	def __new__ (cls, ast, retxlat = False, ass2cmp = True):
-		self         = super ().__new__ (cls)
-		self.ass2cmp  = ass2cmp
-		self.parents = [None]
-		self.parent  = self.ast = AST.Null
+		return _render_cached (('py', retxlat, ass2cmp), ast, cls._render, ast, retxlat, ass2cmp)
 
+	@classmethod
+	def _render (cls, ast, retxlat, ass2cmp):
 		astx = sxlat.xlat_funcs2asts (ast, sxlat.XLAT_FUNC2AST_PY)
-		astS = sxlat.xlat_pyS (astx) if _PYS else astx # 1/2 -> S(1)/2
-		py   = self._ast2py (astS)
+		py   = AST.call_deep (AST.depth (astx), cls._xlated, astx, ass2cmp)
 
 		return py if not retxlat else (py, (astx if astx != ast else None))
 
+	@classmethod
+	def _xlated (cls, astx, ass2cmp = True): # render already translated tree
+		self         = super ().__new__ (cls)
+		self.ass2cmp = ass2cmp
+		self.parents = [None]
+		self.parent  = self.ast = AST.Null
+
+		return self._ast2py (sxlat.xlat_pyS (astx) if _PYS else astx) # 1/2 -> S(1)/2
+
 	def _ast2py (self, ast):
 		self.parents.append (self.ast)
 
@@ -1389,6 +1494,17 @@ class ast2py: # abstract syntax tree -> Python code text
 		'-text' : lambda self, ast: ast.py,
 	}
 
+#...............................................................................................
+def ast2all (ast, retxlat = False): # abstract syntax tree -> (LaTeX, native, Python) text, function translation done in one walk for all three and shared where identical
+	return _render_cached (('all', retxlat), ast, _ast2all, ast, retxlat)
+
+def _ast2all (ast, retxlat):
+	xlats = sxlat.xlat_funcs2asts_multi (ast, (sxlat.XLAT_FUNC2AST_TEX, sxlat.XLAT_FUNC2AST_NAT, sxlat.XLAT_FUNC2AST_PY), func_call = _xlat_func_call)
+	depth = max (AST.depth (astx) for astx in {id (astx): astx for astx in xlats}.values ())
+	texts = AST.call_deep (depth, lambda: (ast2tex._xlated (xlats [0]), ast2nat._xlated (xlats [1]), ast2py._xlated (xlats [2])))
+
+	return texts if not retxlat else (texts, tuple ((astx if astx != ast else None) for astx in xlats))
+
 #...............................................................................................
 # Potentially bad __builtins__: eval, exec, globals, locals, vars, setattr, delattr, exit, help, input, license, open, quit, __import__
 _builtins_dict         = __builtins__ if isinstance (__builtins__, dict) else __builtins__.__dict__
@@ -1396,41 +1512,29 @@ _ast2spt_func_builtins = dict (no for no in filter (lambda no: no [1], ((n, _bui
 _ast2spt_pyfuncs       = {**_ast2spt_func_builtins, **sp.__dict__, 'simplify': _simplify}
 
 class ast2spt: # abstract syntax tree -> sympy tree (expression)
-	_SYMPY_FLOAT_PRECISION = None
-
-	@staticmethod
-	def set_precision (ast): # recurse through ast to set sympy float precision according to longest string of digits found
-		prec  = 15
-		stack = [ast]
-
-		while stack:
-			ast = stack.pop ()
-
-			if not isinstance (ast, AST):
-				pass # nop
-			elif ast.is_num:
-				prec = max (prec, len (ast.num)) # will be a little more than number of digits to compensate for falling precision with some calculations
-			else:
-				stack.extend (ast if ast.op is None else ast [1:])
-
-		ast2spt._SYMPY_FLOAT_PRECISION = prec if prec > 15 else None
-
 	def __init__ (self): self.parent = self.ast = None # pylint kibble
-	def __new__ (cls, ast, retxlat = False):
+	def __new__ (cls, ast, retxlat = False, prec = None): # prec = float precision context for this call, like ast.num_prec of expression as entered, otherwise precision of each float is taken from its own digits
 		self         = super ().__new__ (cls)
 		self.parents = [None]
 		self.parent  = self.ast = AST.Null
+		self.prec    = prec if prec and prec > 15 else None # will be a little more than number of digits to compensate for falling precision with some calculations
 
-		clear_cache () # don't want sympy object annotations to stick around like ?F(x) coming back as ?F(xi_1)
+		if _CLEAR_CACHE == 'always' or (_SPT_ANNOTATED and _CLEAR_CACHE == 'annotated'):
+			_clear_cache () # don't want sympy object annotations to stick around like ?F(x) coming back as ?F(xi_1)
 
-		astx = sxlat.xlat_funcs2asts (ast, sxlat.XLAT_FUNC2AST_SPT)
-		spt  = self._ast2spt (astx)
+		def ast2spt (astx):
+			spt = self._ast2spt (astx)
 
-		if _DOIT:
-			spt = _doit (spt)
+			if _DOIT:
+				spt = _doit (spt)
 
-		if _POST_SIMPLIFY:
-			spt = _simplify (spt)
+			if _POST_SIMPLIFY:
+				spt = _simplify (spt)
+
+			return spt
+
+		astx = sxlat.xlat_funcs2asts (ast, sxlat.XLAT_FUNC2AST_SPT)
+		spt  = AST.call_deep (AST.depth (astx), ast2spt, astx)
 
 		return spt if not retxlat else (spt, (astx if astx != ast else None))
 
@@ -1576,7 +1680,7 @@ class ast2spt: # abstract syntax tree -> sympy tree (expression)
 
 					if src:
 						mul [-1] = spt = sp.Subs (mul [-1], tuple (src), tuple (dst))
-						spt.doit = lambda self = spt, *args, **kw: self # disable doit because loses information
+						_spt_annotate (spt, doit = lambda self = spt, *args, **kw: self) # disable doit because loses information
 
 					continue
 
@@ -1645,7 +1749,7 @@ class ast2spt: # abstract syntax tree -> sympy tree (expression)
 			spt = sp.Lambda (tuple (sp.Symbol (v) for v in ast.vars), self._ast2spt (ast.lamb))
 
 			if not (ast.lamb.is_func and ast.lamb.func == AST.Func.NOEVAL):
-				spt.doit = lambda self, *args, **kw: self # disable doit for lambda definition
+				_spt_annotate (spt, doit = lambda self, *args, **kw: self) # disable doit for lambda definition
 
 		return spt
 
@@ -1670,9 +1774,11 @@ class ast2spt: # abstract syntax tree -> sympy tree (expression)
 		return sdiff
 
 	def _ast2spt_ufunc (self, ast):
-		spt                   = sp.Function (ast.ufunc, **{k: _bool_or_None (self._ast2spt (a)) for k, a in ast.kw}) (*(self._ast2spt (v) for v in ast.vars))
-		spt.is_ufunc_explicit = ast.is_ufunc_explicit # try to pass explicit state of ufunc through
-		assum                 = _spt_assumptions (spt)
+		spt = sp.Function (ast.ufunc, **{k: _bool_or_None (self._ast2spt (a)) for k, a in ast.kw}) (*(self._ast2spt (v) for v in ast.vars))
+
+		_spt_annotate (spt, is_ufunc_explicit = ast.is_ufunc_explicit) # try to pass explicit state of ufunc through
+
+		assum = _spt_assumptions (spt)
 
 		if assum not in _SYM_ASSUM_REDUCE:
 			_SYM_ASSUM_REDUCE [assum] = ast.kw
@@ -1686,7 +1792,7 @@ class ast2spt: # abstract syntax tree -> sympy tree (expression)
 		';'     : lambda self, ast: _raise (RuntimeError ('semicolon expression should never get here')),
 		'='     : _ast2spt_ass,
 		'<>'    : _ast2spt_cmp,
-		'#'     : lambda self, ast: sp.Integer (ast.num) if ast.is_num_int else sp.Float (ast.num, ast2spt._SYMPY_FLOAT_PRECISION),
+		'#'     : lambda self, ast: sp.Integer (ast.num) if ast.is_num_int else sp.Float (ast.num, self.prec),
 		'@'     : _ast2spt_var,
 		'.'     : _ast2spt_attr,
 		'"'     : lambda self, ast: ast.str_,
@@ -1737,7 +1843,7 @@ class spt2ast:
 		self.parents = [None]
 		self.parent  = self.spt = None
 
-		return _ast_eqcmp2ass (self._spt2ast (spt))
+		return _ast_eqcmp2ass (AST.call_deep (_spt_depth (spt), self._spt2ast, spt))
 
 	def _spt2ast (self, spt): # sympy tree (expression) -> abstract syntax tree
 		def __spt2ast (spt):
@@ -2080,6 +2186,27 @@ def set_quick (state):
 	global _QUICK_MODE
 	_QUICK_MODE = state
 
+def set_render_cache (size): # max number of top level tex / nat / py renderings to cache, 0 to disable
+	global _RENDER_CACHE_SIZE
+	_RENDER_CACHE_SIZE = size
+
+	while len (_RENDER_CACHE) > size:
+		_RENDER_CACHE.popitem (last = False)
+
+def render_cache_info (): # (hits, misses, current size, max size)
+	return tuple (_RENDER_CACHE_STATS) + (len (_RENDER_CACHE), _RENDER_CACHE_SIZE)
+
+def render_cache_clear ():
+	_RENDER_CACHE.clear ()
+
+def set_clear_cache (mode): # 'always', 'annotated' or 'never'
+	global _CLEAR_CACHE
+
+	if mode not in {'always', 'annotated', 'never'}:
+		raise ValueError (f'invalid cache clearing mode {mode!r}')
+
+	_CLEAR_CACHE = mode
+
 class sym: # for single script
 	set_sym_user_vars  = set_sym_user_vars
 	set_sym_user_funcs = set_sym_user_funcs
@@ -2089,9 +2216,14 @@ class sym: # for single script
 	set_prodrat        = set_prodrat
 	set_strict         = set_strict
 	set_quick          = set_quick
+	set_clear_cache    = set_clear_cache
+	set_render_cache   = set_render_cache
+	render_cache_info  = render_cache_info
+	render_cache_clear = render_cache_clear
 	ast2tex            = ast2tex
 	ast2nat            = ast2nat
 	ast2py             = ast2py
+	ast2all            = ast2all
 	ast2spt            = ast2spt
 	spt2ast            = spt2ast
 
@@ -2,6 +2,7 @@
 # python 3.6+
 
 from functools import lru_cache
+import pickle
 import unittest
 
 import sympy as sp
@@ -9,6 +10,7 @@ from sast import AST
 import spatch
 import sym
 import sparser as _sparser
+import sxlat as _sxlat
 
 import test_sym as _test_sym
 
@@ -60,6 +62,272 @@ class Test (unittest.TestCase):
 	def test_sym (self):
 		self.assertEqual (_test_sym.test (['-c']), True)
 
+	def test_parse_session (self):
+		def parse (text, session = None):
+			ast, erridx, autocomplete, error = parser.parse (text, session)
+
+			return ast, erridx, autocomplete, repr (error)
+
+		for expr in (r'\int_0^1 x**2 + \sqrt[3]{y} dx', r'\[[1, 2], [3, 4]] * x y z', r'\lim_{x \to 0} \frac{\sin x}{x}', r'\sum_{n=1}^\infty 1/n**2 + \[1,2',
+				'f(x) = x**2 + sin(x); lambda x: x', "d/dx y(x) + x' {x: y, 1: 2} if a else b"):
+			session = _sparser.Session ()
+
+			for i in range (1, len (expr) + 1): # typing
+				self.assertEqual (parse (expr [:i], session), parse (expr [:i]))
+
+			for i in range (0, len (expr), 3): # editing
+				self.assertEqual (parser.parse_edit (session, i, 1, '(') [:3], parse (session.src) [:3])
+				self.assertEqual (parser.parse_edit (session, i, 1, '') [:3], parse (session.src) [:3])
+
+		cparser = _sparser.Parser (cache_size = 8) # cache hit must still leave session at text just parsed
+		session = _sparser.Session ()
+
+		cparser.parse ('x + y', session), cparser.parse ('a * b', session), cparser.parse ('x + y', session)
+		self.assertEqual (session.src, 'x + y')
+		self.assertEqual (cparser.parse_edit (session, 4, 1, 'z') [0], ('+', (('@', 'x'), ('@', 'z'))))
+		self.assertEqual (cparser.parse_edit (session, 0, 1, 'w') [0], ('+', (('@', 'w'), ('@', 'z'))))
+
+	def test_parse_budget (self):
+		text = 'Subs ((x y z w).subs ({'
+
+		self.assertEqual (parser.parse (text, budget = (None, None)), parser.parse (text))
+		self.assertFalse (parser.parse_truncated)
+		self.assertEqual (parser.parse (text, budget = (2, None)) [:3], (None, 0, []))
+		self.assertTrue (parser.parse_truncated)
+		self.assertEqual (parser.parse_explored, 2)
+		self.assertEqual (parser.parse ('x + y', budget = (None, 0)) [0], ('+', (('@', 'x'), ('@', 'y'))))
+
+	def test_parse_cache (self):
+		cparser = _sparser.Parser (cache_size = 2)
+
+		try:
+			_sparser.set_sp_user_funcs (_USER_FUNCS) # don't depend on what anything else left in parser environment
+			_sparser.set_sp_user_vars ({})
+
+			self.assertEqual (cparser.parse ('x + y'), parser.parse ('x + y'))
+			self.assertEqual (cparser.parse ('x + y', budget = (1, None)), parser.parse ('x + y'))
+			self.assertEqual (cparser.parse ('x +'), parser.parse ('x +'))
+			self.assertEqual (cparser.cache_info (), (1, 2, 2, 2))
+
+			cparser.parse ('a'), cparser.parse ('x + y')
+			self.assertEqual (cparser.cache_info (), (1, 4, 2, 2))
+
+			_sparser.set_sp_user_vars ({'_': AST ('#', '2')})
+			cparser.parse ('x + y')
+			self.assertEqual (cparser.cache_info (), (1, 5, 2, 2))
+
+			_sparser.set_sp_user_funcs (set (_USER_FUNCS)) # equal funcs and changed non-function values of same vars don't affect parse
+			_sparser.set_sp_user_vars ({'_': AST ('#', '3')})
+			cparser.parse ('x + y')
+			self.assertEqual (cparser.cache_info (), (2, 5, 2, 2))
+
+			_sparser.set_sp_user_funcs (_USER_FUNCS | {'f'})
+			cparser.parse ('x + y')
+			self.assertEqual (cparser.cache_info (), (2, 6, 2, 2))
+
+		finally:
+			_sparser.set_sp_user_funcs (_USER_FUNCS)
+			_sparser.set_sp_user_vars ({})
+
+		try:
+			self.assertEqual (cparser.parse ('e (x)') [0], ('*', (('@', 'e'), ('(', ('@', 'x')))))
+			AST.EI (True)
+			self.assertEqual (cparser.parse ('e (x)') [0], ('-ufunc', 'e', (('@', 'x'),)))
+		finally:
+			AST.EI (False)
+
+	def test_render_cache (self):
+		def stats (): # hits and misses since start of test
+			return tuple (n - n0 for n, n0 in zip (sym.render_cache_info () [:2], start))
+
+		size, pyS = sym.render_cache_info () [3], sym._PYS # restored after, may have been set by something else
+		ast       = p ('f (x) + y')
+
+		try:
+			sym.set_render_cache (0)
+			sym.set_sym_user_vars ({})
+			sym.set_pyS (False)
+
+			nat   = sym.ast2nat (ast)
+			start = sym.render_cache_info () [:2]
+
+			sym.set_render_cache (2)
+
+			self.assertEqual (sym.ast2nat (ast), nat)
+			self.assertEqual (sym.ast2nat (p ('f (x) + y')), nat)
+			self.assertEqual (stats (), (1, 1))
+
+			sym.set_sym_user_vars ({'z': AST.One})
+			sym.ast2nat (ast)
+			self.assertEqual (stats (), (2, 1))
+
+			sym.set_sym_user_vars ({'y': AST.One})
+			sym.ast2nat (ast)
+			sym.set_strict (False)
+			sym.ast2nat (ast)
+			sym.set_strict (True)
+			sym.ast2nat (ast)
+			self.assertEqual (stats (), (3, 3))
+
+			sym.ast2tex (ast), sym.ast2nat (ast)
+			self.assertEqual (stats (), (4, 4))
+			self.assertEqual (sym.render_cache_info () [2:], (2, 2))
+
+			ast = AST ('(', AST ('=', ('@', 'x'), ('@', 'y'), ass_is_not_kw = True))
+			self.assertEqual (sym.ast2py (ast, ass2cmp = False), '(Eq(x, y))')
+			sym._SYM_MARK_PY_ASS_EQ = True
+			self.assertEqual (sym.ast2py (ast, ass2cmp = False), '(Eq(x, y, 1))')
+
+		finally:
+			sym.set_render_cache (size)
+			sym.set_sym_user_vars ({})
+			sym.set_pyS (pyS)
+
+			sym._SYM_MARK_PY_ASS_EQ = False
+
+	def test_sympy_cache_clearing (self):
+		sym.ast2spt (p ('?f (x)'))
+		self.assertTrue (sym._SPT_ANNOTATED)
+		sym.ast2spt (p ('x + 1'))
+		self.assertFalse (sym._SPT_ANNOTATED)
+		self.assertEqual (sym.spt2ast (sym.ast2spt (p ('?f (x)'))), ('-ufunc', '?f', (('@', 'x'),)))
+		self.assertEqual (sym.spt2ast (sym.ast2spt (AST ('-ufunc', 'f', (('@', 'x'),)))), ('-ufunc', 'f', (('@', 'x'),)))
+
+	def test_deep (self):
+		n     = 3000
+		paren = parser.parse ('(' * n + 'x' + ')' * n) [0]
+		add   = AST ('@', 'x0')
+
+		for i in range (1, n):
+			add = AST ('+', (('@', f'x{i}'), add))
+
+		self.assertEqual (AST.depth (paren), n + 1)
+		self.assertEqual (paren.free_vars, {('@', 'x')})
+		self.assertEqual (AST.apply_vars (paren, {'x': AST ('#', '2')}).strip_paren, ('#', '2'))
+		self.assertEqual (ast2nat (paren), '(' * n + 'x' + ')' * n)
+		self.assertEqual (add.flat.add.len, n)
+		self.assertEqual (AST.depth (AST.intern (paren)), n + 1)
+		self.assertEqual (AST.depth (pickle.loads (pickle.dumps (paren))), n + 1)
+
+		AST.intern_clear ()
+
+	def test_intern (self):
+		a  = parser.parse ('x + sin (y) / 2') [0]
+		ia = AST.intern (a)
+		ib = AST.intern (parser.parse ('(x + sin (y) / 2) * x') [0])
+
+		self.assertEqual (ia, a)
+		self.assertIs (ia.add [1], ib.mul [0].paren.add [1])
+		self.assertIs (ia.add [0], ib.mul [1])
+		self.assertIs (ia.pre_parse_postprocess, a.pre_parse_postprocess)
+		self.assertEqual (hash (ib), hash (tuple (ib)))
+
+		AST.intern_clear ()
+
+	def test_lazy_attrs (self):
+		a = AST ('+', (('@', 'x'), ('*', (('#', 2), ('@', 'y')))))
+
+		self.assertEqual (a.add [1].mul, (('#', '2'), ('@', 'y')))
+		self.assertEqual (a.add [1].exp, frozenset ())
+		self.assertIsNone (a.is_mul)
+		self.assertIsNone (a.add [0].is_num_pos)
+		self.assertEqual (vars (a), {})
+		self.assertEqual (a.free_vars, {('@', 'x'), ('@', 'y')})
+		self.assertIn ('free_vars', vars (a))
+		self.assertEqual (AST ('-intg', ('@', 'x'), ('@', 'dx')).from_, None)
+		self.assertEqual (AST ('@', 'x', text = 'x').setkw (error = 'e').explicit_kw (), {'text': 'x', 'error': 'e'})
+		self.assertRaises (TypeError, AST, '/', ('#', '1'))
+
+	def test_free_vars (self):
+		x, y = AST ('@', 'x'), AST ('@', 'y')
+		term = AST ('*', (x, ('(', ('+', (y, ('#', '1'))))))
+		expr = AST ('+', (term, ('-lamb', ('+', (x, ('@', 'z'))), ('x', 'z')), ('-intg', x, ('@', 'dx'), ('#', '0'), ('@', 'a'))))
+
+		self.assertEqual (term.mul [1].free_vars, {y})
+		self.assertEqual (expr.free_vars, {x, y, ('@', 'a')})
+		self.assertIsInstance (expr.free_vars, frozenset)
+		self.assertIs (AST ('-', term).free_vars, term.free_vars)
+		self.assertEqual (AST ('-subs', ('+', (x, y)), ((x, ('@', 'b')), (('@', 'c'), ('@', 'd')))).free_vars, {y, ('@', 'b')})
+		self.assertEqual (AST ('-sum', x, x, ('#', '0'), ('@', 'n')).free_vars, {('@', 'n')})
+
+	def test_tree_summaries (self):
+		ast = p ('sin (1.23456789012345678901) + x.diff (y) * Gamma (z) / 2.5')
+
+		self.assertEqual (ast.num_prec, 22)
+		self.assertEqual (ast.func_names, {'sin', 'Gamma', '.diff'})
+		self.assertEqual (ast.var_names, {'x', 'y', 'z'})
+		self.assertEqual (AST ('@', 'x').num_prec, 0)
+		self.assertEqual (sym.ast2spt (p ('1.2345678901234567890123456789')), sym.ast2spt (p ('1.2345678901234567890123456789'), prec = 15))
+		self.assertNotEqual (sym.ast2spt (p ('1.2345678901234567890123456789')), sym.ast2spt (p ('1.2345678901234567890123456789'), prec = 40))
+
+		ast = p ('x + y**2 * Gamma (z)')
+
+		self.assertIs (_sxlat.xlat_funcs2asts (ast.add [1].mul [0], _sxlat.XLAT_FUNC2AST_TEX), ast.add [1].mul [0])
+		self.assertIs (_sxlat.xlat_funcs2asts (ast, {'sin': lambda x: x}), ast)
+		self.assertIs (_sxlat.xlat_funcs2asts_multi (ast, (_sxlat.XLAT_FUNC2AST_TEX, _sxlat.XLAT_FUNC2AST_PY)) [1].add [0], ast.add [0])
+
+	def test_apply_vars_scopes (self):
+		_sparser.set_sp_user_funcs (_USER_FUNCS | {'f'})
+
+		try:
+			vars = {'f': parser.parse ('lambda x: x + y') [0], 'y': AST ('#', '2'), 'z': AST ('@', 'x')}
+
+			self.assertEqual (AST.apply_vars (parser.parse ('f (3)') [0], vars), ('+', (('#', '3'), ('#', '2'))))
+			self.assertEqual (AST.apply_vars (parser.parse ('\\sum_{y=0}^1 f (y)') [0], vars), ('-sum', ('+', (('#', '2'), ('@', 'y'))), ('@', 'y'), ('#', '0'), ('#', '1')))
+			self.assertEqual (AST.apply_vars (parser.parse ('lambda y: f (y) + z') [0], vars), ('-lamb', ('+', (('+', (('#', '2'), ('@', 'y'))), ('@', 'x'))), ('y',)))
+			self.assertEqual (set (vars), {'f', 'y', 'z'})
+
+		finally:
+			_sparser.set_sp_user_funcs (_USER_FUNCS)
+
+	def test_ast2all (self):
+		for text in ('x + sin (y) / 2', 'diag (1, 2) * Gamma (x)', 'Derivative (f (x), x) + re (z)', '\\int_0^1 x dx', 'x.diff (y)'):
+			ast = p (text)
+
+			self.assertEqual (sym.ast2all (ast, retxlat = True), tuple (zip (*(func (ast, retxlat = True) for func in (sym.ast2tex, sym.ast2nat, sym.ast2py)))))
+
+		ast   = p ('x**2 + Gamma (y)')
+		xlats = _sxlat.xlat_funcs2asts_multi (ast, (_sxlat.XLAT_FUNC2AST_TEX, _sxlat.XLAT_FUNC2AST_NAT, _sxlat.XLAT_FUNC2AST_PY))
+
+		self.assertIs (xlats [0].add [0], ast.add [0])
+		self.assertIs (xlats [1], xlats [0])
+		self.assertIsNot (xlats [2], ast)
+
+	def test_parser_tables (self):
+		dense = parser.tables_load ()
+
+		self.assertIsNotNone (dense)
+		self.assertEqual (dense, parser.tables_dense (parser._PARSER_TABLES))
+
+	def test_reduction_plans (self):
+		plans = parser.rplans [1:]
+
+		self.assertIs (parser.rplans, _sparser.Parser ().rplans)
+		self.assertTrue (any (func is None for _, _, _, func in plans))
+		self.assertTrue (all (func is not None for _, _, nargs, func in plans if nargs != 1))
+		self.assertEqual (p ('a'), ('@', 'a')) # every atom goes through chain of pass-through rules
+
+	def test_tokenize (self):
+		def full (text):
+			toks, pos = [], 0
+
+			while pos < len (text):
+				m = parser.tokrec.match (text, pos)
+
+				if m is None:
+					return toks + [('$err', pos, (text [pos],))]
+
+				if m.lastgroup != 'ignore':
+					s, e = parser.tokgrps [m.lastgroup]
+					toks.append ((m.lastgroup, pos, m.groups () [s : e]))
+
+				pos = m.end ()
+
+			return toks
+
+		for text in ("a.b x_1 \\frac12 'str' x's \\int_0^1", 'dx ∂x \\partial x \\alpha α ∫ 1.e+20 d\\beta', 'x .y \\text{a} \\left(\\right) \\?', '`'):
+			self.assertEqual ([(t, t.pos, (t.text or None,) + t.grp) for t in parser.tokenize (text) [:-1]], full (text))
+
 	#...............................................................................................
 	# BEGIN UPDATE BLOCK
 	def test_sparser (self):
@@ -4,9 +4,11 @@
 # Testing of server state machine (vars, env, lambdas).
 
 import os
+import pickle
 import sys
 import time
 import subprocess
+import threading
 import unittest
 
 import requests
@@ -24,6 +26,219 @@ class Test (unittest.TestCase):
 		self.assertEqual (get ('env (noquick)'), {'msg': ['Quick input mode is off.']})
 		self.assertEqual (get ('α, β, γ, δ, ε, ζ, η, θ, ι, κ, λ, μ, ν, ξ, π, ρ, σ, τ, υ, φ, χ, ψ, ω, Γ, Δ, Θ, Λ, Ξ, Π, Σ, Υ, Φ, Ψ, Ω'), {'math': ('(alpha, beta, gamma, delta, epsilon, zeta, eta, theta, iota, kappa, lambda, mu, nu, xi, pi, rho, sigma, tau, upsilon, phi, chi, psi, omega, Gamma, Delta, Theta, Lambda, Xi, Pi, Sigma, Upsilon, Phi, Psi, Omega)', '(alpha, beta, gamma, delta, epsilon, zeta, eta, theta, iota, kappa, lambda, mu, nu, xi, pi, rho, sigma, tau, upsilon, phi, chi, psi, omega, Gamma, Delta, Theta, Lambda, Xi, Pi, Sigma, Upsilon, Phi, Psi, Omega)', '\\left(\\alpha, \\beta, \\gamma, \\delta, \\epsilon, \\zeta, \\eta, \\theta, \\iota, \\kappa, \\lambda, \\mu, \\nu, \\xi, \\pi, \\rho, \\sigma, \\tau, \\upsilon, \\phi, \\chi, \\psi, \\omega, \\Gamma, \\Delta, \\Theta, \\Lambda, \\Xi, \\Pi, \\Sigma, \\Upsilon, \\Phi, \\Psi, \\Omega \\right)')})
 
+	def test_vars_rev (self):
+		def post (text, rev = ''):
+			return requests.post (URL, {'idx': 1, 'mode': 'evaluate', 'text': text, 'vars_rev': rev}).json ()
+
+		reset ()
+		resp = post ('x = 1')
+		self.assertEqual (resp ['vars'], [{'name': 'x', 'tex': 'x = 1', 'nat': 'x = 1', 'py': 'x = 1'}])
+		rev  = resp ['vars_rev']
+		resp = post ('y = 2', rev)
+		self.assertEqual ((resp ['vars_changed'], resp ['vars_deleted']), ([{'name': 'y', 'tex': 'y = 2', 'nat': 'y = 2', 'py': 'y = 2'}], []))
+		resp = post ('x + y', resp ['vars_rev'])
+		self.assertEqual ((resp ['vars_changed'], resp ['vars_deleted']), ([], []))
+		resp = post ('del x', resp ['vars_rev'])
+		self.assertEqual ((resp ['vars_changed'], resp ['vars_deleted']), ([], ['x']))
+		resp = post ('0', rev)
+		self.assertEqual ((resp ['vars_changed'], resp ['vars_deleted']), ([{'name': 'y', 'tex': 'y = 2', 'nat': 'y = 2', 'py': 'y = 2'}], ['x']))
+		self.assertEqual (post ('0', 'stale:1') ['vars'], [{'name': 'y', 'tex': 'y = 2', 'nat': 'y = 2', 'py': 'y = 2'}])
+
+	def test_vars_deps (self):
+		reset ()
+		get ('c = 2'), get ('b = @(c + 1)'), get ('a = @(b * 2)'), get ('d = 5')
+		self.assertEqual ((server._SESSIONS [None].vars_users ['c'], server._SESSIONS [None].vars_users ['b']), ({'b'}, {'a'}))
+		self.assertEqual (get ('a'), {'math': ('6', '6', '6')})
+		self.assertEqual (get ('c = 3'), {'math': ('c = 3', 'c = 3', 'c = 3')})
+		self.assertEqual (get ('a'), {'math': ('8', '8', '8')})
+		self.assertEqual (get ('del b'), {'msg': ["Variable 'b' deleted."]})
+		self.assertEqual (get ('a'), {'math': ('2 b', '2*b', '2 b')})
+		self.assertEqual ((server._SESSIONS [None].vars_flat ['a'], server._SESSIONS [None].vars_users ['c']), (('*', (('#', '2'), ('@', 'b'))), set ()))
+
+	def test_sessions (self):
+		def post (sess, text):
+			return sess.post (URL, {'idx': 1, 'mode': 'evaluate', 'text': text}).json () ['data'] [0]
+
+		reset ()
+		get ('x = 1')
+		s1, s2 = requests.Session (), requests.Session ()
+		self.assertIn ('History = []', s1.get (URL + 'env.js').text)
+		s2.get (URL + 'env.js')
+		self.assertNotEqual (s1.cookies ['sympad_session'], s2.cookies ['sympad_session'])
+		self.assertEqual (post (s1, 'x = 2') ['math'] [0] ['nat'], 'x = 2')
+		self.assertEqual (post (s1, 'env (quick)'), {'msg': ['Quick input mode is on.']})
+		self.assertEqual (post (s2, 'x') ['math'] [0] ['nat'], 'x')
+		self.assertEqual (post (s2, 'ab') ['math'] [0] ['nat'], 'ab')
+		self.assertEqual (post (s1, 'x + 1') ['math'] [0] ['nat'], '3')
+		self.assertEqual (post (s1, 'ab') ['math'] [0] ['nat'], 'a b')
+		self.assertEqual (get ('x'), {'math': ('1', '1', '1')})
+		self.assertIn ("History = ['x = 2', 'env (quick)', 'x + 1', 'ab']", s1.get (URL + 'env.js').text)
+
+		sid = s2.cookies ['sympad_session']
+		server._SESSIONS [sid].atime -= server._SESSION_IDLE + 1
+		server._SESSION_EVICT [0] = 0
+		self.assertEqual (post (s1, 'x') ['math'] [0] ['nat'], '2')
+		self.assertNotIn (sid, server._SESSIONS)
+		self.assertIn ('History = []', s2.get (URL + 'env.js').text)
+
+	def test_concurrent (self):
+		reset ()
+		sess = requests.Session ()
+		sess.get (URL + 'env.js')
+		slow = threading.Thread (target = lambda: sess.post (URL, {'idx': 1, 'mode': 'evaluate', 'text': 'isprime (2**9689 - 1)'}))
+		slow.start ()
+		time.sleep (0.2)
+		self.assertEqual (get ('1 + 1'), {'math': ('2', '2', '2')})
+		self.assertEqual (requests.post (URL, {'idx': 1, 'mode': 'validate', 'text': 'x**2'}).json () ['nat'], 'x**2')
+		self.assertTrue (slow.is_alive ())
+		slow.join ()
+
+	def test_cancel (self):
+		def post (text, idx = 1):
+			return sess.post (URL, {'idx': idx, 'mode': 'evaluate', 'text': text}).json () ['data'] [0]
+
+		sess = requests.Session ()
+		sess.get (URL + 'env.js')
+		self.assertEqual (post ('x = 1') ['math'] [0] ['nat'], 'x = 1')
+		resp    = []
+		slow    = [threading.Thread (target = lambda: resp.append (post ('x = isprime (2**9689 - 1)', 7))) for _ in range (2)] # same input again while first still running
+		evals   = server._SESSIONS [sess.cookies [server._SESSION_COOKIE]].evals
+		timeout = time.time () + 10
+
+		for thread in slow:
+			thread.start ()
+
+		while (len (evals) < 2 or not any (e [1] for e in list (evals.values ()))) and time.time () < timeout: # one evaluating and one waiting for its turn
+			time.sleep (0.01)
+
+		self.assertEqual (sess.post (URL, {'idx': 7, 'mode': 'cancel'}).json (), {'idx': '7', 'cancelled': True, 'mode': 'cancel'})
+
+		for thread in slow:
+			thread.join ()
+
+		self.assertEqual (resp, [{'err': ['WorkerError: evaluation cancelled']}] * 2)
+		self.assertEqual (sess.post (URL, {'idx': 7, 'mode': 'cancel'}).json () ['cancelled'], False)
+		self.assertEqual (post ('x') ['math'] [0] ['nat'], '1')
+
+		server._EVAL_TIMEOUT [0] = 0.5
+		self.assertEqual (post ('x = isprime (2**9689 - 1)'), {'err': ['WorkerError: evaluation timed out after 0.5 seconds']})
+		server._EVAL_TIMEOUT [0] = None
+		self.assertEqual (post ('x + 1') ['math'] [0] ['nat'], '2')
+
+	def test_worker_fork (self):
+		if not server._ZYGOTE [0]:
+			self.skipTest ('fork not available')
+
+		reset () # default session
+		server._worker_put (server._worker_get ()) # zygote done warming up
+		start  = time.time ()
+		worker = server._Worker ()
+		self.assertLess (time.time () - start, 1)
+		delta, resp = pickle.loads (worker.evaluate (pickle.dumps (('test', 0, server._SESSIONS [None].eval_state (), '\\int x dx', None))))
+		self.assertEqual (resp ['data'] [0] ['math'] [0] ['nat'], 'x**2 / 2')
+		worker.kill ('test')
+		worker.close ()
+
+	def test_worker_killed_late (self): # kill after worker answered, as by cancel or timeout racing with end of evaluation
+		reset ()
+		worker      = []
+		data        = pickle.dumps (('test', 0, server._SESSIONS [None].eval_state (), '1 + 1', None))
+		delta, resp = pickle.loads (server._worker_evaluate (data, worker.append, lambda: worker [0].kill ('too late')))
+
+		self.assertEqual (resp ['data'] [0] ['math'] [0] ['nat'], '2')
+		self.assertEqual (worker [0].killed, 'too late')
+		self.assertNotIn (worker [0], server._WORKERS)
+		self.assertTrue (all (w.killed is None for w in server._WORKERS))
+
+	def test_worker_states (self): # session state stays in worker process, only changes come back
+		reset ()
+		sess = server._SESSIONS [None]
+		get ('x = 2')
+		rev  = sess.state_rev
+		self.assertTrue (any (w.states.get (sess.epoch) == rev for w in server._WORKERS))
+		self.assertEqual (get ('y = x + 1'), {'math': ('y = 3', 'y = 3', 'y = 3')})
+		self.assertEqual ((sess.state_rev, sess.vars ['y']), (rev + 1, ('#', '3')))
+
+		sess.state_rev                          = rev + 2 # server thinks a worker has current state but it doesn't
+		server._WORKERS [0].states [sess.epoch] = rev + 2
+		self.assertEqual (get ('y'), {'err': 'WorkerError: session state missing in evaluation process'})
+		self.assertEqual (get ('y'), {'math': ('3', '3', '3')})
+		reset ()
+
+	def test_worker_start_failed (self): # slot of worker which could not be replaced is kept and tried again on next use
+		def fail ():
+			raise OSError ('zygote gone')
+
+		reset ()
+		Worker, server._Worker = server._Worker, fail
+
+		try:
+			with self.assertRaises (server.WorkerError):
+				server._worker_evaluate (b'', lambda w: w.kill ('test'))
+
+			self.assertEqual ((len (server._WORKERS), server._WORKERS [-1]), (server._WORKERS_NUM, None))
+			workers = [server._worker_get () for _ in range (server._WORKERS_NUM - 1)]
+
+			with self.assertRaises (server.WorkerError):
+				server._worker_get ()
+
+			self.assertEqual (list (server._WORKERS), [None])
+
+		finally:
+			server._Worker = Worker
+
+		workers.append (server._worker_get ())
+
+		for worker in workers:
+			server._worker_put (worker)
+
+		self.assertNotIn (None, server._WORKERS)
+		self.assertEqual (get ('1 + 1'), {'math': ('2', '2', '2')})
+
+	def test_validate_superseded (self):
+		def post (subidx, sess = requests):
+			resp.append (sess.post (URL, {'idx': 1, 'mode': 'validate', 'subidx': subidx, 'text': f'x + {subidx}'}).json ())
+
+		def run (posts, key = None): # all wait for lock, until registered under key if given
+			threads = [threading.Thread (target = post, args = args) for args in posts]
+
+			with server._SESSION_LOCK:
+				for thread in threads:
+					thread.start ()
+
+				timeout = time.time () + 10
+
+				while key and server._VALIDATING.get (key, (0, 0)) [1] < len (threads) and time.time () < timeout:
+					time.sleep (0.01)
+
+				if not key: # requests without cookie are not registered anywhere, give them a moment to get to the lock
+					time.sleep (0.1)
+
+			for thread in threads:
+				thread.join ()
+
+			resp.sort (key = lambda r: r ['subidx'])
+
+		sess = requests.Session ()
+		sess.get (URL + 'env.js')
+		resp = []
+
+		run ([(subidx, sess) for subidx in (1, 2, 3)], (sess.cookies [server._SESSION_COOKIE], '1')) # only newest is parsed
+		self.assertEqual ([r.get ('superseded', False) for r in resp], [True, True, False])
+		self.assertEqual (resp [2] ['nat'], 'x + 3')
+
+		resp = []
+
+		run ([(1,), (2,)]) # clients without session cookie can't be told apart so don't supersede each other
+		self.assertEqual ([(r.get ('superseded', False), r ['nat']) for r in resp], [(False, 'x + 1'), (False, 'x + 2')])
+		self.assertEqual (server._VALIDATING, {})
+
+	def test_deep (self):
+		n    = 1500
+		resp = requests.post (URL, {'idx': 1, 'mode': 'evaluate', 'text': '(' * n + 'x + 1' + ')' * n}).json ()
+
+		self.assertEqual (resp ['data'], [{'math': [{'tex': 'x + 1', 'nat': 'x + 1', 'py': 'x + 1'}]}])
+
 	#...............................................................................................
 	# BEGIN UPDATE BLOCK
 	def test_vars (self):